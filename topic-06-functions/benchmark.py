@@ -0,0 +1,68 @@
+# performance measurements for the closure compiler, against the
+# evaluator where evaluator.py can be imported
+#
+# run all benchmarks with `python benchmark.py`, or a single one
+# by name, e.g. `python benchmark.py loop 1000000`
+
+import contextlib
+import os
+import sys
+import time
+
+import compiler
+from compiler import identifier, assign, binary, program
+
+
+def timed(function, *arguments):
+    start = time.perf_counter()
+    result = function(*arguments)
+    return result, time.perf_counter() - start
+
+
+# k = count; total = 0; while (k) { total = total + k * 2 - 1; k = k - 1; }
+def loop_program(count):
+    return program(
+        assign("k", count),
+        assign("total", 0),
+        {"type": "while", "condition": identifier("k"), "do": {"type": "block", "statements": [
+            assign("total", binary(identifier("total"), "+", binary(binary(identifier("k"), "*", 2), "-", 1))),
+            assign("k", binary(identifier("k"), "-", 1)),
+        ]}},
+        identifier("total"),
+    )
+
+
+def benchmark_loop(count=200000):
+    print("benchmark: loop")
+    ast = loop_program(count)
+    run, compile_time = timed(compiler.compile_node, ast)
+    result, run_time = timed(run)
+    assert result == count * count
+    print(f"  {count} iterations")
+    print(f"  compile       : {compile_time:8.6f} sec")
+    print(f"  run closures  : {run_time:8.3f} sec")
+    try:
+        import evaluator
+    except ImportError as e:
+        # evaluator.py imports parse from parser.py, which this topic's
+        # parser.py does not have yet
+        print(f"  evaluate      : not available ({e})")
+        return
+    # evaluate prints the environment on every assignment
+    with open(os.devnull, "w") as null, contextlib.redirect_stdout(null):
+        reference, evaluate_time = timed(evaluator.evaluate, ast)
+    assert reference == result
+    print(f"  evaluate      : {evaluate_time:8.3f} sec")
+    print(f"  speedup       : {evaluate_time / (compile_time + run_time):8.1f}x")
+
+
+benchmarks = {
+    "loop": benchmark_loop,
+}
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        benchmarks[sys.argv[1]](*[int(argument) for argument in sys.argv[2:]])
+    else:
+        for benchmark in benchmarks.values():
+            benchmark()
@@ -45,22 +45,52 @@ def number(s):
         return int(s)
 
 
-# simple list class to hold token buffer
+# token buffer that walks the token list with a cursor instead of
+# copying the rest of the list every time a token is discarded
 class List:
-    def __init__(this, tokens):
+    def __init__(this, tokens, position=0):
         assert type(tokens) is list
-        this.list = tokens
+        this.tokens = tokens
+        this.position = position
+
+    # the remaining (not yet discarded) tokens
+    @property
+    def list(this):
+        return this.tokens[this.position :]
+
+    @list.setter
+    def list(this, tokens):
+        assert type(tokens) is list
+        this.tokens = tokens
+        this.position = 0
 
     def current(this):
-        try:
-            return this.list[0]
-        except:
-            return None
+        return this.lookahead(0)
+
+    # the token k positions past the current one, or None past the end
+    def lookahead(this, k=1):
+        if k < 0:
+            raise Exception(f"Cannot look behind the current token (k={k})")
+        index = this.position + k
+        if index < len(this.tokens):
+            return this.tokens[index]
+        return None
 
     def discard(this, token=None):
         if token:
-            assert this.list[0] == token
-        this.list = this.list[1:]
+            assert this.tokens[this.position] == token
+        this.position += 1
+
+    # discard n tokens without checking them
+    def skip(this, n=1):
+        this.position += n
+
+    # remember the current position so that it can be restored by reset()
+    def mark(this):
+        return this.position
+
+    def reset(this, mark):
+        this.position = mark
 
 
 # The lex/tokenize function
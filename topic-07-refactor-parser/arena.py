@@ -0,0 +1,248 @@
+# an AST stored as columns of numbers instead of Python objects
+#
+# Nodes are numbered in the order the parser finishes them, so children
+# come before their parents. For each node the arena keeps its kind, its
+# operator code, and the slice of the children column holding its
+# fields. A field is a node id when it is zero or more, and a constant
+# (number, string, name or None) when it is negative: -1 - its index in
+# the constant table. Fields that hold lists, such as the statements of
+# a block, always come last and take up the rest of the slice.
+#
+# An arena is also a builder for parse(): `root = parse(tokens, arena)`
+# adds the whole program to the arena and returns the id of its root.
+# A million-node program is a few arrays, so the garbage collector has
+# almost nothing to traverse.
+
+from array import array
+
+from tokenizer import tokenize
+import parser
+
+# node kinds, and the dict keys of the fields of each kind in the order
+# they are stored. the last key of a kind with a list field is that list.
+kind_fields = [
+    ("unary", ["expression"]),
+    ("binary", ["left", "right"]),
+    ("reference", ["name", "indexes"]),
+    ("function_call", ["reference", "expressions"]),
+    ("array-expression", ["expressions"]),
+    ("expression-list", ["expressions"]),
+    ("block", ["statements"]),
+    ("if", ["condition", "then", "else"]),
+    ("while", ["condition", "do"]),
+    ("print", ["expression_list"]),
+    ("return", ["expression"]),
+    ("exit", ["expression"]),
+    ("function_declaraction", ["name", "block", "parameters"]),
+    ("assignment", ["reference", "expression"]),
+    ("program", ["statements"]),
+]
+kind_names = [name for name, fields in kind_fields]
+kind_codes = {name: code for code, name in enumerate(kind_names)}
+list_fields = {"indexes", "expressions", "statements", "parameters"}
+
+UNARY, BINARY, REFERENCE, FUNCTION_CALL, ARRAY_EXPRESSION, EXPRESSION_LIST = range(6)
+BLOCK, IF, WHILE, PRINT, RETURN, EXIT, FUNCTION_DECLARATION, ASSIGNMENT, PROGRAM = range(6, 15)
+
+# operator code 0 is for nodes without an operator
+operators = [None] + list(parser.binding_powers)
+operator_codes = {operator: code for code, operator in enumerate(operators)}
+
+
+class Arena:
+    def __init__(this):
+        this.kinds = array("B")
+        this.operators = array("B")
+        this.firsts = array("I")
+        this.counts = array("I")
+        this.children = array("i")
+        this.constants = []
+        this.constant_codes = {}
+
+    def __len__(this):
+        return len(this.kinds)
+
+    # the code of a constant field, which is always negative
+    def constant(this, value):
+        key = (type(value), value)
+        code = this.constant_codes.get(key)
+        if code == None:
+            this.constants.append(value)
+            code = this.constant_codes[key] = -len(this.constants)
+        return code
+
+    # add a node. an int field is already a node id or a constant code;
+    # anything else (a name or None) becomes a constant
+    def add(this, kind, fields, items=[], operator=None):
+        this.kinds.append(kind)
+        this.operators.append(operator_codes[operator])
+        this.firsts.append(len(this.children))
+        this.counts.append(len(fields) + len(items))
+        children = this.children
+        for value in fields:
+            children.append(value if type(value) is int else this.constant(value))
+        for value in items:
+            children.append(value if type(value) is int else this.constant(value))
+        return len(this.kinds) - 1
+
+    ### builder methods called by the parser
+
+    def unary(this, operator, expression):
+        return this.add(UNARY, [expression], operator=operator)
+
+    def binary(this, left, operator, right):
+        return this.add(BINARY, [left, right], operator=operator)
+
+    def reference(this, name, indexes):
+        return this.add(REFERENCE, [name], indexes)
+
+    def function_call(this, reference, expressions):
+        return this.add(FUNCTION_CALL, [reference], expressions)
+
+    def array_expression(this, expressions):
+        return this.add(ARRAY_EXPRESSION, [], expressions)
+
+    def expression_list(this, expressions):
+        return this.add(EXPRESSION_LIST, [], expressions)
+
+    def block(this, statements):
+        return this.add(BLOCK, [], statements)
+
+    def if_statement(this, condition, then_block, else_block):
+        return this.add(IF, [condition, then_block, else_block])
+
+    def while_statement(this, condition, do_block):
+        return this.add(WHILE, [condition, do_block])
+
+    def print_statement(this, expression_list):
+        return this.add(PRINT, [expression_list])
+
+    def return_statement(this, expression):
+        return this.add(RETURN, [expression])
+
+    def exit_statement(this, expression):
+        return this.add(EXIT, [expression])
+
+    def function_declaration(this, name, parameters, block):
+        return this.add(FUNCTION_DECLARATION, [name, block], parameters)
+
+    def assignment(this, reference, expression):
+        return this.add(ASSIGNMENT, [reference, expression])
+
+    def program(this, statements):
+        return this.add(PROGRAM, [], statements)
+
+    def function_body(this, tokens):
+        return parser.parse_block(tokens, this)
+
+    ### traversal
+
+    def kind(this, node):
+        return this.kinds[node]
+
+    def type(this, node):
+        return kind_names[this.kinds[node]]
+
+    def operator(this, node):
+        return operators[this.operators[node]]
+
+    # the fields of a node, as node ids and constant codes
+    def fields(this, node):
+        first = this.firsts[node]
+        return this.children[first : first + this.counts[node]]
+
+    # the k-th field of a node
+    def child(this, node, k):
+        return this.children[this.firsts[node] + k]
+
+    # the value of a field: the constant for a constant code, or the node id
+    def value(this, code):
+        if code < 0:
+            return this.constants[-1 - code]
+        return code
+
+    # the node ids of a subtree, parents before children, without recursion
+    def walk(this, root):
+        stack = [root]
+        while stack:
+            node = stack.pop()
+            yield node
+            first = this.firsts[node]
+            for code in reversed(this.children[first : first + this.counts[node]]):
+                if code >= 0:
+                    stack.append(code)
+
+    # the dict form of a field, as the parser would build it
+    def to_dict(this, code):
+        if code < 0:
+            return this.constants[-1 - code]
+        name, keys = kind_fields[this.kinds[code]]
+        node = {"type": name}
+        if this.operators[code]:
+            node["operator"] = operators[this.operators[code]]
+        fields = [this.to_dict(child) for child in this.fields(code)]
+        for i, key in enumerate(keys):
+            if key in list_fields:
+                node[key] = fields[i:]
+            else:
+                node[key] = fields[i]
+        if node.get("indexes", None) == []:
+            del node["indexes"]
+        return node
+
+
+def test_arena():
+    print("testing arena")
+    sources = [
+        "print(1+2); {print(3); print(4)}",
+        "x = [1, [2, 3], []]; y.z[x[0]].w = -f(x, \"a\", \"@b\", 2.5, 1)",
+        "if (x <= 1 == y) { print() } else { while (x) { x = x - 1 } }; if (1) {}",
+        "function add(a, b) { return (a + b) }; exit(add(1, 2) * -(3 / 4))",
+        "",
+    ]
+    for source in sources:
+        arena = Arena()
+        root = parser.parse(tokenize(source), arena)
+        assert arena.type(root) == "program"
+        assert arena.to_dict(root) == parser.parse(tokenize(source))
+    # constants are shared, and numbers are kept apart from equal strings
+    arena = Arena()
+    root = parser.parse(tokenize('x = 1; y = 1; z = "1"; w = 1.0'), arena)
+    assert arena.constants == ["@x", 1, "@y", "@z", "1", "@w", 1.0]
+    # several programs can share one arena
+    other = parser.parse(tokenize("x = 2"), arena)
+    assert arena.to_dict(other)["statements"][0]["expression"] == 2
+    assert arena.to_dict(root)["statements"][0]["expression"] == 1
+
+
+def test_walk():
+    print("testing arena walk")
+    arena = Arena()
+    root = parser.parse(tokenize("x = -(1 + y) * 2; print(x)"), arena)
+    types = [arena.type(node) for node in arena.walk(root)]
+    assert types == [
+        "program",
+        "assignment",
+        "reference",
+        "binary",
+        "unary",
+        "binary",
+        "reference",
+        "print",
+        "expression-list",
+        "reference",
+    ]
+    assignment = arena.child(root, 0)
+    multiply = arena.child(assignment, 1)
+    assert arena.kind(multiply) == BINARY and arena.operator(multiply) == "*"
+    assert arena.value(arena.child(multiply, 1)) == 2
+    assert arena.operator(arena.child(multiply, 0)) == "-"
+    # nested references, walked without recursion
+    root = parser.parse(tokenize("x" + "[y" * 200 + "]" * 200), arena)
+    assert sum(1 for node in arena.walk(root)) == 202
+
+
+if __name__ == "__main__":
+    test_arena()
+    test_walk()
+    print("done.")
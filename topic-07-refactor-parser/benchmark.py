@@ -0,0 +1,696 @@
+# performance measurements for the language system
+#
+# run all benchmarks with `python benchmark.py`, or a single one
+# by name, e.g. `python benchmark.py tokenize`
+
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import tokenizer
+import parser
+import token_store
+import parallel
+import stack_parser
+import nodes
+import cache
+import binary_ast
+import incremental
+import ll1
+import evaluator
+import bytecode
+import transpiler
+import tiered
+
+
+# a chunk of typical source text, repeated to build large programs
+sample = """
+// compute some values
+function add(x, y) { return (x + y) };
+total = 0;
+k = 100;
+while (k) {
+    total = add(total, k * 2.5);
+    values[k] = "item ""quoted"" text";
+    k = k - 1
+};
+if (total >= 1000) { print(total, values.length) } else { print(0) };
+"""
+
+
+def generate_source(copies):
+    return sample * copies
+
+
+def timed(function, *arguments):
+    start = time.perf_counter()
+    result = function(*arguments)
+    return result, time.perf_counter() - start
+
+
+def benchmark_tokenize(copies=500):
+    print("benchmark: tokenize")
+    source = generate_source(copies)
+    tokens, master_time = timed(tokenizer.tokenize, source)
+    count = len(tokens.list)
+    reference, reference_time = timed(tokenizer.tokenize_by_patterns, source)
+    assert reference.list == tokens.list
+    print(f"  {len(source)} characters, {count} tokens")
+    print(f"  pattern loop   : {count / reference_time:12.0f} tokens/sec")
+    print(f"  master pattern : {count / master_time:12.0f} tokens/sec")
+    print(f"  speedup        : {reference_time / master_time:12.1f}x")
+
+
+# the original token buffer, which copies the remaining list on every discard
+class SlicingList:
+    has_kinds = False
+
+    def __init__(this, tokens):
+        this.list = tokens
+
+    def current(this):
+        try:
+            return this.list[0]
+        except:
+            return None
+
+    def discard(this, token=None):
+        if token:
+            assert this.list[0] == token
+        this.list = this.list[1:]
+
+
+def benchmark_parse(copies=120):
+    print("benchmark: parse")
+    tokens = tokenizer.tokenize(generate_source(copies)).list
+    ast, cursor_time = timed(parser.parse, tokenizer.List(tokens))
+    reference, slicing_time = timed(parser.parse, SlicingList(tokens))
+    assert reference == ast
+    print(f"  {len(tokens)} tokens")
+    print(f"  slicing list : {slicing_time:8.3f} sec")
+    print(f"  cursor list  : {cursor_time:8.3f} sec")
+    print(f"  speedup      : {slicing_time / cursor_time:8.1f}x")
+
+
+# the old chain of precedence levels, one function per level, kept as
+# the reference that parser.parse_expression is timed against
+
+
+def parse_term(tokens):
+    """<term>     ::= <factor> { ('*' | '/') <factor> }"""
+    left_factor = parser.parse_factor(tokens)
+    while tokens.current() in ["*", "/"]:
+        operator = tokens.current()
+        tokens.discard(operator)
+        right_factor = parser.parse_factor(tokens)
+        left_factor = {
+            "type": "binary",
+            "left": left_factor,
+            "operator": operator,
+            "right": right_factor,
+        }
+    return left_factor
+
+
+def parse_sum(tokens):
+    """<sum>     ::= <term> { ('+' | '-') <term> }"""
+    left_term = parse_term(tokens)
+    while tokens.current() in ["+", "-"]:
+        operator = tokens.current()
+        tokens.discard(operator)
+        right_term = parse_term(tokens)
+        left_term = {
+            "type": "binary",
+            "left": left_term,
+            "operator": operator,
+            "right": right_term,
+        }
+    return left_term
+
+
+def benchmark_expressions(count=1000, operators=100):
+    print("benchmark: expressions")
+    import random
+
+    random.seed(1)
+    expressions = []
+    for i in range(count):
+        source = "x[1]"
+        for j in range(operators):
+            source += random.choice(["+", "-", "*", "/"]) + random.choice(["7", "x[1]", "f(y)"])
+        expressions.append(tokenizer.tokenize(source).list)
+
+    def parse_all(parse_expression):
+        return [parse_expression(tokenizer.List(tokens)) for tokens in expressions]
+
+    asts, pratt_time = timed(parse_all, parser.parse_expression)
+    reference, chain_time = timed(parse_all, parse_sum)
+    assert asts == reference
+    print(f"  {count} expressions of {operators} operators")
+    print(f"  precedence chain   : {chain_time:8.3f} sec")
+    print(f"  precedence climbing: {pratt_time:8.3f} sec")
+    print(f"  speedup            : {chain_time / pratt_time:8.1f}x")
+
+
+def benchmark_nesting(depth=10000):
+    print("benchmark: nesting")
+    sources = {
+        "blocks": "{" * depth + "}" * depth,
+        "parentheses": "x = " + "(" * depth + "1" + ")" * depth,
+        "if statements": "if (x) {" * depth + "}" * depth,
+    }
+    for name, source in sources.items():
+        tokens = tokenizer.tokenize(source).list
+        try:
+            ast, recursive_time = timed(parser.parse, tokenizer.List(tokens))
+            recursive = f"{recursive_time:8.3f} sec"
+        except RecursionError:
+            recursive = "RecursionError"
+        ast, stack_time = timed(stack_parser.parse, tokenizer.List(tokens))
+        print(f"  {depth} nested {name}: explicit stack {stack_time:8.3f} sec, recursive {recursive}")
+    tokens = tokenizer.tokenize(generate_source(120)).list
+    ast, recursive_time = timed(parser.parse, tokenizer.List(tokens))
+    reference, stack_time = timed(stack_parser.parse, tokenizer.List(tokens))
+    assert ast == reference
+    print(f"  typical program, {len(tokens)} tokens: explicit stack {stack_time:8.3f} sec, recursive {recursive_time:8.3f} sec")
+
+
+def benchmark_ll1(copies=120, depth=10000):
+    print("benchmark: ll1")
+    tokens = tokenizer.tokenize(generate_source(copies)).list
+    ast, recursive_time = timed(parser.parse, tokenizer.List(tokens))
+    reference, table_time = timed(ll1.parse, tokenizer.List(tokens))
+    assert ast == reference
+    print(f"  {len(tokens)} tokens")
+    print(f"  recursive descent: {recursive_time:8.3f} sec")
+    print(f"  ll(1) table      : {table_time:8.3f} sec")
+    print(f"  ratio            : {table_time / recursive_time:8.1f}x")
+    tokens = tokenizer.tokenize("x = " + "(" * depth + "1" + ")" * depth).list
+    ast, table_time = timed(ll1.parse, tokenizer.List(tokens))
+    print(f"  {depth} nested parentheses: ll(1) table {table_time:8.3f} sec")
+
+
+def benchmark_nodes(copies=1000):
+    print("benchmark: nodes")
+    import gc
+    import tracemalloc
+
+    tokens = tokenizer.tokenize(generate_source(copies)).list
+    results = {}
+    for name, builder in [("dicts", None), ("slotted nodes", nodes.NodeBuilder())]:
+        gc.collect()
+        tracemalloc.start()
+        start = time.perf_counter()
+        results[name] = parser.parse(tokenizer.List(tokens), builder)
+        parse_time = time.perf_counter() - start
+        memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        print(f"  {name:14}: {memory / 1024 / 1024:6.1f} MB, parse {parse_time:6.3f} sec")
+    assert nodes.to_dict(results["slotted nodes"]) == results["dicts"]
+    print(f"  {len(tokens)} tokens")
+
+
+def benchmark_arena(copies=15000):
+    print("benchmark: arena")
+    import gc
+    import arena
+
+    # the growth in resident memory while parsing, in a fresh interpreter
+    code = """
+import benchmark, parser, tokenizer, nodes, arena
+tokens = tokenizer.tokenize(benchmark.generate_source({copies}))
+def resident():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * 4096 / 1024 / 1024
+before = resident()
+ast = parser.parse(tokens, {builder})
+print(resident() - before)
+"""
+    # the builder in the fresh interpreter, and in this one
+    builders = {
+        "dicts": ("None", lambda: None),
+        "slotted nodes": ("nodes.NodeBuilder()", nodes.NodeBuilder),
+        "arena": ("arena.Arena()", arena.Arena),
+    }
+    tokens = tokenizer.tokenize(generate_source(copies)).tokens
+    for name, (expression, make_builder) in builders.items():
+        memory = float(run_python(code.format(copies=copies, builder=expression)))
+        builder = make_builder()
+        ast, parse_time = timed(parser.parse, tokenizer.List(tokens), builder)
+        gc.collect()
+        pause = min(timed(gc.collect)[1] for i in range(3))
+        print(f"  {name:14}: {memory:7.1f} MB RSS, parse {parse_time:6.2f} sec, full gc {1000 * pause:7.1f} ms")
+        del ast
+    columns = [builder.kinds, builder.operators, builder.firsts, builder.counts, builder.children]
+    size = sum(len(column) * column.itemsize for column in columns)
+    print(f"  {len(builder)} nodes, {len(tokens)} tokens, {size / 1024 / 1024:.1f} MB of arena columns")
+
+
+def benchmark_cache(copies=2000):
+    print("benchmark: cache")
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "program.t")
+        with open(path, "w") as f:
+            f.write(generate_source(copies))
+        cache_directory = os.path.join(directory, "cache")
+        ast, cold_time = timed(cache.load_program, path, cache_directory)
+        warm_times = [timed(cache.load_program, path, cache_directory)[1] for i in range(5)]
+        assert cache.load_program(path, cache_directory) == ast
+        size = sum(os.path.getsize(entry.path) for entry in os.scandir(cache_directory))
+        print(f"  {os.path.getsize(path) / 1024:.0f} KB script, {size / 1024:.0f} KB cache file")
+        print(f"  cold start (tokenize, parse, write): {cold_time:8.3f} sec")
+        print(f"  warm start (read, unmarshal)       : {min(warm_times):8.3f} sec")
+        print(f"  speedup                            : {cold_time / min(warm_times):8.1f}x")
+
+
+def benchmark_binary_ast(functions=5000):
+    print("benchmark: binary ast")
+    import json
+    import pickle
+
+    # a library of functions, of which a program calls three
+    library = ";".join(
+        f"function f{i}(x, y) {{ total = 0; while (x) {{ total = total + y[x] * {i}; x = x - 1 }}; return (total) }}"
+        for i in range(functions)
+    )
+    ast = parser.parse(tokenizer.tokenize(library + "; print(f1(3, a), f2(3, a), f3(3, a))"))
+    with tempfile.TemporaryDirectory() as directory:
+        paths = {name: os.path.join(directory, name) for name in ["json", "pickle", "binary"]}
+        with open(paths["json"], "w") as f:
+            json.dump(ast, f)
+        with open(paths["pickle"], "wb") as f:
+            pickle.dump(ast, f)
+        binary_ast.dump_file(ast, paths["binary"])
+
+        def load_json():
+            with open(paths["json"]) as f:
+                return json.load(f)
+
+        def load_pickle():
+            with open(paths["pickle"], "rb") as f:
+                return pickle.load(f)
+
+        def load_binary():
+            return binary_ast.materialize(binary_ast.load_file(paths["binary"]))
+
+        # visit only the call and the functions it calls
+        def load_binary_lazily():
+            program = binary_ast.load_file(paths["binary"])
+            statements = program["statements"]
+            visited = [binary_ast.materialize(statements[-1])]
+            for i in [1, 2, 3]:
+                visited.append(binary_ast.materialize(statements[i]))
+            return visited
+
+        print(f"  {functions} functions, 3 called")
+        for name, load in [
+            ("json", load_json),
+            ("pickle", load_pickle),
+            ("binary, all nodes", load_binary),
+            ("binary, lazy", load_binary_lazily),
+        ]:
+            result, load_time = min((timed(load) for i in range(3)), key=lambda pair: pair[1])
+            path = paths[name.split(",")[0]]
+            print(f"  {name:18}: {os.path.getsize(path) / 1024:7.0f} KB, load {1000 * load_time:8.1f} ms")
+        assert load_binary() == ast
+
+
+def benchmark_lazy(functions=2000):
+    print("benchmark: lazy")
+    # a library of functions, of which a program calls three
+    library = ";".join(
+        f"function f{i}(x, y) {{ total = 0; while (x) {{ total = total + y[x] * {i}; x = x - 1 }}; return (total) }}"
+        for i in range(functions)
+    )
+    tokens = tokenizer.tokenize(library + "; print(f1(3, a), f2(3, a), f3(3, a))").tokens
+    eager, eager_time = timed(parser.parse, tokenizer.List(tokens))
+    lazy, lazy_time = timed(parser.parse, tokenizer.List(tokens), None, True)
+
+    def use_called_functions():
+        return [lazy["statements"][i]["block"]["statements"] for i in [1, 2, 3]]
+
+    used, use_time = timed(use_called_functions)
+    assert lazy == eager
+    print(f"  {functions} functions, 3 called, {len(tokens)} tokens")
+    print(f"  eager parse                      : {eager_time:8.3f} sec")
+    print(f"  lazy parse                       : {lazy_time:8.3f} sec")
+    print(f"  then parse the 3 called functions: {use_time:8.3f} sec")
+
+
+def benchmark_reparse(copies=1000):
+    print("benchmark: reparse")
+    source = generate_source(copies)
+    document, full_time = timed(incremental.Document, source)
+    print(f"  {len(document.statements)} statements, {len(document.store)} tokens, full parse {full_time:.3f} sec")
+    # type a number in the middle, one digit per edit, then delete it
+    offset = source.index("total = 0", len(source) // 2) + len("total = 0")
+    times = []
+    for i, digit in enumerate("123456789"):
+        times.append(timed(document.edit, offset + i, 0, digit)[1])
+    for i in range(9):
+        times.append(timed(document.edit, offset, 1, "")[1])
+    assert document.source == source
+    assert document.program == parser.parse(tokenizer.tokenize(source))
+    print(f"  one-character edit: {1000 * sum(times) / len(times):.3f} ms average, {1000 * max(times):.3f} ms worst")
+
+
+def benchmark_parallel_parse(functions=20000):
+    print("benchmark: parallel parse")
+    library = ";".join(
+        f"function f{i}(x, y) {{ total = 0; while (x) {{ total = total + y[x] * {i}; x = x - 1 }}; return (total) }}"
+        for i in range(functions)
+    )
+    tokens = tokenizer.tokenize(library).tokens
+    expected, serial_time = timed(parser.parse, tokenizer.List(tokens))
+    print(f"  {functions} functions, {len(tokens)} tokens, {os.cpu_count()} cpus")
+    print(f"  serial    : {serial_time:6.2f} sec")
+    for workers in [1, 2, 4, 8]:
+        ast, parallel_time = timed(parallel.parse_parallel, tokens, workers)
+        assert ast == expected
+        print(f"  {workers} workers : {parallel_time:6.2f} sec, {serial_time / parallel_time:4.1f}x")
+
+
+def benchmark_token_store(copies=200):
+    print("benchmark: token store")
+    import tracemalloc
+
+    source = generate_source(copies)
+    tracemalloc.start()
+    tokens = tokenizer.tokenize(source)
+    list_memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    tracemalloc.start()
+    store = token_store.store_tokens(source)
+    store_memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    count = len(store)
+    print(f"  {count} tokens")
+    print(f"  token list  : {list_memory / count:6.1f} bytes/token")
+    print(f"  token store : {store_memory / count:6.1f} bytes/token (with offsets)")
+    ast, list_time = timed(parser.parse, tokens)
+    reference, store_time = timed(parser.parse, token_store.StoreList(store))
+    assert ast == reference
+    print(f"  parse list  : {list_time:8.3f} sec")
+    print(f"  parse store : {store_time:8.3f} sec")
+
+
+def benchmark_keywords(copies=2000):
+    print("benchmark: keywords")
+    import re
+
+    # identifier-heavy code with names that start with keywords
+    source = "printer = iffy + elsewhere * whiled; result = printer - iffy;\n" * copies
+    # the previous pattern list, with a regex per keyword before identifiers
+    keyword_patterns = [[word, token] for word, token in tokenizer.keywords.items()]
+    patterns = tokenizer.patterns[:2] + keyword_patterns + tokenizer.patterns[2:]
+    keyword_pattern = re.compile(
+        "|".join(f"(?P<t{i}>{regex})" for i, (regex, token) in enumerate(patterns))
+    )
+
+    def tokenize_keyword_patterns(characters):
+        tokens = []
+        for match in keyword_pattern.finditer(characters + "\n"):
+            token = patterns[int(match.lastgroup[1:])][1]
+            if token != None:
+                tokens.append(tokenizer.make_token(token, match.group(0)))
+        return tokens
+
+    tokens, table_time = timed(tokenizer.tokenize, source)
+    old_tokens, pattern_time = timed(tokenize_keyword_patterns, source)
+    print(f"  {len(tokens.list)} tokens with the keyword table")
+    print(f"  {len(old_tokens)} tokens with keyword patterns (identifiers split)")
+    print(f"  keyword patterns : {pattern_time:8.3f} sec")
+    print(f"  keyword table    : {table_time:8.3f} sec")
+
+
+def benchmark_edit(lines=100000):
+    print("benchmark: edit")
+    source = "x = x + 1; values[i] = \"item\"; // counter\n" * lines
+    store, full_time = timed(token_store.store_tokens, source)
+    print(f"  {lines} lines, {len(store)} tokens, full tokenize {full_time:.3f} sec")
+    # type an identifier in the middle, one character per edit
+    offset = source.index("\n", len(source) // 2) + 1
+    times = []
+    for i, character in enumerate("counter = 12"):
+        start = time.perf_counter()
+        store.edit(offset + i, 0, character)
+        times.append(time.perf_counter() - start)
+    # then delete it again, one character per edit
+    for i in range(len("counter = 12")):
+        start = time.perf_counter()
+        store.edit(offset, 1, "")
+        times.append(time.perf_counter() - start)
+    assert store.source == source
+    print(f"  one-character edit: {1000 * sum(times) / len(times):.3f} ms average, {1000 * max(times):.3f} ms worst")
+
+
+# programs for the execution benchmarks
+loop_source = """
+k = 0; total = 0;
+while (k < %d) { total = total + k * 2 - k / 4; k = k + 1 };
+exit(total)
+"""
+
+sort_source = """
+function sort(a) {
+    if (a.length < 2) { return (a) };
+    pivot = a[0]; lower = []; greater = []; i = 1;
+    while (i < a.length) {
+        if (a[i] < pivot) { lower[lower.length] = a[i] } else { greater[greater.length] = a[i] };
+        i = i + 1
+    };
+    return (sort(lower) + [pivot] + sort(greater))
+};
+exit(sort(%s))
+"""
+
+fib_source = """
+function fib(n) { if (n < 2) { return (n) }; return (fib(n - 1) + fib(n - 2)) };
+exit(fib(%d))
+"""
+
+
+array_source = """
+n = %d; a = []; i = 0;
+while (i < n) { a[i] = n - i; i = i + 1 };
+i = 0; j = n - 1;
+while (i < j) { t = a[i]; a[i] = a[j]; a[j] = t; i = i + 1; j = j - 1 };
+grid = []; i = 0;
+while (i < 300) { row = []; j = 0; while (j < 300) { row[j] = i * j; j = j + 1 }; grid[i] = row; i = i + 1 };
+total = 0; i = 0;
+while (i < grid.length) { j = 0; while (j < grid[i].length) { total = total + grid[i][j]; j = j + 1 }; i = i + 1 };
+exit(total + a[0] + a[n - 1] + a.length)
+"""
+
+
+def benchmark_evaluate(count=300000, size=100000, n=22):
+    print("benchmark: evaluate")
+    import random
+
+    random.seed(1)
+    numbers = [random.randrange(1000000) for i in range(size // 5)]
+    for name, source in [
+        (f"loop of {count}", loop_source % count),
+        (f"arrays of {size}", array_source % size),
+        (f"fib({n})", fib_source % n),
+        (f"quicksort of {size // 5}", sort_source % numbers),
+    ]:
+        ast = parser.parse(tokenizer.tokenize(source))
+        result, evaluate_time = timed(evaluator.evaluate, ast)
+        print(f"  {name:18}: {evaluate_time:8.3f} sec")
+
+
+def benchmark_vm(count=300000, size=20000, n=22):
+    print("benchmark: vm")
+    import random
+
+    random.seed(1)
+    numbers = [random.randrange(1000000) for i in range(size)]
+    for name, source in [
+        (f"loop of {count}", loop_source % count),
+        (f"quicksort of {size}", sort_source % numbers),
+        (f"fib({n})", fib_source % n),
+    ]:
+        ast = parser.parse(tokenizer.tokenize(source))
+        result, evaluate_time = timed(evaluator.evaluate, ast)
+        code, compile_time = timed(bytecode.compile_program, ast)
+        reference, run_time = timed(bytecode.run, code)
+        assert result == reference
+        print(f"  {name}:")
+        print(f"    evaluate   : {evaluate_time:8.3f} sec")
+        print(f"    compile    : {compile_time:8.3f} sec")
+        print(f"    vm         : {run_time:8.3f} sec")
+        print(f"    speedup    : {evaluate_time / (compile_time + run_time):8.1f}x")
+
+
+def benchmark_transpile(count=300000, size=20000, n=22):
+    print("benchmark: transpile")
+    import random
+
+    random.seed(1)
+    numbers = [random.randrange(1000000) for i in range(size)]
+    with tempfile.TemporaryDirectory() as directory:
+        for name, source in [
+            (f"loop of {count}", loop_source % count),
+            (f"quicksort of {size}", sort_source % numbers),
+            (f"fib({n})", fib_source % n),
+        ]:
+            path = os.path.join(directory, "program.t")
+            with open(path, "w") as f:
+                f.write(source)
+            ast = parser.parse(tokenizer.tokenize(source))
+            result, evaluate_time = timed(evaluator.evaluate, ast)
+            module, cold_time = timed(transpiler.load_module, path, directory)
+            module, warm_time = timed(transpiler.load_module, path, directory)
+            reference, run_time = timed(transpiler.run_module, module)
+            assert result == reference
+            print(f"  {name}:")
+            print(f"    evaluate        : {evaluate_time:8.3f} sec")
+            print(f"    cold transpile  : {cold_time:8.3f} sec")
+            print(f"    cached module   : {warm_time:8.3f} sec")
+            print(f"    run module      : {run_time:8.3f} sec")
+            print(f"    speedup, cached : {evaluate_time / (warm_time + run_time):8.1f}x")
+
+
+def benchmark_tiered(count=300000, size=20000, n=22):
+    print("benchmark: tiered")
+    import random
+
+    random.seed(1)
+    numbers = [random.randrange(1000000) for i in range(size)]
+    for name, source in [
+        (f"loop of {count}", loop_source % count),
+        (f"quicksort of {size}", sort_source % numbers),
+        (f"fib({n})", fib_source % n),
+    ]:
+        ast = parser.parse(tokenizer.tokenize(source))
+        result, evaluate_time = timed(evaluator.evaluate, ast)
+        tiers = tiered.TieredEvaluator()
+        reference, tiered_time = timed(tiers.evaluate, ast)
+        assert result == reference
+        print(f"  {name}:")
+        print(f"    evaluate   : {evaluate_time:8.3f} sec")
+        print(f"    tiered     : {tiered_time:8.3f} sec")
+        print(f"    speedup    : {evaluate_time / tiered_time:8.1f}x")
+        for line in tiers.report().split("\n"):
+            print(f"    {line}")
+
+
+# run code in a fresh interpreter and return what it prints
+def run_python(code):
+    return subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+
+
+def peak_memory(code):
+    # run code in a fresh interpreter and return its peak RSS in megabytes
+    code = code + "\nimport resource\nprint(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)"
+    return int(run_python(code).split()[-1]) / 1024
+
+
+def benchmark_stream(*megabytes):
+    print("benchmark: stream")
+    megabytes = megabytes or (1, 4, 16)
+    with tempfile.TemporaryDirectory() as directory:
+        for size in megabytes:
+            path = os.path.join(directory, "input.t")
+            with open(path, "w") as f:
+                while f.tell() < size * 1024 * 1024:
+                    f.write(generate_source(100))
+            stream_code = f"""
+from tokenizer import generate_tokens
+with open({path!r}) as f:
+    count = sum(1 for token in generate_tokens(f))
+"""
+            read_code = f"""
+from tokenizer import tokenize
+with open({path!r}) as f:
+    count = len(tokenize(f.read()).list)
+"""
+            start = time.perf_counter()
+            stream_memory = peak_memory(stream_code)
+            stream_time = time.perf_counter() - start
+            line = f"  {size:6d} MB: streaming {stream_memory:8.1f} MB RSS ({stream_time:.1f} sec)"
+            if size <= 64:
+                line += f", whole file {peak_memory(read_code):8.1f} MB RSS"
+            print(line)
+
+
+def benchmark_mmap(megabytes=16):
+    print("benchmark: mmap")
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "input.t")
+        with open(path, "w") as f:
+            while f.tell() < megabytes * 1024 * 1024:
+                f.write(generate_source(100))
+        codes = {
+            "read and decode": f"""
+from tokenizer import tokenize
+with open({path!r}) as f:
+    count = len(tokenize(f.read()).list)
+""",
+            "memory-mapped": f"""
+from tokenizer import tokenize_mapped_file
+count = len(tokenize_mapped_file({path!r}).list)
+""",
+        }
+        print(f"  {megabytes} MB input")
+        for name, code in codes.items():
+            start = time.perf_counter()
+            memory = peak_memory(code)
+            print(f"  {name:16}: {time.perf_counter() - start:6.2f} sec, {memory:8.1f} MB RSS")
+
+
+def benchmark_parallel(megabytes=8):
+    print("benchmark: parallel")
+    source = generate_source(1)
+    source = source * (megabytes * 1024 * 1024 // len(source))
+    expected, serial_time = timed(token_store.store_tokens, source)
+    print(f"  {megabytes} MB, {len(expected)} tokens, {os.cpu_count()} cpus")
+    print(f"  serial    : {serial_time:6.2f} sec")
+    for workers in [1, 2, 4, 8]:
+        store, parallel_time = timed(parallel.store_tokens_parallel, source, workers)
+        assert store.tokens() == expected.tokens()
+        print(f"  {workers} workers : {parallel_time:6.2f} sec, {serial_time / parallel_time:4.1f}x")
+
+
+benchmarks = {
+    "tokenize": benchmark_tokenize,
+    "parse": benchmark_parse,
+    "expressions": benchmark_expressions,
+    "nesting": benchmark_nesting,
+    "ll1": benchmark_ll1,
+    "nodes": benchmark_nodes,
+    "arena": benchmark_arena,
+    "cache": benchmark_cache,
+    "binary-ast": benchmark_binary_ast,
+    "lazy": benchmark_lazy,
+    "reparse": benchmark_reparse,
+    "stream": benchmark_stream,
+    "token-store": benchmark_token_store,
+    "keywords": benchmark_keywords,
+    "edit": benchmark_edit,
+    "mmap": benchmark_mmap,
+    "parallel": benchmark_parallel,
+    "parallel-parse": benchmark_parallel_parse,
+    "evaluate": benchmark_evaluate,
+    "vm": benchmark_vm,
+    "transpile": benchmark_transpile,
+    "tiered": benchmark_tiered,
+}
+
+# extra arguments are passed to the benchmark as integers, e.g.
+# `python benchmark.py stream 1024` streams a 1 GB input
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        benchmarks[sys.argv[1]](*[int(argument) for argument in sys.argv[2:]])
+    else:
+        for benchmark in benchmarks.values():
+            benchmark()
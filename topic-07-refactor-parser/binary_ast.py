@@ -0,0 +1,309 @@
+# a compact, versioned binary file format for parsed programs
+#
+# Layout, with all fixed-size numbers little-endian:
+#
+#   header   magic "TAST", format version (1 byte), then four uint32:
+#            string table offset, node index offset, node count, root node
+#   nodes    one record per node, children before parents
+#   strings  varint count, then each string as varint length + UTF-8
+#   index    uint32 file offset of each node record
+#
+# A node record is the varint kind code followed by its fields in the
+# order given by node_keys. Each field is a varint tag and its payload:
+# a zigzag varint for ints, 8 bytes for floats, a string table index for
+# strings and names, a node number for child nodes, and a count followed
+# by the items for lists.
+#
+# load_file() memory-maps a file and returns the root as a LazyNode. A
+# LazyNode acts as a dict and decodes its record the first time it is
+# used, so only the subtrees a program actually visits (for example the
+# bodies of the functions that are called) are ever read. materialize()
+# gives a tree of plain dicts, for code such as json that needs them.
+
+import mmap
+import os
+import struct
+import sys
+
+from tokenizer import tokenize
+from parser import parse, LazyDict, dict_types, materialize
+
+magic = b"TAST"
+format_version = 1
+header = struct.Struct("<4sBIIII")
+
+# the fields of each kind of node, in the order they are stored
+node_keys = {
+    "unary": ["operator", "expression"],
+    "binary": ["left", "operator", "right"],
+    "reference": ["name", "indexes"],
+    "function_call": ["reference", "expressions"],
+    "array-expression": ["expressions"],
+    "expression-list": ["expressions"],
+    "block": ["statements"],
+    "if": ["condition", "then", "else"],
+    "while": ["condition", "do"],
+    "print": ["expression_list"],
+    "return": ["expression"],
+    "exit": ["expression"],
+    "function_declaraction": ["name", "parameters", "block"],
+    "assignment": ["reference", "expression"],
+    "program": ["statements"],
+}
+kinds = list(node_keys)
+kind_codes = {kind: code for code, kind in enumerate(kinds)}
+
+# field tags; ABSENT is a field the node does not have, such as the
+# indexes of a plain reference
+NONE, INT, FLOAT, STRING, NODE, LIST, ABSENT = range(7)
+
+
+def write_varint(out, n):
+    while n >= 0x80:
+        out.append((n & 0x7F) | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def read_varint(data, pos):
+    n = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        n |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return n, pos
+        shift += 7
+
+
+def dumps(ast):
+    strings = []
+    string_codes = {}
+    records = bytearray()
+    offsets = []
+
+    def encode_value(value, out):
+        if value == None:
+            out.append(NONE)
+        elif type(value) is int:
+            out.append(INT)
+            write_varint(out, value * 2 if value >= 0 else -value * 2 - 1)
+        elif type(value) is float:
+            out.append(FLOAT)
+            out += struct.pack("<d", value)
+        elif type(value) is str:
+            if value not in string_codes:
+                string_codes[value] = len(strings)
+                strings.append(value)
+            out.append(STRING)
+            write_varint(out, string_codes[value])
+        elif type(value) is list:
+            out.append(LIST)
+            write_varint(out, len(value))
+            for item in value:
+                encode_value(item, out)
+        else:
+            out.append(NODE)
+            write_varint(out, encode_node(value))
+
+    # write a node record after those of its children; returns its number
+    def encode_node(node):
+        keys = node_keys[node["type"]]
+        assert len(node) - 1 <= len(keys), f"Unexpected fields in {node['type']} node"
+        out = bytearray()
+        write_varint(out, kind_codes[node["type"]])
+        for key in keys:
+            if key in node:
+                encode_value(node[key], out)
+            else:
+                out.append(ABSENT)
+        offsets.append(header.size + len(records))
+        records.extend(out)
+        return len(offsets) - 1
+
+    root = encode_node(ast)
+    table = bytearray()
+    write_varint(table, len(strings))
+    for string in strings:
+        encoded = string.encode("utf-8")
+        write_varint(table, len(encoded))
+        table += encoded
+    string_offset = header.size + len(records)
+    index_offset = string_offset + len(table)
+    index = struct.pack(f"<{len(offsets)}I", *offsets)
+    start = header.pack(magic, format_version, string_offset, index_offset, len(offsets), root)
+    return start + bytes(records) + bytes(table) + index
+
+
+def dump_file(ast, path):
+    with open(path, "wb") as f:
+        f.write(dumps(ast))
+
+
+# reads nodes on demand from the bytes (or memory map) of a binary AST
+class Reader:
+    def __init__(this, data):
+        assert len(data) >= header.size and data[:4] == magic, "Not a binary AST"
+        fields = header.unpack_from(data, 0)
+        assert fields[1] == format_version, f"Unsupported binary AST version {fields[1]}"
+        this.data = data
+        string_offset, this.index_offset, this.count, this.root = fields[2:]
+        this.strings = []
+        count, pos = read_varint(data, string_offset)
+        for i in range(count):
+            length, pos = read_varint(data, pos)
+            this.strings.append(sys.intern(str(data[pos : pos + length], "utf-8")))
+            pos += length
+        this.materialized = 0
+
+    def node(this, number):
+        assert 0 <= number < this.count, f"Bad node number {number}"
+        return LazyNode(this, number)
+
+    def decode_value(this, pos):
+        data = this.data
+        tag = data[pos]
+        pos += 1
+        if tag == NODE:
+            number, pos = read_varint(data, pos)
+            return this.node(number), pos
+        if tag == STRING:
+            code, pos = read_varint(data, pos)
+            return this.strings[code], pos
+        if tag == INT:
+            n, pos = read_varint(data, pos)
+            return (n >> 1) ^ -(n & 1), pos
+        if tag == LIST:
+            count, pos = read_varint(data, pos)
+            items = []
+            for i in range(count):
+                item, pos = this.decode_value(pos)
+                items.append(item)
+            return items, pos
+        if tag == NONE:
+            return None, pos
+        if tag == FLOAT:
+            return struct.unpack_from("<d", data, pos)[0], pos + 8
+        assert False, f"Bad field tag {tag}"
+
+    # the fields of a node, with its child nodes left undecoded
+    def fields(this, number):
+        (pos,) = struct.unpack_from("<I", this.data, this.index_offset + 4 * number)
+        code, pos = read_varint(this.data, pos)
+        kind = kinds[code]
+        fields = {"type": kind}
+        for key in node_keys[kind]:
+            if this.data[pos] == ABSENT:
+                pos += 1
+            else:
+                fields[key], pos = this.decode_value(pos)
+        this.materialized += 1
+        return fields
+
+
+# a node that fills itself from its record on first use
+class LazyNode(LazyDict):
+    __slots__ = ("reader", "number")
+
+    def __init__(this, reader, number):
+        this.contents = None
+        this.reader = reader
+        this.number = number
+
+    def load(this):
+        fields = this.reader.fields(this.number)
+        this.reader = None
+        return fields
+
+
+def loads(data):
+    reader = Reader(data)
+    return reader.node(reader.root)
+
+
+def load_file(path):
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size < header.size:
+            # too short to map (mmap rejects an empty file); Reader says why
+            data = f.read()
+        else:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return loads(data)
+
+
+sources = [
+    "print(1+2); {print(3); print(4)}",
+    'x = [1, [2, 3], []]; y.z[x[0]].w = -f(x, "a", "", "café", 2.5, -7, 300000000000)',
+    "if (x <= 1 == y) { print() } else { while (x) { x = x - 1 } }; if (1) {}",
+    "function add(a, b) { return (a + b) }; exit(add(1, 2) * -(3 / 4))",
+    "",
+]
+
+
+def test_round_trip():
+    print("testing binary ast round trip")
+    import json
+
+    for source in sources:
+        ast = parse(tokenize(source))
+        data = dumps(ast)
+        assert loads(data) == ast
+        assert materialize(loads(data)) == ast
+        assert type(materialize(loads(data))) is dict
+        assert repr(loads(data)) == repr(ast)
+        assert json.loads(json.dumps(materialize(loads(data)))) == ast
+        try:
+            json.dumps(loads(data))
+            raise Exception("An error was expected.")
+        except TypeError:
+            pass
+    for n in [0, 1, -1, 63, -64, 127, 128, 2**40, -(2**40)]:
+        ast = {"type": "return", "expression": n}
+        assert materialize(loads(dumps(ast))) == ast
+    try:
+        loads(b"TAST" + bytes([format_version + 1]) + bytes(16))
+        raise Exception("An error was expected.")
+    except AssertionError:
+        pass
+    # empty and truncated files get the format's own error
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "bad.tast")
+        for data in [b"", dumps(parse(tokenize(sources[0])))[:10]]:
+            with open(path, "wb") as f:
+                f.write(data)
+            try:
+                load_file(path)
+                raise Exception("An error was expected.")
+            except AssertionError as error:
+                assert str(error).startswith("Not a binary AST")
+
+
+def test_lazy_loading():
+    print("testing lazy loading")
+    import tempfile
+
+    source = ";".join(f"function f{i}(x) {{ return (x * {i} + 1) }}" for i in range(100))
+    ast = parse(tokenize(source + "; print(f7(2))"))
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "program.tast")
+        dump_file(ast, path)
+        program = load_file(path)
+        reader = program.reader
+        statements = program["statements"]
+        assert reader.materialized == 1 and len(statements) == 101
+        # only the called function's body is read
+        function = statements[7]
+        assert function["name"] == "@f7" and function["parameters"] == ["@x"]
+        assert function["block"] == ast["statements"][7]["block"]
+        assert reader.materialized < 15
+        assert program == ast
+        assert reader.materialized == reader.count
+
+
+if __name__ == "__main__":
+    test_round_trip()
+    test_lazy_loading()
+    print("done.")
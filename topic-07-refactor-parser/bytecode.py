@@ -0,0 +1,543 @@
+# a stack bytecode compiler and virtual machine
+#
+# compile_program() turns the AST into a Code object: an array of
+# instructions, each an opcode followed by one argument, with a pool of
+# constants and a table of names that the arguments refer to. Every
+# function declaration becomes its own Code object in the constant pool.
+#
+# In a function, the parameters and the names the function assigns are
+# locals, kept in a list of slots instead of a dict. A local slot that
+# has not been assigned yet falls back to the global of the same name,
+# as in the evaluator. Top-level code uses only globals.
+#
+# run() executes a Code object with one operand stack. Calls push a frame
+# on a list instead of recursing in Python, so the depth of recursion is
+# limited only by memory.
+
+from array import array
+
+from tokenizer import tokenize
+from parser import parse, dict_types
+from evaluator import get_index, set_index
+
+# the opcodes, in order of their codes
+opcodes = [
+    "HALT",
+    "CONST",
+    "LOAD_LOCAL",
+    "STORE_LOCAL",
+    "LOAD_GLOBAL",
+    "STORE_GLOBAL",
+    "GET_INDEX",
+    "SET_INDEX",
+    "GET_FIELD",
+    "SET_FIELD",
+    "ADD",
+    "SUBTRACT",
+    "MULTIPLY",
+    "DIVIDE",
+    "EQUAL",
+    "NOT_EQUAL",
+    "LESS",
+    "LESS_EQUAL",
+    "GREATER",
+    "GREATER_EQUAL",
+    "NEGATE",
+    "JUMP",
+    "JUMP_IF_FALSE",
+    "CALL",
+    "RETURN",
+    "EXIT",
+    "ARRAY",
+    "PRINT",
+    "POP",
+]
+HALT, CONST, LOAD_LOCAL, STORE_LOCAL, LOAD_GLOBAL, STORE_GLOBAL = range(6)
+GET_INDEX, SET_INDEX, GET_FIELD, SET_FIELD = range(6, 10)
+ADD, SUBTRACT, MULTIPLY, DIVIDE = range(10, 14)
+EQUAL, NOT_EQUAL, LESS, LESS_EQUAL, GREATER, GREATER_EQUAL, NEGATE = range(14, 21)
+JUMP, JUMP_IF_FALSE, CALL, RETURN, EXIT, ARRAY, PRINT, POP = range(21, 29)
+
+binary_opcodes = {
+    "+": ADD,
+    "-": SUBTRACT,
+    "*": MULTIPLY,
+    "/": DIVIDE,
+    "==": EQUAL,
+    "!=": NOT_EQUAL,
+    "<": LESS,
+    "<=": LESS_EQUAL,
+    ">": GREATER,
+    ">=": GREATER_EQUAL,
+}
+
+statement_types = {
+    "program",
+    "block",
+    "if",
+    "while",
+    "print",
+    "return",
+    "exit",
+    "function_declaraction",
+    "assignment",
+}
+
+
+# the value of a local slot that has not been assigned
+class Unset:
+    def __repr__(this):
+        return "UNSET"
+
+
+UNSET = Unset()
+
+
+class Code:
+    def __init__(this, name, parameters=None, local_names=None):
+        this.name = name
+        this.ops = array("i")
+        # set by finish()
+        this.words = None
+        this.constants = []
+        this.constant_codes = {}
+        this.names = []
+        this.name_codes = {}
+        # None for top-level code
+        this.local_names = local_names
+        this.parameter_count = len(parameters) if parameters != None else 0
+        if local_names != None:
+            this.local_codes = {name: i for i, name in enumerate(local_names)}
+            # the global each local slot falls back to
+            this.fallbacks = [this.add_name(name) for name in local_names]
+
+    def __repr__(this):
+        return f"<code {this.name}>"
+
+    def add_constant(this, value):
+        key = (type(value), value)
+        if key not in this.constant_codes:
+            this.constant_codes[key] = len(this.constants)
+            this.constants.append(value)
+        return this.constant_codes[key]
+
+    def add_name(this, name):
+        if name not in this.name_codes:
+            this.name_codes[name] = len(this.names)
+            this.names.append(name)
+        return this.name_codes[name]
+
+    # append an instruction; returns the position of its argument, for
+    # jumps that are patched later
+    def emit(this, op, argument=0):
+        this.ops.append(op)
+        this.ops.append(argument)
+        return len(this.ops) - 1
+
+    def patch(this, position, target):
+        this.ops[position] = target
+
+    # the instructions as a list, which is faster to index than an array
+    def finish(this):
+        this.words = this.ops.tolist()
+
+
+# a function value made from a declaration
+class CompiledFunction:
+    def __init__(this, code):
+        this.code = code
+
+    def __repr__(this):
+        return f"<function {this.code.name[1:]}>"
+
+
+def is_field(index):
+    return type(index) is str and index[0] == "@"
+
+
+# the names a function body assigns, not counting nested function bodies
+def assigned_names(statements, names):
+    for statement in statements:
+        if not isinstance(statement, dict_types):
+            continue
+        t = statement["type"]
+        if t == "assignment" and "indexes" not in statement["reference"]:
+            names.append(statement["reference"]["name"])
+        elif t == "function_declaraction":
+            names.append(statement["name"])
+        elif t == "block":
+            assigned_names(statement["statements"], names)
+        elif t == "if":
+            assigned_names([statement["then"], statement["else"]], names)
+        elif t == "while":
+            assigned_names([statement["do"]], names)
+    return names
+
+
+class Compiler:
+    def __init__(this, code):
+        this.code = code
+
+    def load(this, name):
+        code = this.code
+        if code.local_names != None and name in code.local_codes:
+            code.emit(LOAD_LOCAL, code.local_codes[name])
+        else:
+            code.emit(LOAD_GLOBAL, code.add_name(name))
+
+    def store(this, name):
+        code = this.code
+        if code.local_names != None:
+            code.emit(STORE_LOCAL, code.local_codes[name])
+        else:
+            code.emit(STORE_GLOBAL, code.add_name(name))
+
+    def index(this, index):
+        if is_field(index):
+            this.code.emit(GET_FIELD, this.code.add_name(index))
+        else:
+            this.expression(index)
+            this.code.emit(GET_INDEX)
+
+    def expression(this, node):
+        code = this.code
+        if not isinstance(node, dict_types):
+            code.emit(CONST, code.add_constant(node))
+            return
+        t = node["type"]
+        if t == "reference":
+            this.load(node["name"])
+            for index in node.get("indexes", []):
+                this.index(index)
+        elif t == "binary":
+            this.expression(node["left"])
+            this.expression(node["right"])
+            code.emit(binary_opcodes[node["operator"]])
+        elif t == "unary":
+            assert node["operator"] == "-", f"Unknown operator {node['operator']}"
+            this.expression(node["expression"])
+            code.emit(NEGATE)
+        elif t == "function_call":
+            this.expression(node["reference"])
+            for expression in node["expressions"]:
+                this.expression(expression)
+            code.emit(CALL, len(node["expressions"]))
+        elif t == "array-expression":
+            for expression in node["expressions"]:
+                this.expression(expression)
+            code.emit(ARRAY, len(node["expressions"]))
+        else:
+            raise Exception(f"Unknown content in AST={node}")
+
+    def statement(this, node):
+        code = this.code
+        t = node["type"] if isinstance(node, dict_types) else None
+        if t not in statement_types:
+            # an expression used as a statement
+            this.expression(node)
+            code.emit(POP)
+        elif t in ["program", "block"]:
+            for statement in node["statements"]:
+                this.statement(statement)
+        elif t == "assignment":
+            reference = node["reference"]
+            this.expression(node["expression"])
+            indexes = reference.get("indexes", [])
+            if indexes == []:
+                this.store(reference["name"])
+                return
+            this.load(reference["name"])
+            for index in indexes[:-1]:
+                this.index(index)
+            if is_field(indexes[-1]):
+                code.emit(SET_FIELD, code.add_name(indexes[-1]))
+            else:
+                this.expression(indexes[-1])
+                code.emit(SET_INDEX)
+        elif t == "if":
+            this.expression(node["condition"])
+            to_else = code.emit(JUMP_IF_FALSE)
+            this.statement(node["then"])
+            if node["else"] != None:
+                to_end = code.emit(JUMP)
+                code.patch(to_else, len(code.ops))
+                this.statement(node["else"])
+                code.patch(to_end, len(code.ops))
+            else:
+                code.patch(to_else, len(code.ops))
+        elif t == "while":
+            start = len(code.ops)
+            this.expression(node["condition"])
+            to_end = code.emit(JUMP_IF_FALSE)
+            this.statement(node["do"])
+            code.emit(JUMP, start)
+            code.patch(to_end, len(code.ops))
+        elif t == "print":
+            expressions = node["expression_list"]["expressions"]
+            for expression in expressions:
+                this.expression(expression)
+            code.emit(PRINT, len(expressions))
+        elif t == "return":
+            this.expression(node["expression"])
+            code.emit(RETURN)
+        elif t == "exit":
+            this.expression(node["expression"])
+            code.emit(EXIT)
+        elif t == "function_declaraction":
+            function = compile_function(node["name"], node["parameters"], node["block"])
+            code.emit(CONST, code.add_constant(function))
+            this.store(node["name"])
+
+
+def compile_function(name, parameters, block):
+    local_names = list(parameters)
+    for assigned in assigned_names(block["statements"], []):
+        if assigned not in local_names:
+            local_names.append(assigned)
+    code = Code(name, parameters, local_names)
+    Compiler(code).statement(block)
+    code.emit(CONST, code.add_constant(None))
+    code.emit(RETURN)
+    code.finish()
+    return CompiledFunction(code)
+
+
+def compile_program(ast):
+    code = Code("<program>")
+    Compiler(code).statement(ast)
+    code.emit(HALT)
+    code.finish()
+    return code
+
+
+# run compiled code; returns the value given to exit(), or None
+def run(code, environment=None):
+    if environment == None:
+        environment = {}
+    ops = code.words
+    constants = code.constants
+    names = code.names
+    local = None
+    stack = []
+    push = stack.append
+    pop = stack.pop
+    frames = []
+    pc = 0
+    while True:
+        op = ops[pc]
+        argument = ops[pc + 1]
+        pc += 2
+        if op == LOAD_LOCAL:
+            value = local[argument]
+            if value is UNSET:
+                name = names[code.fallbacks[argument]]
+                if name not in environment:
+                    raise Exception(f"Unknown name {name[1:]}")
+                value = environment[name]
+            push(value)
+        elif op == CONST:
+            push(constants[argument])
+        elif op == LOAD_GLOBAL:
+            try:
+                push(environment[names[argument]])
+            except KeyError:
+                raise Exception(f"Unknown name {names[argument][1:]}")
+        elif op == STORE_LOCAL:
+            local[argument] = pop()
+        elif op == JUMP_IF_FALSE:
+            if not pop():
+                pc = argument
+        elif op == ADD:
+            value = pop()
+            stack[-1] = stack[-1] + value
+        elif op == SUBTRACT:
+            value = pop()
+            stack[-1] = stack[-1] - value
+        elif op == LESS:
+            value = pop()
+            stack[-1] = stack[-1] < value
+        elif op == JUMP:
+            pc = argument
+        elif op == STORE_GLOBAL:
+            environment[names[argument]] = pop()
+        elif op == GET_INDEX:
+            index = pop()
+            if type(index) is int:
+                stack[-1] = stack[-1][index]
+            else:
+                stack[-1] = get_index(stack[-1], index)
+        elif op == GET_FIELD:
+            if type(stack[-1]) is list and names[argument] == "@length":
+                stack[-1] = len(stack[-1])
+            else:
+                stack[-1] = get_index(stack[-1], names[argument])
+        elif op == MULTIPLY:
+            value = pop()
+            stack[-1] = stack[-1] * value
+        elif op == CALL:
+            function = stack[-argument - 1]
+            if type(function) is CompiledFunction:
+                frames.append((code, pc, local))
+                code = function.code
+                if argument != code.parameter_count:
+                    raise Exception(f"Wrong number of arguments to {code.name[1:]}")
+                local = stack[len(stack) - argument :]
+                local.extend([UNSET] * (len(code.local_names) - argument))
+                del stack[-argument - 1 :]
+                ops = code.words
+                constants = code.constants
+                names = code.names
+                pc = 0
+            else:
+                # a Python function given in the environment
+                arguments = stack[len(stack) - argument :]
+                del stack[-argument - 1 :]
+                push(function(*arguments))
+        elif op == RETURN:
+            if not frames:
+                raise Exception("Return outside of a function")
+            code, pc, local = frames.pop()
+            ops = code.words
+            constants = code.constants
+            names = code.names
+        elif op == GREATER:
+            value = pop()
+            stack[-1] = stack[-1] > value
+        elif op == LESS_EQUAL:
+            value = pop()
+            stack[-1] = stack[-1] <= value
+        elif op == GREATER_EQUAL:
+            value = pop()
+            stack[-1] = stack[-1] >= value
+        elif op == EQUAL:
+            value = pop()
+            stack[-1] = stack[-1] == value
+        elif op == NOT_EQUAL:
+            value = pop()
+            stack[-1] = stack[-1] != value
+        elif op == DIVIDE:
+            value = pop()
+            stack[-1] = stack[-1] / value
+        elif op == NEGATE:
+            stack[-1] = -stack[-1]
+        elif op == SET_INDEX:
+            index = pop()
+            container = pop()
+            if type(container) is list and type(index) is int and index < len(container):
+                container[index] = pop()
+            else:
+                set_index(container, index, pop())
+        elif op == SET_FIELD:
+            container = pop()
+            set_index(container, names[argument], pop())
+        elif op == ARRAY:
+            values = stack[len(stack) - argument :]
+            del stack[len(stack) - argument :]
+            push(values)
+        elif op == PRINT:
+            values = stack[len(stack) - argument :]
+            del stack[len(stack) - argument :]
+            print(*values)
+        elif op == POP:
+            pop()
+        elif op == EXIT:
+            return pop()
+        elif op == HALT:
+            return None
+        else:
+            raise Exception(f"Unknown opcode {op}")
+
+
+# a readable listing of compiled code and of the functions it declares
+def disassemble(code):
+    lines = [f"function {code.name[1:]}:" if code.local_names != None else f"{code.name}:"]
+    functions = []
+    for pc in range(0, len(code.ops), 2):
+        op = code.ops[pc]
+        argument = code.ops[pc + 1]
+        line = f"  {pc:5} {opcodes[op]:14}"
+        if op == CONST:
+            value = code.constants[argument]
+            if type(value) is CompiledFunction:
+                functions.append(value.code)
+            line += f"{argument:5}  ({value!r})"
+        elif op in [LOAD_GLOBAL, STORE_GLOBAL, GET_FIELD, SET_FIELD]:
+            line += f"{argument:5}  ({code.names[argument][1:]})"
+        elif op in [LOAD_LOCAL, STORE_LOCAL]:
+            line += f"{argument:5}  ({code.local_names[argument][1:]})"
+        elif op in [JUMP, JUMP_IF_FALSE, CALL, ARRAY, PRINT]:
+            line += f"{argument:5}"
+        lines.append(line.rstrip())
+    for function in functions:
+        lines.append("")
+        lines.append(disassemble(function))
+    return "\n".join(lines)
+
+
+def test_run():
+    print("testing bytecode run")
+    import contextlib
+    import io
+    from evaluator import test_programs
+
+    for source, expected in test_programs:
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            run(compile_program(parse(tokenize(source))))
+        assert output.getvalue() == expected, source
+    environment = {}
+    assert run(compile_program(parse(tokenize("x = 2; exit(x + 1)"))), environment) == 3
+    assert environment == {"@x": 2}
+    assert run(compile_program(parse(tokenize("exit(double(3))"))), {"@double": lambda x: x * 2}) == 6
+    # recursion is not limited by the Python stack
+    source = "function count(n) { if (n == 0) { return (0) }; return (1 + count(n - 1)) }; exit(count(20000))"
+    assert run(compile_program(parse(tokenize(source)))) == 20000
+    # errors are the evaluator's
+    from evaluator import evaluate
+
+    for source in ["print(y)", "x = [1]; print(x[2])", "function f(a) { }; f()", "return (1)"]:
+        messages = []
+        for run_program in [lambda: evaluate(parse(tokenize(source))), lambda: run(compile_program(parse(tokenize(source))))]:
+            try:
+                run_program()
+                raise Exception("An error was expected.")
+            except Exception as error:
+                messages.append(str(error))
+        assert messages[0] == messages[1] and "An error was expected." not in messages[0], (source, messages)
+
+
+def test_disassemble():
+    print("testing disassemble")
+    code = compile_program(parse(tokenize("function f(a) { b = a.length; return (b * 2) }; x = f([1]); print(x)")))
+    assert disassemble(code) == "\n".join(
+        [
+            "<program>:",
+            "      0 CONST             0  (<function f>)",
+            "      2 STORE_GLOBAL      0  (f)",
+            "      4 LOAD_GLOBAL       0  (f)",
+            "      6 CONST             1  (1)",
+            "      8 ARRAY             1",
+            "     10 CALL              1",
+            "     12 STORE_GLOBAL      1  (x)",
+            "     14 LOAD_GLOBAL       1  (x)",
+            "     16 PRINT             1",
+            "     18 HALT",
+            "",
+            "function f:",
+            "      0 LOAD_LOCAL        0  (a)",
+            "      2 GET_FIELD         2  (length)",
+            "      4 STORE_LOCAL       1  (b)",
+            "      6 LOAD_LOCAL        1  (b)",
+            "      8 CONST             0  (2)",
+            "     10 MULTIPLY",
+            "     12 RETURN",
+            "     14 CONST             1  (None)",
+            "     16 RETURN",
+        ]
+    )
+
+
+if __name__ == "__main__":
+    test_run()
+    test_disassemble()
+    print("done.")
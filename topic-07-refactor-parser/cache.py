@@ -0,0 +1,196 @@
+# a cache of parsed programs, like __pycache__ for .t scripts
+#
+# The AST of a script is stored with marshal, compressed with zlib, in a
+# .tc file in a __tcache__ directory next to the script (or in a given
+# directory). The file name includes a hash of the script's contents and
+# of the tokenizer and parser sources, so editing either the script or
+# the language invalidates it. Files are written atomically, and when the directory
+# grows past max_cache_size the least recently used files are removed.
+
+import hashlib
+import marshal
+import os
+import tempfile
+import zlib
+
+from tokenizer import tokenize
+from parser import parse
+
+# bump when the layout of .tc files changes
+cache_format = 1
+magic = b"TC" + bytes([cache_format])
+
+max_cache_size = 64 * 1024 * 1024
+
+language_hash = None
+
+
+# a hash of the code that turns source into an AST
+def language_version():
+    global language_hash
+    if language_hash == None:
+        digest = hashlib.sha256(magic)
+        directory = os.path.dirname(os.path.abspath(__file__))
+        for name in ["tokenizer.py", "parser.py"]:
+            with open(os.path.join(directory, name), "rb") as f:
+                digest.update(f.read())
+        language_hash = digest.digest()
+    return language_hash
+
+
+def cache_path(path, source, directory=None):
+    if directory == None:
+        directory = os.path.join(os.path.dirname(os.path.abspath(path)), "__tcache__")
+    key = hashlib.sha256(language_version() + source).hexdigest()[:32]
+    name = os.path.splitext(os.path.basename(path))[0]
+    return os.path.join(directory, f"{name}.{key}.tc")
+
+
+# the cached AST, or None if there is no usable cache file
+def read_cache(cache_file):
+    try:
+        with open(cache_file, "rb") as f:
+            data = f.read()
+    except OSError:
+        return None
+    if not data.startswith(magic):
+        return None
+    try:
+        ast = marshal.loads(zlib.decompress(data[len(magic) :]))
+    except (EOFError, ValueError, TypeError, zlib.error):
+        return None
+    # mark the file as recently used
+    try:
+        os.utime(cache_file)
+    except OSError:
+        pass
+    return ast
+
+
+# write through a temporary file, so that a reader never sees part of a file
+def write_cache(cache_file, ast, max_size=None):
+    directory = os.path.dirname(cache_file)
+    os.makedirs(directory, exist_ok=True)
+    handle, temporary = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(handle, "wb") as f:
+            f.write(magic)
+            f.write(zlib.compress(marshal.dumps(ast), 1))
+        os.replace(temporary, cache_file)
+    except BaseException:
+        os.remove(temporary)
+        raise
+    evict(directory, max_cache_size if max_size == None else max_size)
+
+
+# remove the least recently used .tc files until the directory fits
+def evict(directory, max_size):
+    entries = []
+    for entry in os.scandir(directory):
+        if entry.name.endswith(".tc"):
+            try:
+                status = entry.stat()
+            except OSError:
+                continue
+            entries.append((status.st_mtime, status.st_size, [entry.path]))
+    remove_oldest(entries, max_size)
+
+
+# remove the files of the oldest (mtime, size, paths) entries until the
+# sizes of the rest add up to at most max_size
+def remove_oldest(entries, max_size):
+    total = sum(size for mtime, size, paths in entries)
+    for mtime, size, paths in sorted(entries):
+        if total <= max_size:
+            break
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        total -= size
+
+
+# the AST of a script, from the cache if it is there
+def load_program(path, directory=None, max_size=None):
+    with open(path, "rb") as f:
+        source = f.read()
+    cache_file = cache_path(path, source, directory)
+    ast = read_cache(cache_file)
+    if ast == None:
+        ast = parse(tokenize(source.decode("utf-8")))
+        try:
+            write_cache(cache_file, ast, max_size)
+        except OSError:
+            # an unwritable cache only costs time
+            pass
+    return ast
+
+
+def test_load_program():
+    print("testing load program")
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "program.t")
+        with open(path, "w") as f:
+            f.write('x = [1, 2.5, "a"]; if (x) { print(x[0], -x.y) } else { f(x) }')
+        ast = load_program(path)
+        assert ast == parse(tokenize(open(path).read()))
+        cached = os.listdir(os.path.join(directory, "__tcache__"))
+        assert len(cached) == 1 and cached[0].startswith("program.")
+        assert cached[0].endswith(".tc")
+        assert load_program(path) == ast
+        # an edited script gets a new cache file
+        with open(path, "a") as f:
+            f.write("; y = 2")
+        assert load_program(path)["statements"][-1]["expression"] == 2
+        assert len(os.listdir(os.path.join(directory, "__tcache__"))) == 2
+
+
+def test_damaged_cache():
+    print("testing damaged cache")
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "program.t")
+        with open(path, "w") as f:
+            f.write("print(1 + 2)")
+        ast = load_program(path, directory)
+        with open(path, "rb") as f:
+            cache_file = cache_path(path, f.read(), directory)
+        compressed = zlib.compress(marshal.dumps(ast))
+        for data in [b"", b"XX", magic, magic + b"\xff\x00", magic + compressed[:5], magic + zlib.compress(b"\xff")]:
+            with open(cache_file, "wb") as f:
+                f.write(data)
+            assert read_cache(cache_file) == None
+            assert load_program(path, directory) == ast
+        assert read_cache(cache_file) == ast
+
+
+def test_evict():
+    print("testing evict")
+    with tempfile.TemporaryDirectory() as directory:
+        cache = os.path.join(directory, "cache")
+        files = []
+        for i in range(5):
+            path = os.path.join(directory, f"p{i}.t")
+            with open(path, "w") as f:
+                f.write(f"x = {i}" + "; y = 1" * 100)
+            load_program(path, cache)
+            with open(path, "rb") as f:
+                files.append(cache_path(path, f.read(), cache))
+            os.utime(files[i], (i + 1, i + 1))
+        size = os.path.getsize(files[0])
+        evict(cache, 3 * size)
+        assert sorted(os.listdir(cache)) == sorted(os.path.basename(f) for f in files[2:])
+        # reading a file makes it the most recently used
+        load_program(os.path.join(directory, "p2.t"), cache)
+        evict(cache, 2 * size)
+        assert sorted(os.listdir(cache)) == sorted(os.path.basename(f) for f in [files[2], files[4]])
+        # writing evicts, and leaves no temporary files behind
+        load_program(os.path.join(directory, "p0.t"), cache, max_size=size)
+        assert os.listdir(cache) == [os.path.basename(files[0])]
+
+
+if __name__ == "__main__":
+    test_load_program()
+    test_damaged_cache()
+    test_evict()
+    print("done.")
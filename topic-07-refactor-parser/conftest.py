@@ -0,0 +1,5 @@
+# pytest settings for the tests in this directory
+
+
+def pytest_configure(config):
+    config.addinivalue_line("markers", "slow: tests that time the code, and take a while")
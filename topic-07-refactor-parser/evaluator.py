@@ -0,0 +1,425 @@
+# a tree-walking evaluator for the AST built by parser.py
+#
+# Names are kept as the parser spells them ("@x"). The program's
+# variables live in a global environment; a function call gets a local
+# environment holding its parameters and the names it assigns, and looks
+# up any other name in the global one. `a.length` is the length of an
+# array or string, any other `.field` is a key of a dict, and assigning
+# one past the end of an array appends to it.
+#
+# Each node is run by the handler that the `handlers` table holds for its
+# type, so a node costs one dict lookup instead of a chain of string
+# comparisons. Children that are constants, and the fields among the
+# indexes of a reference, are used directly, without a call. A call runs
+# in a new Frame; a return statement stores its value in the frame and
+# the enclosing blocks and loops stop, so returning raises no exception.
+#
+# A frame can carry tiers, such as a tiered.TieredEvaluator, for which
+# calls count the calls of each function and evaluate_counted_while()
+# the iterations (back edges) of each loop. A
+# counter lives in the unit that tiers.function_unit() or
+# tiers.loop_unit() gives for the function or loop; when it reaches
+# tiers.call_threshold or tiers.loop_threshold, tiers.promote() sets the
+# unit's compiled code, which is run instead: for a function, it is given
+# the variables and the environment and returns the function's value,
+# and for a loop, it is given the frame.
+#
+# Each call of a program function takes four Python frames (the call,
+# the block, the return and the expression that calls again), so with
+# Python's default limit of 1000 frames a program can recurse about 240
+# calls deep.
+
+import operator
+
+from tokenizer import tokenize
+from parser import parse
+
+binary_operations = {
+    "+": operator.add,
+    "-": operator.sub,
+    "*": operator.mul,
+    "/": operator.truediv,
+    "==": operator.eq,
+    "!=": operator.ne,
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+}
+
+unary_operations = {
+    "-": operator.neg,
+}
+
+# the values that are their own nodes
+constant_types = {int, float, str, bool, type(None)}
+
+
+class Function:
+    def __init__(this, name, parameters, block):
+        this.name = name
+        this.parameters = parameters
+        this.block = block
+
+    def __repr__(this):
+        return f"<function {this.name[1:]}>"
+
+
+# the variables of a running function (or of the program), and whether
+# it has executed a return statement
+class Frame:
+    __slots__ = ("variables", "environment", "returning", "value", "tiers")
+
+    def __init__(this, variables, environment, tiers=None):
+        this.variables = variables
+        this.environment = environment
+        this.returning = False
+        this.value = None
+        this.tiers = tiers
+
+
+class Exit(Exception):
+    def __init__(this, value):
+        this.value = value
+
+
+### indexes shared by all the backends
+
+
+# the value of container[index], where a field is a name like "@length"
+def get_index(container, index):
+    if type(index) is str and index[0] == "@":
+        if index == "@length" and type(container) in (list, str):
+            return len(container)
+        return container[index[1:]]
+    return container[index]
+
+
+def set_index(container, index, value):
+    if type(index) is str and index[0] == "@":
+        container[index[1:]] = value
+    elif type(container) is list and index == len(container):
+        container.append(value)
+    else:
+        container[index] = value
+
+
+def lookup(name, local, environment):
+    if name in local:
+        return local[name]
+    if name in environment:
+        return environment[name]
+    raise Exception(f"Unknown name {name[1:]}")
+
+
+# value[index], where index is a field name or an expression node
+def follow(value, index, frame):
+    if index.__class__ is str and index[0] == "@":
+        if index == "@length" and type(value) in (list, str):
+            return len(value)
+        return value[index[1:]]
+    if index.__class__ not in constant_types:
+        index = handlers[index["type"]](index, frame)
+    if type(value) is list and type(index) is int:
+        return value[index]
+    return get_index(value, index)
+
+
+### handlers
+
+
+def evaluate_node(node, frame):
+    if node.__class__ in constant_types:
+        return node
+    return handlers[node["type"]](node, frame)
+
+
+def evaluate_reference(node, frame):
+    name = node["name"]
+    variables = frame.variables
+    if name in variables:
+        value = variables[name]
+    else:
+        value = lookup(name, variables, frame.environment)
+    if "indexes" in node:
+        for index in node["indexes"]:
+            value = follow(value, index, frame)
+    return value
+
+
+def evaluate_binary(node, frame):
+    left = node["left"]
+    if left.__class__ not in constant_types:
+        left = handlers[left["type"]](left, frame)
+    right = node["right"]
+    if right.__class__ not in constant_types:
+        right = handlers[right["type"]](right, frame)
+    return binary_operations[node["operator"]](left, right)
+
+
+def evaluate_unary(node, frame):
+    return unary_operations[node["operator"]](evaluate_node(node["expression"], frame))
+
+
+def evaluate_assignment(node, frame):
+    value = node["expression"]
+    if value.__class__ not in constant_types:
+        value = handlers[value["type"]](value, frame)
+    reference = node["reference"]
+    if "indexes" not in reference:
+        frame.variables[reference["name"]] = value
+        return
+    indexes = reference["indexes"]
+    container = lookup(reference["name"], frame.variables, frame.environment)
+    for index in indexes[:-1]:
+        container = follow(container, index, frame)
+    index = indexes[-1]
+    if not (index.__class__ is str and index[0] == "@"):
+        index = evaluate_node(index, frame)
+        if type(container) is list and type(index) is int and 0 <= index < len(container):
+            container[index] = value
+            return
+    set_index(container, index, value)
+
+
+def evaluate_block(node, frame):
+    for statement in node["statements"]:
+        if statement.__class__ not in constant_types:
+            handlers[statement["type"]](statement, frame)
+            if frame.returning:
+                return
+
+
+# runs the statements of the block itself, which saves a Python frame
+# for each if statement that a recursive call is in
+def evaluate_if(node, frame):
+    condition = node["condition"]
+    if condition.__class__ not in constant_types:
+        condition = handlers[condition["type"]](condition, frame)
+    if condition:
+        block = node["then"]
+    else:
+        block = node["else"]
+        if block == None:
+            return
+    for statement in block["statements"]:
+        if statement.__class__ not in constant_types:
+            handlers[statement["type"]](statement, frame)
+            if frame.returning:
+                return
+
+
+def evaluate_while(node, frame):
+    if frame.tiers != None:
+        return evaluate_counted_while(node, frame)
+    condition = node["condition"]
+    statements = node["do"]["statements"]
+    while evaluate_node(condition, frame):
+        for statement in statements:
+            if statement.__class__ not in constant_types:
+                handlers[statement["type"]](statement, frame)
+                if frame.returning:
+                    return
+
+
+# a while loop that counts its back edges, and runs compiled once its
+# unit is promoted
+def evaluate_counted_while(node, frame):
+    tiers = frame.tiers
+    unit = tiers.loop_unit(node)
+    condition = node["condition"]
+    statements = node["do"]["statements"]
+    while unit.compiled == None:
+        if not evaluate_node(condition, frame):
+            return
+        for statement in statements:
+            if statement.__class__ not in constant_types:
+                handlers[statement["type"]](statement, frame)
+                if frame.returning:
+                    return
+        # a back edge
+        unit.count += 1
+        if unit.count >= tiers.loop_threshold:
+            tiers.promote(unit)
+    unit.compiled(frame)
+
+
+# calls program functions itself rather than through call_function(),
+# which saves a Python frame for each call
+def evaluate_function_call(node, frame):
+    function = evaluate_reference(node["reference"], frame)
+    arguments = [evaluate_node(e, frame) for e in node["expressions"]]
+    if type(function) is not Function:
+        return call_function(function, arguments, frame.environment)
+    parameters = function.parameters
+    if len(arguments) != len(parameters):
+        raise Exception(f"Wrong number of arguments to {function.name[1:]}")
+    tiers = frame.tiers
+    if tiers != None:
+        unit = counted_unit(function, tiers)
+        if unit.compiled != None:
+            return unit.compiled(dict(zip(parameters, arguments)), frame.environment)
+    called = Frame(dict(zip(parameters, arguments)), frame.environment, tiers)
+    evaluate_block(function.block, called)
+    return called.value
+
+
+def call_function(function, arguments, environment, tiers=None):
+    if type(function) is not Function:
+        # a Python function given in the environment
+        return function(*arguments)
+    parameters = function.parameters
+    if len(arguments) != len(parameters):
+        raise Exception(f"Wrong number of arguments to {function.name[1:]}")
+    if tiers != None:
+        unit = counted_unit(function, tiers)
+        if unit.compiled != None:
+            return unit.compiled(dict(zip(parameters, arguments)), environment)
+    frame = Frame(dict(zip(parameters, arguments)), environment, tiers)
+    evaluate_block(function.block, frame)
+    return frame.value
+
+
+# the unit of a function for tiers, with the call counted, promoted when
+# the function gets hot
+def counted_unit(function, tiers):
+    unit = tiers.function_unit(function)
+    if unit.compiled == None:
+        unit.count += 1
+        if unit.count >= tiers.call_threshold:
+            tiers.promote(unit)
+    return unit
+
+
+def evaluate_array_expression(node, frame):
+    return [evaluate_node(e, frame) for e in node["expressions"]]
+
+
+def evaluate_print(node, frame):
+    print(*[evaluate_node(e, frame) for e in node["expression_list"]["expressions"]])
+
+
+def evaluate_return(node, frame):
+    if frame.variables is frame.environment:
+        raise Exception("Return outside of a function")
+    value = node["expression"]
+    if value.__class__ not in constant_types:
+        value = handlers[value["type"]](value, frame)
+    frame.value = value
+    frame.returning = True
+
+
+def evaluate_exit(node, frame):
+    raise Exit(evaluate_node(node["expression"], frame))
+
+
+def evaluate_function_declaration(node, frame):
+    frame.variables[node["name"]] = Function(node["name"], node["parameters"], node["block"])
+
+
+handlers = {
+    "reference": evaluate_reference,
+    "binary": evaluate_binary,
+    "unary": evaluate_unary,
+    "assignment": evaluate_assignment,
+    "program": evaluate_block,
+    "block": evaluate_block,
+    "if": evaluate_if,
+    "while": evaluate_while,
+    "function_call": evaluate_function_call,
+    "array-expression": evaluate_array_expression,
+    "print": evaluate_print,
+    "return": evaluate_return,
+    "exit": evaluate_exit,
+    "function_declaraction": evaluate_function_declaration,
+}
+
+
+# run a program; returns the value given to exit(), or None
+def evaluate(ast, environment=None, tiers=None):
+    if environment == None:
+        environment = {}
+    try:
+        evaluate_block(ast, Frame(environment, environment, tiers))
+    except Exit as result:
+        return result.value
+    return None
+
+
+# programs that every backend should run the same way, with their output
+test_programs = [
+    ("print(1 + 2 * 3, -4 / 2, 7 - 2 - 1)", "7 -2.0 4\n"),
+    ('x = 3; y = x * x; print(y, "text", x == 3, x != 3, x < y, x >= y)', "9 text True False True False\n"),
+    ("k = 0; total = 0; while (k < 10) { total = total + k; k = k + 1 }; print(total)", "45\n"),
+    ("if (0) { print(1) } else { print(2) }; if (1) { print(3) }; if (0) { print(4) }", "2\n3\n"),
+    ("a = [1, [2, 3], []]; a[1][0] = 5; a[2][a[2].length] = 6; print(a, a.length)", "[1, [5, 3], [6]] 3\n"),
+    ("function add(x, y) { return (x + y) }; print(add(1, add(2, 3)))", "6\n"),
+    (
+        "function fib(n) { if (n < 2) { return (n) }; return (fib(n - 1) + fib(n - 2)) }; print(fib(15))",
+        "610\n",
+    ),
+    ("x = 1; function f() { y = x; x = 2; return (y + x) }; print(f(), x)", "3 1\n"),
+    ("function f(n) { while (1) { if (n > 3) { return (n) }; n = n + 1 } }; print(f(0))", "4\n"),
+    ("function f() { print(1) }; print(f())", "1\nNone\n"),
+    ("print(1); exit(2); print(3)", "1\n"),
+    ("function f(x) { exit(x * 2) }; f(5); print(0)", ""),
+    (
+        """
+        function sort(a) {
+            if (a.length < 2) { return (a) };
+            pivot = a[0]; lower = []; greater = []; i = 1;
+            while (i < a.length) {
+                if (a[i] < pivot) { lower[lower.length] = a[i] } else { greater[greater.length] = a[i] };
+                i = i + 1
+            };
+            return (sort(lower) + [pivot] + sort(greater))
+        };
+        print(sort([3.14, 2.71, 1.41, 1.73, 3, 1]))
+        """,
+        "[1, 1.41, 1.73, 2.71, 3, 3.14]\n",
+    ),
+]
+
+
+def test_evaluate():
+    print("testing evaluate")
+    import contextlib
+    import io
+
+    for source, expected in test_programs:
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            evaluate(parse(tokenize(source)))
+        assert output.getvalue() == expected, source
+    environment = {}
+    assert evaluate(parse(tokenize("x = 2; exit(x + 1)")), environment) == 3
+    assert environment == {"@x": 2}
+    assert evaluate(parse(tokenize("x = 2")), environment) == None
+    # lazily parsed function bodies run the same way
+    assert evaluate(parse(tokenize("function f(x) { exit(x) }; f(4)"), lazy=True)) == 4
+    # functions from Python
+    assert evaluate(parse(tokenize("exit(double(3))")), {"@double": lambda x: x * 2}) == 6
+    for source, message in [
+        ("print(y)", "Unknown name y"),
+        ("x = [1]; print(x[2])", "list index out of range"),
+        ("function f(a) { }; f()", "Wrong number of arguments to f"),
+        ("return (1)", "Return outside of a function"),
+    ]:
+        try:
+            evaluate(parse(tokenize(source)))
+            raise Exception("An error was expected.")
+        except Exception as error:
+            assert str(error) == message, source
+    # evaluating leaves the tree as the parser made it
+    source = "a = [[1, 2]]; i = 1; a[0][a[0].length] = 3; exit(a[0][i + 1] + a.length)"
+    ast = parse(tokenize(source))
+    assert evaluate(ast) == 4
+    assert ast == parse(tokenize(source))
+    # deep recursion
+    source = "function f(n) { if (n < 1) { return (0) }; return (f(n - 1) + 1) }; exit(f(200))"
+    assert evaluate(parse(tokenize(source))) == 200
+
+
+if __name__ == "__main__":
+    test_evaluate()
+    print("done.")
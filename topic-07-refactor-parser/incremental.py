@@ -0,0 +1,202 @@
+# incremental reparsing of an edited program
+#
+# A Document keeps the tokens of a program in a TokenStore, its AST, and
+# the token range of every top-level statement. After an edit, the token
+# store re-lexes the changed tokens, and the document re-parses from the
+# statement where those tokens begin. It stops as soon as a new statement
+# starts where an old statement (moved by the edit) started, because the
+# parse of a top-level statement depends only on its own tokens, so from
+# there on the old statements can be kept. Only the statements that
+# overlap the edit are parsed again; a statement as a whole is the unit,
+# so an edit inside a function body re-parses that function.
+
+from array import array
+
+from tokenizer import tokenize
+from parser import parse, parse_statement
+from token_store import store_tokens, StoreList
+
+
+class Document:
+    def __init__(this, source=""):
+        this.store = store_tokens(source)
+        # token index of the first token of each statement, and of the
+        # token after its last
+        this.starts = array("i")
+        this.stops = array("i")
+        # ranges from shift_index on are still to be moved by shift, as
+        # in the token store
+        this.shift_index = 0
+        this.shift = 0
+        this.statements = []
+        this.program = {"type": "program", "statements": this.statements}
+        this.reparse(0, 0, 0)
+
+    @property
+    def source(this):
+        return this.store.source
+
+    def start(this, i):
+        if i >= this.shift_index:
+            return this.starts[i] + this.shift
+        return this.starts[i]
+
+    # add delta to the stored ranges of statements first..stop-1
+    def move(this, first, stop, delta):
+        if delta == 0:
+            return
+        for i in range(first, stop):
+            this.starts[i] += delta
+            this.stops[i] += delta
+
+    # the token range of statement i
+    def statement_range(this, i):
+        if i >= this.shift_index:
+            return this.starts[i] + this.shift, this.stops[i] + this.shift
+        return this.starts[i], this.stops[i]
+
+    # index of the last statement that starts at or before the token
+    def find_statement(this, token):
+        low, high = 0, len(this.statements)
+        while low < high:
+            middle = (low + high) // 2
+            if this.start(middle) <= token:
+                low = middle + 1
+            else:
+                high = middle
+        return max(low - 1, 0)
+
+    # Replace `deleted` characters at `offset` with `inserted`, and update
+    # the AST. If the new text does not parse, the edit is undone and the
+    # error raised. Returns (first, old_stop, new_stop): statements
+    # first..old_stop-1 were replaced by statements first..new_stop-1.
+    def edit(this, offset, deleted, inserted):
+        removed = this.store.text.slice(offset, offset + deleted)
+        first, old_stop, new_stop = this.store.edit(offset, deleted, inserted)
+        try:
+            return this.reparse(first, old_stop, new_stop)
+        except Exception:
+            this.store.edit(offset, len(inserted), removed)
+            raise
+
+    # re-parse after tokens first..old_stop-1 were replaced by tokens
+    # first..new_stop-1
+    def reparse(this, first, old_stop, new_stop):
+        delta = new_stop - old_stop
+        count = len(this.statements)
+        index = this.find_statement(first)
+        tokens = StoreList(this.store, this.start(index) if count else 0)
+        old = index
+        parsed = []
+        while True:
+            start = tokens.position
+            if tokens.current() == None:
+                old = count
+                break
+            if start >= new_stop:
+                while old < count and this.start(old) + delta < start:
+                    old = old + 1
+                if old < count and this.start(old) + delta == start:
+                    break
+            statement = parse_statement(tokens)
+            parsed.append((statement, start, tokens.position))
+            if tokens.current() != None:
+                tokens.discard(";")
+        # move the pending shift to the first statement after the replaced
+        # ones, which costs only the distance from the previous edit
+        if this.shift_index < old:
+            this.move(this.shift_index, index, this.shift)
+        else:
+            this.move(old, this.shift_index, -this.shift)
+        this.statements[index:old] = [statement for statement, start, stop in parsed]
+        this.starts[index:old] = array("i", [start for statement, start, stop in parsed])
+        this.stops[index:old] = array("i", [stop for statement, start, stop in parsed])
+        this.shift_index = index + len(parsed)
+        this.shift = this.shift + delta
+        return index, old, index + len(parsed)
+
+
+def check_document(document):
+    assert document.program == parse(tokenize(document.source))
+    tokens = document.store.tokens()
+    for i, statement in enumerate(document.statements):
+        start, stop = document.statement_range(i)
+        assert parse_statement(StoreList(document.store, start)) == statement
+        assert stop == len(tokens) or tokens[stop] == ";"
+
+
+def test_document():
+    print("testing document")
+    source = "x = 1; print(x); function f(a) { return (a * 2) }; y = f(x)"
+    document = Document(source)
+    check_document(document)
+    assert [document.statement_range(i) for i in range(4)] == [(0, 3), (4, 8), (9, 22), (23, 29)]
+    # change a number in the second statement
+    offset = source.index("print(x)") + 6
+    assert document.edit(offset, 1, "2 + 3") == (1, 2, 2)
+    check_document(document)
+    # join the first two statements
+    offset = document.source.index(";")
+    try:
+        document.edit(offset, 1, "")
+        raise Exception("An error was expected.")
+    except AssertionError:
+        pass
+    assert document.source == source.replace("print(x)", "print(2 + 3)")
+    check_document(document)
+    # add a statement; re-lexing starts at the separator before it, so
+    # the statement that the separator ends is parsed again too
+    offset = document.source.index("y =")
+    assert document.edit(offset, 0, "z = 0;\n") == (2, 3, 4)
+    check_document(document)
+    # delete everything, then start again
+    document.edit(0, len(document.source), "")
+    assert document.program == {"type": "program", "statements": []}
+    document.edit(0, 0, "print(1);")
+    check_document(document)
+
+
+def test_random_edits():
+    print("testing random edits")
+    import random
+
+    random.seed(7)
+    statements = [
+        "x = 1",
+        "print(x, 2)",
+        "function f(a) { if (a) { return (a - 1) } }",
+        "while (x < 3) { x = x + 1 }",
+        "{ y = [1, 2]; y[0] = -y[1] }",
+        "z = f(x.w, y[0])",
+    ]
+    source = ";\n".join(random.choice(statements) for i in range(40))
+    document = Document(source)
+    snippets = [";", "x", "1", "(", ")", "{", "}", " ", "+", "=", "; y = 2", "print(3);", "if"]
+    changed = 0
+    for i in range(400):
+        old_source = document.source
+        offset = random.randrange(len(old_source) + 1)
+        deleted = min(random.choice([0, 0, 1, 2, 5]), len(old_source) - offset)
+        inserted = random.choice(snippets + [""])
+        new_source = old_source[:offset] + inserted + old_source[offset + deleted :]
+        try:
+            expected = parse(tokenize(new_source))
+        except Exception:
+            expected = None
+        try:
+            document.edit(offset, deleted, inserted)
+        except Exception:
+            assert expected == None, new_source
+            assert document.source == old_source
+            continue
+        assert expected != None
+        assert document.source == new_source
+        check_document(document)
+        changed += 1
+    assert changed > 50
+
+
+if __name__ == "__main__":
+    test_document()
+    test_random_edits()
+    print("done.")
@@ -0,0 +1,444 @@
+# a table-driven LL(1) parser generated from an EBNF grammar
+#
+# The grammar below is the ebnf of parser.py, cleaned up so that it is
+# LL(1) and annotated with actions that build the AST. In the grammar:
+#
+#   'x'      matches the token x and drops it (quoted keywords match the
+#            keyword tokens, so 'if' matches "#if")
+#   "x"      matches the token x and pushes it on the value stack
+#   number, string, identifier
+#            match a token of that class and push its value
+#   @name    runs an action on the value stack; @mark pushes a marker,
+#            and list actions take the values above the latest marker
+#   [ ]      optional, { } repeated, ( | ) grouped alternatives
+#
+# Lists that may end with a separator, such as "{ x; }", are written as
+# right recursion (statements ::= [ statement [ ';' statements ] ]),
+# which the generated parser runs on its explicit stack.
+#
+# generate() turns the grammar into plain BNF, computes FIRST and FOLLOW
+# sets and builds a table from (rule, token class) to production. parse()
+# then runs a loop over an explicit stack of symbols, with no Python
+# call per rule, so nesting depth is limited only by memory. It is still
+# slower than parser.py: every optional part and repetition is a table
+# lookup, and an expression goes through one rule per precedence level
+# where precedence climbing needs only one (see `benchmark.py ll1`).
+
+import re
+
+from tokenizer import tokenize, keywords
+from parser import DictBuilder
+
+grammar = """
+program              ::= @mark statements @program
+statements           ::= [ statement [ ';' statements ] ]
+
+statement            ::= if-statement | while-statement | print-statement
+                       | return-statement | exit-statement | function-declaration
+                       | block | expression [ '=' expression @assignment ]
+
+block                ::= '{' @mark statements '}' @block
+if-statement         ::= 'if' '(' expression ')' block ( 'else' block | @none ) @if
+while-statement      ::= 'while' '(' expression ')' block @while
+print-statement      ::= 'print' expression-list @print
+return-statement     ::= 'return' '(' expression ')' @return
+exit-statement       ::= 'exit' '(' expression ')' @exit
+function-declaration ::= 'function' identifier '(' @mark parameters ')' @list block @function
+parameters           ::= [ identifier [ ',' parameters ] ]
+
+expression-list      ::= '(' @mark expressions ')' @expression-list
+expressions          ::= [ expression [ ',' expressions ] ]
+
+expression           ::= relation { ( "==" | "!=" ) relation @binary }
+relation             ::= sum { ( "<" | "<=" | ">" | ">=" ) sum @binary }
+sum                  ::= term { ( "+" | "-" ) term @binary }
+term                 ::= unary { ( "*" | "/" ) unary @binary }
+unary                ::= "-" unary @unary | factor
+factor               ::= number | string | '(' expression ')' | array
+                       | reference [ '(' @mark expressions ')' @function-call ]
+array                ::= '[' @mark expressions ']' @array
+reference            ::= identifier @mark { '.' identifier | '[' expression ']' } @reference
+"""
+
+token_classes = ["number", "string", "identifier"]
+
+
+### READING THE GRAMMAR
+
+grammar_pattern = re.compile(r"""\s*(?:(::=)|'([^']*)'|"([^"]*)"|@([\w-]+)|([\w-]+)|(\S))""")
+
+
+# the grammar as a dict from rule name to expression, where an expression
+# is one of ("alternatives", [expressions]), ("sequence", [expressions]),
+# ("optional", expression), ("repeat", expression), ("drop", token),
+# ("keep", token), ("action", name) or ("rule", name)
+def read_grammar(text):
+    items = []
+    for match in grammar_pattern.finditer(text.strip()):
+        define, drop, keep, action, name, symbol = match.groups()
+        if define:
+            # the name before ::= starts a new rule
+            items[-1] = ("define", items[-1][1])
+        elif drop != None:
+            items.append(("drop", keywords.get(drop, drop)))
+        elif keep != None:
+            items.append(("keep", keep))
+        elif action:
+            items.append(("action", action))
+        elif name:
+            items.append(("rule", name))
+        else:
+            items.append(("symbol", symbol))
+    items.append(("end", None))
+    position = 0
+
+    def peek():
+        return items[position]
+
+    def next_item():
+        nonlocal position
+        position += 1
+        return items[position - 1]
+
+    def alternatives():
+        options = [sequence()]
+        while peek() == ("symbol", "|"):
+            next_item()
+            options.append(sequence())
+        return options[0] if len(options) == 1 else ("alternatives", options)
+
+    def sequence():
+        parts = []
+        while peek()[0] not in ["define", "end"] and peek() not in [
+            ("symbol", "|"),
+            ("symbol", ")"),
+            ("symbol", "]"),
+            ("symbol", "}"),
+        ]:
+            parts.append(part())
+        return ("sequence", parts)
+
+    def part():
+        kind, value = next_item()
+        if kind == "symbol":
+            closing = {"(": ")", "[": "]", "{": "}"}[value]
+            inner = alternatives()
+            assert next_item() == ("symbol", closing), f"Expected {closing} in grammar"
+            if value == "[":
+                return ("optional", inner)
+            if value == "{":
+                return ("repeat", inner)
+            return inner
+        return (kind, value)
+
+    rules = {}
+    while peek()[0] != "end":
+        kind, name = next_item()
+        assert kind == "define", f"Expected a rule at {name}"
+        rules[name] = alternatives()
+    return rules
+
+
+### GENERATING THE TABLE
+
+END = None
+
+
+# plain BNF: a dict from rule name to a list of productions, each a list
+# of symbols. groups, optional parts and repetitions become new rules.
+def to_bnf(rules):
+    productions = {}
+
+    def add(name, expression):
+        if expression[0] == "alternatives":
+            productions[name] = [symbols(option) for option in expression[1]]
+        else:
+            productions[name] = [symbols(expression)]
+
+    def symbols(expression):
+        kind, value = expression
+        if kind == "sequence":
+            return [symbol for part in value for symbol in symbols(part)]
+        if kind in ["drop", "keep", "action"]:
+            return [expression]
+        if kind == "rule":
+            if value in token_classes:
+                return [("class", value)]
+            assert value in rules, f"Unknown rule {value}"
+            return [expression]
+        # a new rule for a group, optional part or repetition
+        name = f"{len(productions)}-{kind}"
+        productions[name] = None
+        if kind == "alternatives":
+            add(name, expression)
+        elif kind == "optional":
+            productions[name] = [symbols(value), []]
+        elif kind == "repeat":
+            productions[name] = [symbols(value) + [("rule", name)], []]
+        return [("rule", name)]
+
+    for name, expression in rules.items():
+        add(name, expression)
+    return productions
+
+
+# the token class a terminal symbol matches
+def terminal(symbol):
+    kind, value = symbol
+    return value
+
+
+def first_of(symbols, first):
+    result = set()
+    for kind, value in symbols:
+        if kind == "action":
+            continue
+        if kind == "rule":
+            result |= first[value] - {"ε"}
+            if "ε" not in first[value]:
+                return result
+            continue
+        result.add(value)
+        return result
+    result.add("ε")
+    return result
+
+
+def first_sets(productions):
+    first = {name: set() for name in productions}
+    changed = True
+    while changed:
+        changed = False
+        for name, options in productions.items():
+            for production in options:
+                new = first_of(production, first)
+                if not new <= first[name]:
+                    first[name] |= new
+                    changed = True
+    return first
+
+
+def follow_sets(productions, first, start):
+    follow = {name: set() for name in productions}
+    follow[start].add(END)
+    changed = True
+    while changed:
+        changed = False
+        for name, options in productions.items():
+            for production in options:
+                for i, (kind, value) in enumerate(production):
+                    if kind != "rule":
+                        continue
+                    rest = first_of(production[i + 1 :], first)
+                    new = rest - {"ε"}
+                    if "ε" in rest:
+                        new |= follow[name]
+                    if not new <= follow[value]:
+                        follow[value] |= new
+                        changed = True
+    return follow
+
+
+# the parse table, {rule: {token class: production}}; raises an error if
+# the grammar is not LL(1)
+def generate(text=grammar, start="program"):
+    productions = to_bnf(read_grammar(text))
+    first = first_sets(productions)
+    follow = follow_sets(productions, first, start)
+    table = {}
+    for name, options in productions.items():
+        row = table[name] = {}
+        for production in options:
+            lookahead = first_of(production, first)
+            if "ε" in lookahead:
+                lookahead = (lookahead - {"ε"}) | follow[name]
+            for token in lookahead:
+                assert token not in row, f"Grammar is not LL(1): {name} on {token}"
+                # push the symbols in reverse, ready for the parse stack
+                row[token] = list(reversed(production))
+    return table
+
+
+### PARSING
+
+MARK = object()
+builder = DictBuilder()
+
+
+def pop_list(values):
+    i = len(values) - 1
+    while values[i] is not MARK:
+        i -= 1
+    items = values[i + 1 :]
+    del values[i:]
+    return items
+
+
+def function_call_action(values):
+    expressions = pop_list(values)
+    values.append(builder.function_call(values.pop(), expressions))
+
+
+def reference_action(values):
+    indexes = pop_list(values)
+    values.append(builder.reference(values.pop(), indexes))
+
+
+def binary_action(values):
+    right = values.pop()
+    operator = values.pop()
+    values.append(builder.binary(values.pop(), operator, right))
+
+
+def unary_action(values):
+    expression = values.pop()
+    values.append(builder.unary(values.pop(), expression))
+
+
+def assignment_action(values):
+    expression = values.pop()
+    values.append(builder.assignment(values.pop(), expression))
+
+
+def if_action(values):
+    else_block = values.pop()
+    then_block = values.pop()
+    values.append(builder.if_statement(values.pop(), then_block, else_block))
+
+
+def while_action(values):
+    do_block = values.pop()
+    values.append(builder.while_statement(values.pop(), do_block))
+
+
+def function_action(values):
+    block = values.pop()
+    parameters = values.pop()
+    values.append(builder.function_declaration(values.pop(), parameters, block))
+
+
+actions = {
+    "mark": lambda values: values.append(MARK),
+    "list": lambda values: values.append(pop_list(values)),
+    "none": lambda values: values.append(None),
+    "program": lambda values: values.append(builder.program(pop_list(values))),
+    "block": lambda values: values.append(builder.block(pop_list(values))),
+    "expression-list": lambda values: values.append(builder.expression_list(pop_list(values))),
+    "array": lambda values: values.append(builder.array_expression(pop_list(values))),
+    "function-call": function_call_action,
+    "reference": reference_action,
+    "binary": binary_action,
+    "unary": unary_action,
+    "assignment": assignment_action,
+    "if": if_action,
+    "while": while_action,
+    "print": lambda values: values.append(builder.print_statement(values.pop())),
+    "return": lambda values: values.append(builder.return_statement(values.pop())),
+    "exit": lambda values: values.append(builder.exit_statement(values.pop())),
+    "function": function_action,
+}
+
+
+# the class of a token, as used in the table
+def token_class(token):
+    if type(token) in (int, float):
+        return "number"
+    if token == None:
+        return END
+    if token[0] == "$":
+        return "string"
+    if token[0] == "@":
+        return "identifier"
+    return token
+
+
+table = generate()
+
+
+def parse(tokens, start="program"):
+    stack = [("rule", start)]
+    values = []
+    token = tokens.current()
+    lookahead = token_class(token)
+    while stack:
+        kind, value = stack.pop()
+        if kind == "rule":
+            production = table[value].get(lookahead)
+            assert production != None, f"Syntax error in {value} at {token}"
+            stack.extend(production)
+        elif kind == "action":
+            actions[value](values)
+        else:
+            assert lookahead == value, f"Expected {value} at {token}"
+            if kind == "keep":
+                values.append(token)
+            elif kind == "class":
+                values.append(token[1:] if value == "string" else token)
+            tokens.discard()
+            token = tokens.current()
+            lookahead = token_class(token)
+    assert token == None, f"Syntax error at {token}"
+    return values.pop()
+
+
+def test_generate():
+    print("testing generate")
+    rules = read_grammar("a ::= 'x' [ b ] { \"y\" @z } | c\nb ::= number\nc ::= ( 'if' | b )")
+    assert rules["a"] == (
+        "alternatives",
+        [
+            (
+                "sequence",
+                [
+                    ("drop", "x"),
+                    ("optional", ("sequence", [("rule", "b")])),
+                    ("repeat", ("sequence", [("keep", "y"), ("action", "z")])),
+                ],
+            ),
+            ("sequence", [("rule", "c")]),
+        ],
+    )
+    assert rules["c"] == ("sequence", [("alternatives", [("sequence", [("drop", "#if")]), ("sequence", [("rule", "b")])])])
+    table = generate("a ::= 'x' [ b ] { \"y\" @z } | c\nb ::= number\nc ::= ( 'if' | b )", "a")
+    assert set(table["a"]) == {"x", "#if", "number"}
+    try:
+        generate("a ::= b | c\nb ::= 'x'\nc ::= 'x' 'y'", "a")
+        raise Exception("An error was expected.")
+    except AssertionError as error:
+        assert "not LL(1)" in str(error)
+
+
+def test_parse():
+    print("testing ll1 parse")
+    import parser
+
+    sources = [
+        "",
+        "print(1+2); {print(3); print(4)}",
+        "0; x = 1;",
+        'x = [1, [2, 3], []]; y.z[x[0]].w = -f(x, "a", 2.5)',
+        "if (x <= 1 == y) { print() } else { while (x) { x = x - 1; } }; if (1) {}",
+        "function add(a, b,) { return (a + b) }; exit(add(1, 2,) * -(3 / 4))",
+        "x = 1--2 * -y; z = a < b + c; w = 1 - 2 - 3 / 4 / 5",
+        "x >= 1 = 2",
+    ]
+    for source in sources:
+        assert parse(tokenize(source)) == parser.parse(tokenize(source)), source
+    # nesting uses the explicit stack, not Python recursion
+    ast = parse(tokenize("x = " + "-(" * 5000 + "1" + ")" * 5000))
+    expression = ast["statements"][0]["expression"]
+    for i in range(5000):
+        expression = expression["expression"]
+    assert expression == 1
+    for source in ["x = ", "{print(1) print(2)}", "if (1) print(2)", "f(1 2)", "{;}", "x;;y", "(1"]:
+        try:
+            parse(tokenize(source))
+            raise Exception("An error was expected.")
+        except AssertionError as error:
+            assert "Expected" in str(error) or "Syntax error" in str(error), error
+
+
+if __name__ == "__main__":
+    test_generate()
+    test_parse()
+    print("done.")
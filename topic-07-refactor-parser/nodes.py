@@ -0,0 +1,292 @@
+# AST node classes, a compact alternative to the parser's dicts
+#
+# Each node class stores its fields in __slots__, so a node has no
+# per-instance dict, and evaluators can dispatch on the class rather than
+# comparing node["type"] strings. `parse(tokens, NodeBuilder())` builds
+# these nodes directly. to_dict() and from_dict() convert between nodes
+# and the dict form, for code that expects dicts.
+
+from tokenizer import tokenize
+import parser
+
+
+class Node:
+    __slots__ = ()
+    type = None
+    # (dict key, attribute) for each field, in dict order
+    fields = ()
+
+    def __eq__(this, other):
+        return type(this) is type(other) and all(
+            getattr(this, attribute) == getattr(other, attribute)
+            for key, attribute in this.fields
+        )
+
+    def __repr__(this):
+        values = ", ".join(repr(getattr(this, attribute)) for key, attribute in this.fields)
+        return f"{type(this).__name__}({values})"
+
+
+class Unary(Node):
+    __slots__ = ("operator", "expression")
+    type = "unary"
+    fields = (("operator", "operator"), ("expression", "expression"))
+
+    def __init__(this, operator, expression):
+        this.operator = operator
+        this.expression = expression
+
+
+class Binary(Node):
+    __slots__ = ("left", "operator", "right")
+    type = "binary"
+    fields = (("left", "left"), ("operator", "operator"), ("right", "right"))
+
+    def __init__(this, left, operator, right):
+        this.left = left
+        this.operator = operator
+        this.right = right
+
+
+class Reference(Node):
+    __slots__ = ("name", "indexes")
+    type = "reference"
+    fields = (("name", "name"), ("indexes", "indexes"))
+
+    def __init__(this, name, indexes=None):
+        this.name = name
+        this.indexes = [] if indexes == None else indexes
+
+
+class FunctionCall(Node):
+    __slots__ = ("reference", "expressions")
+    type = "function_call"
+    fields = (("reference", "reference"), ("expressions", "expressions"))
+
+    def __init__(this, reference, expressions):
+        this.reference = reference
+        this.expressions = expressions
+
+
+class ArrayExpression(Node):
+    __slots__ = ("expressions",)
+    type = "array-expression"
+    fields = (("expressions", "expressions"),)
+
+    def __init__(this, expressions):
+        this.expressions = expressions
+
+
+class ExpressionList(Node):
+    __slots__ = ("expressions",)
+    type = "expression-list"
+    fields = (("expressions", "expressions"),)
+
+    def __init__(this, expressions):
+        this.expressions = expressions
+
+
+class Block(Node):
+    __slots__ = ("statements",)
+    type = "block"
+    fields = (("statements", "statements"),)
+
+    def __init__(this, statements):
+        this.statements = statements
+
+
+class If(Node):
+    __slots__ = ("condition", "then_block", "else_block")
+    type = "if"
+    fields = (("condition", "condition"), ("then", "then_block"), ("else", "else_block"))
+
+    def __init__(this, condition, then_block, else_block):
+        this.condition = condition
+        this.then_block = then_block
+        this.else_block = else_block
+
+
+class While(Node):
+    __slots__ = ("condition", "do_block")
+    type = "while"
+    fields = (("condition", "condition"), ("do", "do_block"))
+
+    def __init__(this, condition, do_block):
+        this.condition = condition
+        this.do_block = do_block
+
+
+class Print(Node):
+    __slots__ = ("expression_list",)
+    type = "print"
+    fields = (("expression_list", "expression_list"),)
+
+    def __init__(this, expression_list):
+        this.expression_list = expression_list
+
+
+class Return(Node):
+    __slots__ = ("expression",)
+    type = "return"
+    fields = (("expression", "expression"),)
+
+    def __init__(this, expression):
+        this.expression = expression
+
+
+class Exit(Node):
+    __slots__ = ("expression",)
+    type = "exit"
+    fields = (("expression", "expression"),)
+
+    def __init__(this, expression):
+        this.expression = expression
+
+
+class FunctionDeclaration(Node):
+    __slots__ = ("name", "parameters", "block")
+    type = "function_declaraction"
+    fields = (("name", "name"), ("parameters", "parameters"), ("block", "block"))
+
+    def __init__(this, name, parameters, block):
+        this.name = name
+        this.parameters = parameters
+        this.block = block
+
+
+class Assignment(Node):
+    __slots__ = ("reference", "expression")
+    type = "assignment"
+    fields = (("reference", "reference"), ("expression", "expression"))
+
+    def __init__(this, reference, expression):
+        this.reference = reference
+        this.expression = expression
+
+
+class Program(Node):
+    __slots__ = ("statements",)
+    type = "program"
+    fields = (("statements", "statements"),)
+
+    def __init__(this, statements):
+        this.statements = statements
+
+
+node_classes = {
+    node_class.type: node_class
+    for node_class in [
+        Unary,
+        Binary,
+        Reference,
+        FunctionCall,
+        ArrayExpression,
+        ExpressionList,
+        Block,
+        If,
+        While,
+        Print,
+        Return,
+        Exit,
+        FunctionDeclaration,
+        Assignment,
+        Program,
+    ]
+}
+
+
+# a builder for parse() whose methods are the node classes themselves
+class NodeBuilder:
+    def constant(this, value):
+        return value
+
+    unary = Unary
+    binary = Binary
+    reference = Reference
+    function_call = FunctionCall
+    array_expression = ArrayExpression
+    expression_list = ExpressionList
+    block = Block
+    if_statement = If
+    while_statement = While
+    print_statement = Print
+    return_statement = Return
+    exit_statement = Exit
+    function_declaration = FunctionDeclaration
+    assignment = Assignment
+    program = Program
+
+    def function_body(this, tokens):
+        return parser.parse_block(tokens, this)
+
+
+def to_dict(value):
+    if isinstance(value, Node):
+        result = {"type": value.type}
+        for key, attribute in value.fields:
+            result[key] = to_dict(getattr(value, attribute))
+        if result.get("indexes", None) == []:
+            # references without indexes have no "indexes" entry
+            del result["indexes"]
+        return result
+    if type(value) is list:
+        return [to_dict(item) for item in value]
+    return value
+
+
+def from_dict(value):
+    if isinstance(value, parser.dict_types):
+        node_class = node_classes[value["type"]]
+        return node_class(
+            *[from_dict(value.get(key, [])) for key, attribute in node_class.fields]
+        )
+    if type(value) is list:
+        return [from_dict(item) for item in value]
+    return value
+
+
+sources = [
+    "print(1+2); {print(3); print(4)}",
+    "x = [1, [2, 3], []]; y.z[x[0]].w = -f(x, \"a\")",
+    "if (x <= 1 == y) { print() } else { while (x) { x = x - 1 } }; if (1) {}",
+    "function add(a, b) { return (a + b) }; exit(add(1, 2) * -(3 / 4))",
+]
+
+
+def test_node_builder():
+    print("testing node builder")
+    for source in sources:
+        ast = parser.parse(tokenize(source))
+        program = parser.parse(tokenize(source), NodeBuilder())
+        assert type(program) is Program
+        assert to_dict(program) == ast
+        assert from_dict(ast) == program
+    # references without indexes each get their own list
+    x, y = Reference("@x"), Reference("@y")
+    x.indexes.append("@z")
+    assert y.indexes == []
+    # without a builder, parse makes dicts
+    assert parser.parse(tokenize("x")) == {
+        "type": "program",
+        "statements": [{"type": "reference", "name": "@x"}],
+    }
+
+
+def test_nodes():
+    print("testing nodes")
+    program = parser.parse(tokenize("x.y = -2 * z[1]"), NodeBuilder())
+    assignment = program.statements[0]
+    assert assignment.reference == Reference("@x", ["@y"])
+    assert assignment.expression.left == Unary("-", 2)
+    assert assignment.expression.right.indexes == [1]
+    assert repr(Binary(1, "+", 2)) == "Binary(1, '+', 2)"
+    assert not hasattr(assignment, "__dict__")
+    ast = parser.parse(tokenize("if (1) {} else {x}"), NodeBuilder()).statements[0]
+    assert ast.else_block.statements == [Reference("@x")]
+    assert to_dict(ast)["else"] == {"type": "block", "statements": [{"type": "reference", "name": "@x"}]}
+
+
+if __name__ == "__main__":
+    test_node_builder()
+    test_nodes()
+    print("done.")
@@ -0,0 +1,191 @@
+import re
+from array import array
+from bisect import bisect_left
+from concurrent.futures import ProcessPoolExecutor
+
+from tokenizer import tokenize, List
+from parser import parse
+from token_store import TokenStore, store_tokens
+
+# string literals and comments, the only parts of the source that may
+# contain newlines or each other's delimiters
+literal_pattern = re.compile(r'"[^"]*(?:""[^"]*)*"|//[^\n]*')
+
+# inputs smaller than this are tokenized serially
+minimum_parallel_size = 1024 * 1024
+
+# programs with fewer tokens than this are parsed serially
+minimum_parallel_tokens = 100000
+
+
+# offsets just after newlines that are outside string literals and
+# comments, at or after each of the given target offsets
+def split_points(characters, targets):
+    points = []
+    literals = literal_pattern.finditer(characters)
+    literal = next(literals, None)
+    for target in sorted(targets):
+        pos = max([target] + points[-1:])
+        while True:
+            newline = characters.find("\n", pos)
+            if newline == -1 or newline + 1 == len(characters):
+                return points
+            while literal != None and literal.end() <= newline:
+                literal = next(literals, None)
+            if literal != None and literal.start() <= newline:
+                # the newline is inside a string literal
+                pos = literal.end()
+                continue
+            if points[-1:] != [newline + 1]:
+                points.append(newline + 1)
+            break
+    return points
+
+
+# lex one chunk in a worker process, with offsets relative to the whole source
+def lex_chunk(characters, base):
+    store = store_tokens(characters)
+    starts = array("i", [start + base for start in store.starts])
+    ends = array("i", [end + base for end in store.ends])
+    return store.kinds, store.values, starts, ends, store.constants
+
+
+# tokenize into a token store, lexing chunks of the source in parallel
+def store_tokens_parallel(characters, workers=4):
+    if workers <= 1 or len(characters) < minimum_parallel_size:
+        return store_tokens(characters)
+    size = len(characters) // workers
+    points = [0] + split_points(characters, [size * i for i in range(1, workers)])
+    points.append(len(characters))
+    store = TokenStore(characters)
+    with ProcessPoolExecutor(workers) as executor:
+        futures = [
+            executor.submit(lex_chunk, characters[start:stop], start)
+            for start, stop in zip(points, points[1:])
+        ]
+        for future in futures:
+            kinds, values, starts, ends, constants = future.result()
+            mapping = [store.intern(constant) for constant in constants]
+            store.kinds.extend(kinds)
+            store.values.extend(array("I", [mapping[value] for value in values]))
+            store.starts.extend(starts)
+            store.ends.extend(ends)
+    return store
+
+
+# token indexes of top-level function declarations that follow a
+# top-level ";", found by matching brackets
+def function_starts(tokens):
+    starts = []
+    depth = 0
+    for i, token in enumerate(tokens):
+        if token in ("{", "(", "["):
+            depth += 1
+        elif token in ("}", ")", "]"):
+            depth -= 1
+        elif token == ";" and depth == 0 and i + 1 < len(tokens) and tokens[i + 1] == "#function":
+            starts.append(i + 1)
+    return starts
+
+
+# parse a run of top-level statements in a worker process
+def parse_chunk(tokens):
+    return parse(List(tokens))["statements"]
+
+
+# parse a list of tokens, parsing runs of top-level statements that start
+# at function declarations in parallel
+def parse_parallel(tokens, workers=4):
+    if workers <= 1 or len(tokens) < minimum_parallel_tokens:
+        return parse(List(tokens))
+    starts = function_starts(tokens)
+    points = [0]
+    for i in range(1, workers):
+        k = bisect_left(starts, len(tokens) * i // workers)
+        if k < len(starts) and starts[k] > points[-1]:
+            points.append(starts[k])
+    points.append(len(tokens))
+    statements = []
+    with ProcessPoolExecutor(workers) as executor:
+        futures = [
+            executor.submit(parse_chunk, tokens[start:stop])
+            for start, stop in zip(points, points[1:])
+        ]
+        for future in futures:
+            statements.extend(future.result())
+    return {"type": "program", "statements": statements}
+
+
+def test_split_points():
+    print("testing split points")
+    source = 'x = 1;\ny = "a\nb";\n// c "\nz = "d"\n'
+    # every newline outside a string or comment
+    assert split_points(source, range(len(source))) == [7, 18, 25]
+    assert split_points(source, [8]) == [18]
+    assert split_points(source, [19]) == [25]
+    assert split_points(source, [30]) == []
+    assert split_points("x = 1", [2]) == []
+
+
+def test_store_tokens_parallel():
+    print("testing store tokens parallel")
+    global minimum_parallel_size
+    source = 'x = "a\n""b"""; // comment "\nwhile (x) { print(x[1], 2.5) }\n' * 50
+    expected = store_tokens(source)
+    size = minimum_parallel_size
+    minimum_parallel_size = 0
+    try:
+        for workers in [1, 2, 3, 8]:
+            store = store_tokens_parallel(source, workers)
+            assert store.tokens() == expected.tokens()
+            assert store.kinds == expected.kinds
+            assert store.starts == expected.starts and store.ends == expected.ends
+            assert store.source == source
+        try:
+            store_tokens_parallel(source + "x = 1 ? 2\n" + source, 2)
+            raise Exception("An error was expected.")
+        except AssertionError:
+            pass
+    finally:
+        minimum_parallel_size = size
+
+
+def test_function_starts():
+    print("testing function starts")
+    tokens = tokenize("function f() {}; x = 1; function g(a) { function h() {}; return (a) };function k() {}").list
+    assert [tokens[i + 1] for i in function_starts(tokens)] == ["@g", "@k"]
+    assert function_starts(tokenize("function f() {}").list) == []
+
+
+def test_parse_parallel():
+    print("testing parse parallel")
+    global minimum_parallel_tokens
+    source = ";".join(
+        f"function f{i}(x) {{ if (x) {{ function g() {{}}; return (x * {i}) }} }}; y{i} = f{i}([{i}, 2])"
+        for i in range(40)
+    )
+    tokens = tokenize(source).list
+    expected = parse(List(tokens))
+    size = minimum_parallel_tokens
+    minimum_parallel_tokens = 0
+    try:
+        for workers in [1, 2, 3, 8]:
+            assert parse_parallel(tokens, workers) == expected
+        # a program without separate functions is parsed as one chunk
+        short = tokenize("function f() {}; x = 1").list
+        assert parse_parallel(short, 4) == parse(List(short))
+        try:
+            parse_parallel(tokens + tokenize("; function f() { x = }").list, 2)
+            raise Exception("An error was expected.")
+        except AssertionError:
+            pass
+    finally:
+        minimum_parallel_tokens = size
+
+
+if __name__ == "__main__":
+    test_split_points()
+    test_store_tokens_parallel()
+    test_function_starts()
+    test_parse_parallel()
+    print("done.")
@@ -1,4 +1,7 @@
-from tokenizer import tokenize
+import io
+from collections.abc import MutableMapping
+from tokenizer import tokenize, generate_tokens, Stream, List
+from token_store import NUMBER, STRING, KEYWORD, SYMBOL
 from pprint import pprint
 
 ebnf = """
@@ -51,7 +54,11 @@ ebnf = """
 
 <function_call>          ::= <reference> <expression-list> 
 
-<expression>              ::= <term> { ('+' | '-') <term> } 
+<expression>              ::= <relation> { ('==' | '!=') <relation> }
+
+<relation>                ::= <sum> { ('<' | '<=' | '>' | '>=') <sum> }
+
+<sum>                     ::= <term> { ('+' | '-') <term> }
 
 
 
@@ -60,7 +67,9 @@ ebnf = """
 
 
 
-<term>           ::= <factor> { ('*' | '/') <factor> } 
+<term>           ::= <unary> { ('*' | '/') <unary> } 
+
+<unary>          ::= '-' <unary> | <factor>
 
 <factor>         ::= <number> 
                    | <reference> 
@@ -73,6 +82,160 @@ ebnf = """
 <expression-list> ::= <expression> { ',' <expression> }
 """
 
+### NODES
+
+# The parse functions create AST nodes through a builder, with one method
+# per kind of node, which each parse function passes on to the ones it
+# calls. DictBuilder makes the usual dicts; parse() can be given another
+# builder, such as nodes.NodeBuilder, to build other forms. A builder's
+# function_body() parses the block of a function declaration, so that a
+# builder can put off parsing it, as LazyBuilder does.
+
+
+class DictBuilder:
+    # numbers and strings are their own nodes
+    def constant(this, value):
+        return value
+
+    def unary(this, operator, expression):
+        return {"type": "unary", "operator": operator, "expression": expression}
+
+    def binary(this, left, operator, right):
+        return {"type": "binary", "left": left, "operator": operator, "right": right}
+
+    def reference(this, name, indexes):
+        if indexes == []:
+            return {"type": "reference", "name": name}
+        return {"type": "reference", "name": name, "indexes": indexes}
+
+    def function_call(this, reference, expressions):
+        return {"type": "function_call", "reference": reference, "expressions": expressions}
+
+    def array_expression(this, expressions):
+        return {"type": "array-expression", "expressions": expressions}
+
+    def expression_list(this, expressions):
+        return {"type": "expression-list", "expressions": expressions}
+
+    def block(this, statements):
+        return {"type": "block", "statements": statements}
+
+    def if_statement(this, condition, then_block, else_block):
+        return {"type": "if", "condition": condition, "then": then_block, "else": else_block}
+
+    def while_statement(this, condition, do_block):
+        return {"type": "while", "condition": condition, "do": do_block}
+
+    def print_statement(this, expression_list):
+        return {"type": "print", "expression_list": expression_list}
+
+    def return_statement(this, expression):
+        return {"type": "return", "expression": expression}
+
+    def exit_statement(this, expression):
+        return {"type": "exit", "expression": expression}
+
+    def function_declaration(this, name, parameters, block):
+        return {
+            "type": "function_declaraction",
+            "name": name,
+            "parameters": parameters,
+            "block": block,
+        }
+
+    def assignment(this, reference, expression):
+        return {"type": "assignment", "reference": reference, "expression": expression}
+
+    def program(this, statements):
+        return {"type": "program", "statements": statements}
+
+    def function_body(this, tokens):
+        return parse_block(tokens, this)
+
+
+node_builder = DictBuilder()
+
+
+# a node that acts as a dict, and whose contents are computed by load()
+# the first time it is used. It is a mapping rather than a dict, since
+# code that reads a dict directly (json, marshal) would see it empty
+# before it is loaded; such code is given materialize(), the whole tree
+# as plain dicts and lists, or raises an error for the mapping.
+class LazyDict(MutableMapping):
+    __slots__ = ("contents",)
+
+    @property
+    def loaded(this):
+        return this.contents != None
+
+    # the node's own fields, loaded on first use
+    def fields(this):
+        if this.contents == None:
+            this.contents = this.load()
+        return this.contents
+
+    def materialize(this):
+        return materialize(this)
+
+    def __getitem__(this, key):
+        return this.fields()[key]
+
+    def __setitem__(this, key, value):
+        this.fields()[key] = value
+
+    def __delitem__(this, key):
+        del this.fields()[key]
+
+    def get(this, key, default=None):
+        return this.fields().get(key, default)
+
+    def __contains__(this, key):
+        return key in this.fields()
+
+    def __iter__(this):
+        return iter(this.fields())
+
+    def __len__(this):
+        return len(this.fields())
+
+    def keys(this):
+        return this.fields().keys()
+
+    def values(this):
+        return this.fields().values()
+
+    def items(this):
+        return this.fields().items()
+
+    def __eq__(this, other):
+        if isinstance(other, LazyDict):
+            other = other.fields()
+        return this.fields() == other
+
+    def __repr__(this):
+        return repr(this.fields())
+
+    def copy(this):
+        return dict(this.fields())
+
+    # copies and pickles are plain dicts
+    def __reduce__(this):
+        return dict, (this.fields(),)
+
+
+# the classes of the nodes that are not constants
+dict_types = (dict, LazyDict)
+
+
+# a plain dict copy of a whole tree, loading every lazy node
+def materialize(value):
+    if isinstance(value, dict_types):
+        return {key: materialize(item) for key, item in value.items()}
+    if type(value) is list:
+        return [materialize(item) for item in value]
+    return value
+
+
 ### EXPRESSIONS
 
 
@@ -103,7 +266,7 @@ def test_parse_identifier():
         pass
 
 
-def parse_reference(tokens):
+def parse_reference(tokens, builder=node_builder):
     """
     A reference identifies location holding a value that may be set or retrieved.
 
@@ -114,15 +277,12 @@ def parse_reference(tokens):
     while tokens.current() in [".", "["]:
         if tokens.current() == "[":
             tokens.discard("[")
-            indexes.append(parse_expression(tokens))
+            indexes.append(parse_expression(tokens, 0, builder))
             tokens.discard("]")
         if tokens.current() == ".":
             tokens.discard(".")
             indexes.append(parse_identifier(tokens))
-    if indexes == []:
-        return {"type": "reference", "name": name}
-    else:
-        return {"type": "reference", "name": name, "indexes": indexes}
+    return builder.reference(name, indexes)
 
 
 def test_parse_reference():
@@ -136,7 +296,7 @@ def test_parse_reference():
     assert ast == {"type": "reference", "name": "@x", "indexes": [1, 2, 3]}
 
 
-def parse_expression_list(tokens):
+def parse_expression_list(tokens, builder=node_builder):
     """
     An expression list is a parenthesized list of zero or more expressions.
 
@@ -145,11 +305,11 @@ def parse_expression_list(tokens):
     tokens.discard("(")
     expressions = []
     while tokens.current() != ")":
-        expressions.append(parse_expression(tokens))
+        expressions.append(parse_expression(tokens, 0, builder))
         if tokens.current() != ")":
             tokens.discard(",")
     tokens.discard(")")
-    return {"type": "expression-list", "expressions": expressions}
+    return builder.expression_list(expressions)
 
 
 def test_parse_expression_list():
@@ -169,7 +329,7 @@ def test_parse_expression_list():
     }
 
 
-def parse_function_call(reference, tokens):
+def parse_function_call(reference, tokens, builder=node_builder):
     """
     A function_call invokes a function with a list of zero or more arguments.
     Note that the reference is passed in.
@@ -179,15 +339,11 @@ def parse_function_call(reference, tokens):
     expressions = []
     tokens.discard("(")
     while tokens.current() != ")":
-        expressions.append(parse_expression(tokens))
+        expressions.append(parse_expression(tokens, 0, builder))
         if tokens.current() != ")":
             tokens.discard(",")
     tokens.discard(")")
-    return {
-        "type": "function_call",
-        "reference": reference,
-        "expressions": expressions,
-    }
+    return builder.function_call(reference, expressions)
 
 
 def test_parse_function_call():
@@ -212,7 +368,7 @@ def test_parse_function_call():
     }
 
 
-def parse_array_expression(tokens):
+def parse_array_expression(tokens, builder=node_builder):
     """
     An array_expression list is a bracketed list of zero or more expressions.
 
@@ -221,11 +377,11 @@ def parse_array_expression(tokens):
     tokens.discard("[")
     expressions = []
     while tokens.current() != "]":
-        expressions.append(parse_expression(tokens))
+        expressions.append(parse_expression(tokens, 0, builder))
         if tokens.current() != "]":
             tokens.discard(",")
     tokens.discard("]")
-    return {"type": "array-expression", "expressions": expressions}
+    return builder.array_expression(expressions)
 
 
 def test_parse_array_expression():
@@ -237,7 +393,7 @@ def test_parse_array_expression():
     assert ast == {"type": "array-expression", "expressions": [1, 2]}
 
 
-def parse_factor(tokens):
+def parse_factor(tokens, builder=node_builder):
     """
     <factor>     ::= <number>
                    | <string>              #not implemented yet
@@ -248,22 +404,38 @@ def parse_factor(tokens):
 
     """
     token = tokens.current()
-    if type(token) in [int, float]:
+    if tokens.has_kinds:
+        # the token source knows the kind of each token
+        kind = tokens.kind()
+        if kind == NUMBER:
+            tokens.skip()
+            return builder.constant(token)
+        if kind == STRING:
+            tokens.skip()
+            return builder.constant(token[1:])
+        if kind != SYMBOL:
+            # an identifier; a keyword fails in parse_identifier
+            return parse_reference_or_call(tokens, builder)
+    elif type(token) in (int, float):
         tokens.discard(token)
-        return token
-    if token.startswith("$"):
+        return builder.constant(token)
+    elif token[0] == "$":
         tokens.discard(token)
-        return token[1:]
+        return builder.constant(token[1:])
     if token == "(":
         tokens.discard("(")
-        expression = parse_expression(tokens)
+        expression = parse_expression(tokens, 0, builder)
         tokens.discard(")")
         return expression
     if token == "[":
-        return parse_array_expression(tokens)
-    reference = parse_reference(tokens)
+        return parse_array_expression(tokens, builder)
+    return parse_reference_or_call(tokens, builder)
+
+
+def parse_reference_or_call(tokens, builder=node_builder):
+    reference = parse_reference(tokens, builder)
     if tokens.current() == "(":
-        return parse_function_call(reference, tokens)
+        return parse_function_call(reference, tokens, builder)
     return reference
 
 
@@ -296,45 +468,48 @@ def test_parse_factor():
     }
 
 
-def parse_term(tokens):
-    """<term>     ::= <factor> { ('*' | '/') <factor> }"""
-    left_factor = parse_factor(tokens)
-    while tokens.current() in ["*", "/"]:
-        operator = tokens.current()
-        tokens.discard(operator)
-        right_factor = parse_factor(tokens)
-        left_factor = {
-            "type": "binary",
-            "left": left_factor,
-            "operator": operator,
-            "right": right_factor,
-        }
-    return left_factor
-
+# binding powers of the binary operators; higher binds tighter, and all
+# operators are left associative
+binding_powers = {
+    "==": 1,
+    "!=": 1,
+    "<": 2,
+    "<=": 2,
+    ">": 2,
+    ">=": 2,
+    "+": 3,
+    "-": 3,
+    "*": 4,
+    "/": 4,
+}
 
-def test_parse_term():
-    ast = parse_term(tokenize("1"))
-    assert ast == 1
-    ast = parse_term(tokenize("1*2"))
-    assert ast == {"type": "binary", "left": 1, "operator": "*", "right": 2}
-    ast = parse_term(tokenize("1/2"))
-    assert ast == {"type": "binary", "left": 1, "operator": "/", "right": 2}
+# unary minus binds tighter than any binary operator
+unary_power = 5
 
 
-def parse_expression(tokens):
-    """<expression>     ::= <term> { ('+' | '-') <term> }"""
-    left_term = parse_term(tokens)
-    while tokens.current() in ["+", "-"]:
+def parse_expression(tokens, minimum=0, builder=node_builder):
+    """
+    Expressions are parsed by precedence climbing with the binding_powers
+    table, using one call per operator instead of one per precedence level.
+
+    <expression> ::= <relation> { ('==' | '!=') <relation> }
+    <relation>   ::= <sum> { ('<' | '<=' | '>' | '>=') <sum> }
+    <sum>        ::= <term> { ('+' | '-') <term> }
+    <term>       ::= <unary> { ('*' | '/') <unary> }
+    <unary>      ::= '-' <unary> | <factor>
+    """
+    if tokens.current() == "-":
+        tokens.discard("-")
+        left = builder.unary("-", parse_expression(tokens, unary_power, builder))
+    else:
+        left = parse_factor(tokens, builder)
+    while True:
         operator = tokens.current()
+        power = binding_powers.get(operator) if type(operator) is str else None
+        if power == None or power <= minimum:
+            return left
         tokens.discard(operator)
-        right_term = parse_term(tokens)
-        left_term = {
-            "type": "binary",
-            "left": left_term,
-            "operator": operator,
-            "right": right_term,
-        }
-    return left_term
+        left = builder.binary(left, operator, parse_expression(tokens, power, builder))
 
 
 def test_parse_expression():
@@ -379,6 +554,48 @@ def test_parse_expression():
         "reference": {"type": "reference", "name": "@x"},
         "expressions": [1, 2, 3],
     }
+    ast = parse_expression(tokenize("1-2-3"))
+    assert ast == {
+        "type": "binary",
+        "left": {"type": "binary", "left": 1, "operator": "-", "right": 2},
+        "operator": "-",
+        "right": 3,
+    }
+    ast = parse_expression(tokenize("x<y+1==z"))
+    assert ast == {
+        "type": "binary",
+        "left": {
+            "type": "binary",
+            "left": {"type": "reference", "name": "@x"},
+            "operator": "<",
+            "right": {
+                "type": "binary",
+                "left": {"type": "reference", "name": "@y"},
+                "operator": "+",
+                "right": 1,
+            },
+        },
+        "operator": "==",
+        "right": {"type": "reference", "name": "@z"},
+    }
+    ast = parse_expression(tokenize("-x*2"))
+    assert ast == {
+        "type": "binary",
+        "left": {"type": "unary", "operator": "-", "expression": {"type": "reference", "name": "@x"}},
+        "operator": "*",
+        "right": 2,
+    }
+    ast = parse_expression(tokenize("1--2"))
+    assert ast == {
+        "type": "binary",
+        "left": 1,
+        "operator": "-",
+        "right": {"type": "unary", "operator": "-", "expression": 2},
+    }
+    # a statement ends the expression at the assignment
+    tokens = tokenize("x >= 1 = 2")
+    parse_expression(tokens)
+    assert tokens.current() == "="
 
 
 def test_expressions():
@@ -388,25 +605,24 @@ def test_expressions():
     test_parse_function_call()
     test_parse_array_expression()
     test_parse_factor()
-    test_parse_term()
     test_parse_expression()
 
 
 ### STATEMENTS
 
 
-def parse_block(tokens):
+def parse_block(tokens, builder=node_builder):
     """ 
     <block> ::= '{' [<statement> { ';' <statement> }] '}'
     """
     tokens.discard("{")
     statements = []
     while tokens.current() != "}":
-        statements.append(parse_statement(tokens))
+        statements.append(parse_statement(tokens, builder))
         if tokens.current() != "}":
             tokens.discard(";")
     tokens.discard("}")
-    return {"type": "block", "statements": statements}
+    return builder.block(statements)
 
 
 def test_parse_block():
@@ -457,26 +673,21 @@ def test_parse_block():
     }
 
 
-def parse_if_statement(tokens):
+def parse_if_statement(tokens, builder=node_builder):
     """
     <if-statement>   ::= 'if' '(' <expression> ')' <block> ['else' <block>]
     """
     tokens.discard("#if")
     tokens.discard("(")
-    condition = parse_expression(tokens)
+    condition = parse_expression(tokens, 0, builder)
     tokens.discard(")")
-    then_block = parse_block(tokens)
+    then_block = parse_block(tokens, builder)
     if tokens.current() == "#else":
         tokens.discard("#else")
-        else_block = parse_block(tokens)
+        else_block = parse_block(tokens, builder)
     else:
         else_block = None
-    return {
-        "type": "if",
-        "condition": condition,
-        "then": then_block,
-        "else": else_block,
-    }
+    return builder.if_statement(condition, then_block, else_block)
 
 
 def test_parse_if_statement():
@@ -496,20 +707,16 @@ def test_parse_if_statement():
     }
 
 
-def parse_while_statement(tokens):
+def parse_while_statement(tokens, builder=node_builder):
     """
     <while-statement> ::= 'while' '(' <expression> ')' <statement>
     """
     tokens.discard("#while")
     tokens.discard("(")
-    condition = parse_expression(tokens)
+    condition = parse_expression(tokens, 0, builder)
     tokens.discard(")")
-    do_block = parse_block(tokens)
-    return {
-        "type": "while",
-        "condition": condition,
-        "do": do_block,
-    }
+    do_block = parse_block(tokens, builder)
+    return builder.while_statement(condition, do_block)
 
 
 def test_parse_while_statement():
@@ -521,16 +728,13 @@ def test_parse_while_statement():
     }
 
 
-def parse_print_statement(tokens):
+def parse_print_statement(tokens, builder=node_builder):
     """
     <print-statement> ::= 'print' <expression-list>
     """
     tokens.discard("#print")
-    expression_list = parse_expression_list(tokens)
-    return {
-        "type": "print",
-        "expression_list": expression_list,
-    }
+    expression_list = parse_expression_list(tokens, builder)
+    return builder.print_statement(expression_list)
 
 
 def test_parse_print_statement():
@@ -541,18 +745,15 @@ def test_parse_print_statement():
     }
 
 
-def parse_return_statement(tokens):
+def parse_return_statement(tokens, builder=node_builder):
     """
     <return-statement> ::= 'return' '(' <expression> ')'
     """
     tokens.discard("#return")
     tokens.discard("(")
-    expression = parse_expression(tokens)
+    expression = parse_expression(tokens, 0, builder)
     tokens.discard(")")
-    return {
-        "type": "return",
-        "expression": expression,
-    }
+    return builder.return_statement(expression)
 
 
 def test_parse_return_statement():
@@ -560,18 +761,15 @@ def test_parse_return_statement():
     assert ast == {"type": "return", "expression": 1}
 
 
-def parse_exit_statement(tokens):
+def parse_exit_statement(tokens, builder=node_builder):
     """
     <exit-statement> ::= 'exit' '(' <expression> ')'
     """
     tokens.discard("#exit")
     tokens.discard("(")
-    expression = parse_expression(tokens)
+    expression = parse_expression(tokens, 0, builder)
     tokens.discard(")")
-    return {
-        "type": "exit",
-        "expression": expression,
-    }
+    return builder.exit_statement(expression)
 
 
 def test_parse_exit_statement():
@@ -579,7 +777,64 @@ def test_parse_exit_statement():
     assert ast == {"type": "exit", "expression": 1}
 
 
-def parse_function_declaration(tokens):
+# the tokens of a block, discarded by matching braces
+def skip_block(tokens):
+    assert tokens.current() == "{"
+    if type(tokens) is List:
+        # scan the list directly
+        depth = 0
+        for end in range(tokens.position, len(tokens.tokens)):
+            token = tokens.tokens[end]
+            if token == "{":
+                depth += 1
+            elif token == "}":
+                depth -= 1
+                if depth == 0:
+                    body = tokens.tokens[tokens.position : end + 1]
+                    tokens.reset(end + 1)
+                    return body
+        assert False, "Unterminated block"
+    body = []
+    depth = 0
+    while True:
+        token = tokens.current()
+        assert token != None, "Unterminated block"
+        tokens.skip()
+        body.append(token)
+        if token == "{":
+            depth += 1
+        elif token == "}":
+            depth -= 1
+            if depth == 0:
+                return body
+
+
+# a function body block that is parsed from its tokens on first use
+class LazyBlock(LazyDict):
+    __slots__ = ("tokens",)
+
+    def __init__(this, tokens):
+        this.contents = None
+        this.tokens = tokens
+
+    def load(this):
+        block = parse_block(List(this.tokens), lazy_builder)
+        this.tokens = None
+        return block
+
+
+# builds dicts like DictBuilder, but function bodies are only
+# brace-matched while parsing, and each is parsed the first time its
+# block is used
+class LazyBuilder(DictBuilder):
+    def function_body(this, tokens):
+        return LazyBlock(skip_block(tokens))
+
+
+lazy_builder = LazyBuilder()
+
+
+def parse_function_declaration(tokens, builder=node_builder):
     """
     <function-declaration-statement> ::= 'function' <identifier> '(' <identifier> { ',' <identifier> } ')' <block>
     """
@@ -592,13 +847,8 @@ def parse_function_declaration(tokens):
         if tokens.current() != ")":
             tokens.discard(",")
     tokens.discard(")")
-    block = parse_block(tokens)
-    return {
-        "type": "function_declaraction",
-        "name": name,
-        "parameters": parameters,
-        "block": block,
-    }
+    block = builder.function_body(tokens)
+    return builder.function_declaration(name, parameters, block)
 
 
 def test_parse_function_declaration():
@@ -611,18 +861,14 @@ def test_parse_function_declaration():
     }
 
 
-def parse_assignment(reference, tokens):
+def parse_assignment(reference, tokens, builder=node_builder):
     """
     <expression> ::= <reference> = <expression>
 
     """
     tokens.discard("=")
-    expression = parse_expression(tokens)
-    return {
-        "type": "assignment",
-        "reference": reference,
-        "expression": expression,
-    }
+    expression = parse_expression(tokens, 0, builder)
+    return builder.assignment(reference, expression)
 
 
 def test_parse_assignment():
@@ -635,7 +881,19 @@ def test_parse_assignment():
     }
 
 
-def parse_statement(tokens):
+# statements that start with a keyword or brace, by their first token
+statement_parsers = {
+    "#if": parse_if_statement,
+    "#while": parse_while_statement,
+    "#print": parse_print_statement,
+    "#return": parse_return_statement,
+    "#exit": parse_exit_statement,
+    "#function": parse_function_declaration,
+    "{": parse_block,
+}
+
+
+def parse_statement(tokens, builder=node_builder):
     """
     <statement>      ::= <if-statement> |
                         <while-statement> |
@@ -647,24 +905,21 @@ def parse_statement(tokens):
                         <assignment> |
                         <expression>
     """
-    token = tokens.current()
-    if token == "#if":
-        return parse_if_statement(tokens)
-    if token == "#while":
-        return parse_while_statement(tokens)
-    if token == "#print":
-        return parse_print_statement(tokens)
-    if token == "#return":
-        return parse_return_statement(tokens)
-    if token == "#exit":
-        return parse_exit_statement(tokens)
-    if token == "#function":
-        return parse_function_declaration(tokens)
-    if token == "{":
-        return parse_block(tokens)
-    expression = parse_expression(tokens)
+    if tokens.has_kinds:
+        # only keywords and symbols can start a statement other than an
+        # expression, so no other token is looked up
+        kind = tokens.kind()
+        if kind == KEYWORD or kind == SYMBOL:
+            token = tokens.current()
+            if token in statement_parsers:
+                return statement_parsers[token](tokens, builder)
+    else:
+        token = tokens.current()
+        if token in statement_parsers:
+            return statement_parsers[token](tokens, builder)
+    expression = parse_expression(tokens, 0, builder)
     if tokens.current() == "=":
-        return parse_assignment(expression, tokens)
+        return parse_assignment(expression, tokens, builder)
     return expression
 
 
@@ -722,31 +977,128 @@ def test_statements():
     test_parse_assignment()
     test_parse_statement()
 
-def parse(program_tokens):
-    global tokens
-    global current_token_index
-    current_token_index = 0
-    tokens = program_tokens
+def parse(tokens, builder=None, lazy=False):
+    """
+    <program> ::= [<statement> { ';' <statement> }]
+
+    With lazy=True, function bodies are parsed when first used, so syntax
+    errors inside them are reported then. Lazy bodies are dicts, and need
+    the default builder.
+    """
+    assert not (lazy and builder != None), "Lazy function bodies need the dict builder"
+    if lazy:
+        builder = lazy_builder
+    elif builder == None:
+        builder = node_builder
     statements = []
-    while tokens.current():
-        statements.append(parse_statement())
-    # return ["program", statements]
-    return {"type":"program","statements":statements}
+    while tokens.current() != None:
+        statements.append(parse_statement(tokens, builder))
+        if tokens.current() != None:
+            tokens.discard(";")
+    return builder.program(statements)
+
 
 def test_parse():
     print("testing parse")
-    program_tokens = tokenize("print 1+2; {print 3; print 4;}")
-    assert program_tokens.list == ['#print', 1, '+', 2, ';', '{', '#print', 3, ';', '#print', 4, ';', '}']
+    program_tokens = tokenize("print(1+2); {print(3); print(4)}")
+    assert program_tokens.list == ['#print', '(', 1, '+', 2, ')', ';', '{', '#print', '(', 3, ')', ';', '#print', '(', 4, ')', '}']
     ast = parse(program_tokens)
-    pprint(ast, sort_dicts=False)   
-    # assert ast == {'type': 'program', 'statements': [
-    #     {'type': 'print', 'expression': 
-    #         {'type': 'binary', 'left': 1.0, 'operator': '+', 'right': 2.0}
-    #     }, 
-    #     {'type': 'block', 'statements': [{'type': 'print', 'expression': 3.0}, {'type': 'print', 'expression': 4.0}]}]}
+    assert ast == {'type': 'program', 'statements': [
+        {'type': 'print', 'expression_list':
+            {'type': 'expression-list', 'expressions': [
+                {'type': 'binary', 'left': 1, 'operator': '+', 'right': 2}]}},
+        {'type': 'block', 'statements': [
+            {'type': 'print', 'expression_list': {'type': 'expression-list', 'expressions': [3]}},
+            {'type': 'print', 'expression_list': {'type': 'expression-list', 'expressions': [4]}}]}]}
+    ast = parse(tokenize("0; x = 1;"))
+    assert ast["statements"][0] == 0
+    assert len(ast["statements"]) == 2
+    source = "x = [1, 2]; while (x) { print(x[0], \"a\") }"
+    stream = Stream(generate_tokens(io.StringIO(source), 8))
+    assert parse(stream) == parse(tokenize(source))
+
+def test_lazy_function_bodies():
+    print("testing lazy function bodies")
+    sources = [
+        "function add(x,y) { return (x + y) }; print(add(1, 2))",
+        "function f() {}; function g(a) { function h(b) { {b = [1, [2]]} }; return (h(a)) }",
+        "x = 1; if (x) { function f(y) { while (y) { y = y - 1 } } }",
+    ]
+    for source in sources:
+        assert parse(tokenize(source), lazy=True) == parse(tokenize(source))
+    source = "function f(x) { print(x) }; function g() { this is not parsed }; f(1)"
+    ast = parse(tokenize(source), lazy=True)
+    f, g = ast["statements"][:2]
+    assert type(f["block"]) is LazyBlock and not f["block"].loaded
+    assert f["block"]["statements"][0]["type"] == "print"
+    assert f["block"].loaded and not g["block"].loaded
+    # code that reads dicts directly sees the whole body, or fails
+    import copy
+    import json
+
+    h = parse(tokenize(sources[0]), lazy=True)["statements"][0]["block"]
+    assert copy.deepcopy(h) == parse(tokenize(sources[0]))["statements"][0]["block"]
+    assert type(copy.copy(h)) is dict and type(h.copy()) is dict
+    assert json.loads(json.dumps(h.materialize())) == h
+    # materialize() loads nested bodies too
+    import marshal
+
+    source = "function f(x) { function g(y) { return (y) }; return (x) }"
+    block = parse(tokenize(source), lazy=True)["statements"][0]["block"]
+    assert json.loads(json.dumps(block.materialize())) == parse(tokenize(source))["statements"][0]["block"]
+    program = materialize(parse(tokenize(source), lazy=True))
+    assert marshal.loads(marshal.dumps(program)) == parse(tokenize(source))
+    try:
+        json.dumps(parse(tokenize(sources[0]), lazy=True))
+        raise Exception("An error was expected.")
+    except TypeError:
+        pass
+    # errors in a body are found when it is used
+    try:
+        g["block"]["statements"]
+        raise Exception("An error was expected.")
+    except AssertionError:
+        pass
+    # a token buffer that is not a List
+    stream = Stream(generate_tokens(io.StringIO(sources[1]), 8))
+    assert parse(stream, lazy=True) == parse(tokenize(sources[1]))
+    try:
+        parse(tokenize("function f() { {}"), lazy=True)
+        raise Exception("An error was expected.")
+    except AssertionError:
+        pass
+    # nested functions stay lazy until used
+    ast = parse(tokenize(sources[1]), lazy=True)
+    outer = ast["statements"][1]["block"]
+    assert type(outer["statements"][0]["block"]) is LazyBlock
+    assert not outer["statements"][0]["block"].loaded
+    # other parses stay eager
+    assert type(parse(tokenize(sources[0]))["statements"][0]["block"]) is dict
+    # subclasses of LazyBuilder are lazy too
+    class CountingBuilder(LazyBuilder):
+        calls = 0
+
+        def function_declaration(this, name, parameters, block):
+            CountingBuilder.calls += 1
+            return DictBuilder.function_declaration(this, name, parameters, block)
+
+    ast = parse(tokenize(sources[1]), CountingBuilder())
+    assert type(ast["statements"][0]["block"]) is LazyBlock and CountingBuilder.calls == 2
+    # a body loaded during another parse is built by its own builder
+    lazy = parse(tokenize("function f() { x = 1 }"), lazy=True)
+
+    class LoadingBuilder(DictBuilder):
+        def assignment(this, reference, expression):
+            lazy["statements"][0]["block"].materialize()
+            return ("assignment", reference, expression)
+
+    assert parse(tokenize("y = 2"), LoadingBuilder())["statements"][0][0] == "assignment"
+    assert lazy["statements"][0]["block"]["statements"][0]["type"] == "assignment"
+
 
 if __name__ == "__main__":
     test_expressions()
     test_statements()
     test_parse()
+    test_lazy_function_bodies()
     print("done.")
@@ -1,22 +1,66 @@
 import sys
 
-from tokenizer import tokenize
+from tokenizer import tokenize, generate_tokens, Stream, tokenize_mapped_file
 
 from parser import parse
 
+from cache import load_program
+
 from evaluator import evaluate
 
+from bytecode import compile_program, run, disassemble
+
+from transpiler import load_module, run_module
+
+from tiered import TieredEvaluator
+
 def main():
     # Check for command line arguments
-    if len(sys.argv) > 1:
-        # Filename provided, read and execute it
-        with open(sys.argv[1], 'r') as f:
-            source_code = f.read()
-        
-        tokens = tokenize(source_code)
+    arguments = sys.argv[1:]
+    if len(arguments) == 2 and arguments[0] == "--mmap":
+        # Memory-map the file and tokenize its bytes directly
+        tokens = tokenize_mapped_file(arguments[1])
         ast = parse(tokens)
         evaluate(ast)
 
+    elif len(arguments) == 2 and arguments[0] == "--cache":
+        # Reuse the parsed program from __tcache__ if the script is unchanged
+        ast = load_program(arguments[1])
+        evaluate(ast)
+
+    elif len(arguments) == 2 and arguments[0] == "--vm":
+        # Compile to bytecode and run it on the virtual machine
+        with open(arguments[1], 'r') as f:
+            ast = parse(tokenize(f.read()))
+        run(compile_program(ast))
+
+    elif len(arguments) == 2 and arguments[0] == "--dis":
+        # Print the bytecode of a program without running it
+        with open(arguments[1], 'r') as f:
+            ast = parse(tokenize(f.read()))
+        print(disassemble(compile_program(ast)))
+
+    elif len(arguments) == 2 and arguments[0] == "--py":
+        # Run the program as a Python module, transpiled once into __tcache__
+        run_module(load_module(arguments[1]))
+
+    elif len(arguments) == 2 and arguments[0] == "--tiered":
+        # Interpret, compiling hot functions and loops, then report what was compiled
+        with open(arguments[1], 'r') as f:
+            ast = parse(tokenize(f.read()))
+        tiers = TieredEvaluator()
+        try:
+            tiers.evaluate(ast)
+        finally:
+            print(tiers.report(), file=sys.stderr)
+
+    elif len(arguments) > 0:
+        # Filename provided, tokenize it in chunks as the parser reads it
+        with open(arguments[0], 'r') as f:
+            tokens = Stream(generate_tokens(f))
+            ast = parse(tokens)
+        evaluate(ast)
+
     else:
         # REPL loop
         while True:
@@ -0,0 +1,306 @@
+# a parser that builds the same AST as parser.py without Python recursion
+#
+# Each parse function here is a generator that mirrors the recursive
+# function of the same name in parser.py. Where that function would call
+# another parse function, this one yields (function, arguments...) and
+# is sent back the result. run() keeps the suspended generators on an
+# explicit stack, so the Python stack stays the same depth however
+# deeply the program is nested, and nesting is limited only by memory.
+
+from tokenizer import tokenize
+from parser import parse_identifier, binding_powers, unary_power
+
+
+# run a parse function and everything it yields on an explicit stack
+def run(tokens, function, *arguments):
+    stack = [function(tokens, *arguments)]
+    value = None
+    while stack:
+        try:
+            request = stack[-1].send(value)
+        except StopIteration as stop:
+            stack.pop()
+            value = stop.value
+            continue
+        stack.append(request[0](tokens, *request[1:]))
+        value = None
+    return value
+
+
+### EXPRESSIONS
+
+
+def parse_reference(tokens):
+    name = parse_identifier(tokens)
+    indexes = []
+    while tokens.current() in [".", "["]:
+        if tokens.current() == "[":
+            tokens.discard("[")
+            indexes.append((yield parse_expression, 0))
+            tokens.discard("]")
+        if tokens.current() == ".":
+            tokens.discard(".")
+            indexes.append(parse_identifier(tokens))
+    if indexes == []:
+        return {"type": "reference", "name": name}
+    else:
+        return {"type": "reference", "name": name, "indexes": indexes}
+
+
+# the expressions of a list, up to and including the closing token
+def parse_expressions(tokens, closing):
+    expressions = []
+    while tokens.current() != closing:
+        expressions.append((yield parse_expression, 0))
+        if tokens.current() != closing:
+            tokens.discard(",")
+    tokens.discard(closing)
+    return expressions
+
+
+def parse_expression_list(tokens):
+    tokens.discard("(")
+    expressions = yield parse_expressions, ")"
+    return {"type": "expression-list", "expressions": expressions}
+
+
+def parse_function_call(tokens, reference):
+    tokens.discard("(")
+    expressions = yield parse_expressions, ")"
+    return {
+        "type": "function_call",
+        "reference": reference,
+        "expressions": expressions,
+    }
+
+
+def parse_array_expression(tokens):
+    tokens.discard("[")
+    expressions = yield parse_expressions, "]"
+    return {"type": "array-expression", "expressions": expressions}
+
+
+def parse_factor(tokens):
+    token = tokens.current()
+    if type(token) in (int, float):
+        tokens.discard(token)
+        return token
+    if token[0] == "$":
+        tokens.discard(token)
+        return token[1:]
+    if token == "(":
+        tokens.discard("(")
+        expression = yield parse_expression, 0
+        tokens.discard(")")
+        return expression
+    if token == "[":
+        return (yield parse_array_expression,)
+    reference = yield parse_reference,
+    if tokens.current() == "(":
+        return (yield parse_function_call, reference)
+    return reference
+
+
+def parse_expression(tokens, minimum):
+    if tokens.current() == "-":
+        tokens.discard("-")
+        left = {
+            "type": "unary",
+            "operator": "-",
+            "expression": (yield parse_expression, unary_power),
+        }
+    else:
+        left = yield parse_factor,
+    while True:
+        operator = tokens.current()
+        power = binding_powers.get(operator) if type(operator) is str else None
+        if power == None or power <= minimum:
+            return left
+        tokens.discard(operator)
+        left = {
+            "type": "binary",
+            "left": left,
+            "operator": operator,
+            "right": (yield parse_expression, power),
+        }
+
+
+### STATEMENTS
+
+
+def parse_block(tokens):
+    tokens.discard("{")
+    statements = []
+    while tokens.current() != "}":
+        statements.append((yield parse_statement,))
+        if tokens.current() != "}":
+            tokens.discard(";")
+    tokens.discard("}")
+    return {"type": "block", "statements": statements}
+
+
+def parse_if_statement(tokens):
+    tokens.discard("#if")
+    tokens.discard("(")
+    condition = yield parse_expression, 0
+    tokens.discard(")")
+    then_block = yield parse_block,
+    if tokens.current() == "#else":
+        tokens.discard("#else")
+        else_block = yield parse_block,
+    else:
+        else_block = None
+    return {
+        "type": "if",
+        "condition": condition,
+        "then": then_block,
+        "else": else_block,
+    }
+
+
+def parse_while_statement(tokens):
+    tokens.discard("#while")
+    tokens.discard("(")
+    condition = yield parse_expression, 0
+    tokens.discard(")")
+    do_block = yield parse_block,
+    return {
+        "type": "while",
+        "condition": condition,
+        "do": do_block,
+    }
+
+
+def parse_print_statement(tokens):
+    tokens.discard("#print")
+    expression_list = yield parse_expression_list,
+    return {
+        "type": "print",
+        "expression_list": expression_list,
+    }
+
+
+def parse_return_statement(tokens):
+    tokens.discard("#return")
+    tokens.discard("(")
+    expression = yield parse_expression, 0
+    tokens.discard(")")
+    return {
+        "type": "return",
+        "expression": expression,
+    }
+
+
+def parse_exit_statement(tokens):
+    tokens.discard("#exit")
+    tokens.discard("(")
+    expression = yield parse_expression, 0
+    tokens.discard(")")
+    return {
+        "type": "exit",
+        "expression": expression,
+    }
+
+
+def parse_function_declaration(tokens):
+    tokens.discard("#function")
+    name = parse_identifier(tokens)
+    parameters = []
+    tokens.discard("(")
+    while tokens.current() != ")":
+        parameters.append(parse_identifier(tokens))
+        if tokens.current() != ")":
+            tokens.discard(",")
+    tokens.discard(")")
+    block = yield parse_block,
+    return {
+        "type": "function_declaraction",
+        "name": name,
+        "parameters": parameters,
+        "block": block,
+    }
+
+
+statement_parsers = {
+    "#if": parse_if_statement,
+    "#while": parse_while_statement,
+    "#print": parse_print_statement,
+    "#return": parse_return_statement,
+    "#exit": parse_exit_statement,
+    "#function": parse_function_declaration,
+    "{": parse_block,
+}
+
+
+def parse_statement(tokens):
+    token = tokens.current()
+    if token in statement_parsers:
+        return (yield statement_parsers[token],)
+    expression = yield parse_expression, 0
+    if tokens.current() == "=":
+        tokens.discard("=")
+        return {
+            "type": "assignment",
+            "reference": expression,
+            "expression": (yield parse_expression, 0),
+        }
+    return expression
+
+
+def parse_program(tokens):
+    statements = []
+    while tokens.current() != None:
+        statements.append((yield parse_statement,))
+        if tokens.current() != None:
+            tokens.discard(";")
+    return {"type": "program", "statements": statements}
+
+
+def parse(tokens):
+    return run(tokens, parse_program)
+
+
+def test_parse():
+    print("testing stack parser")
+    import parser
+
+    sources = [
+        "",
+        "print(1+2); {print(3); print(4)}",
+        "x = [1, [2, 3], []]; y.z[x[0]].w = -f(x, \"a\")",
+        "if (x <= 1 == y) { print() } else { while (x) { x = x - 1 } }",
+        "function add(a, b) { return (a + b) }; exit(add(1, 2) * -(3 / 4))",
+        "0; x = 1;",
+    ]
+    for source in sources:
+        assert parse(tokenize(source)) == parser.parse(tokenize(source)), source
+    for source in ["x = )", "{print(1) print(2)}", "if (1) print(2)", "f(1 2)"]:
+        try:
+            parse(tokenize(source))
+            raise Exception("An error was expected.")
+        except AssertionError:
+            pass
+
+
+def test_deep_nesting():
+    print("testing deep nesting")
+    depth = 10000
+    ast = parse(tokenize("{" * depth + "}" * depth))
+    for i in range(depth):
+        assert ast["type"] in ["program", "block"] and len(ast["statements"]) == 1
+        ast = ast["statements"][0]
+    assert ast == {"type": "block", "statements": []}
+    ast = parse(tokenize("x = " + "(" * depth + "-1" + ")" * depth + "+2"))
+    ast = ast["statements"][0]["expression"]
+    assert ast["operator"] == "+" and ast["right"] == 2
+    assert ast["left"] == {"type": "unary", "operator": "-", "expression": 1}
+    ast = parse(tokenize("x" + "[y" * depth + "]" * depth))["statements"][0]
+    for i in range(depth):
+        ast = ast["indexes"][0]
+    assert ast == {"type": "reference", "name": "@y"}
+
+
+if __name__ == "__main__":
+    test_parse()
+    test_deep_nesting()
+    print("done.")
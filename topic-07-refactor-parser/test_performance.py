@@ -0,0 +1,134 @@
+# performance regression tests for the lexer on adversarial input
+#
+# Each generator builds an input of about n characters designed to make
+# a backtracking lexer slow: long or unterminated string literals, runs
+# of doubled quotes, giant comments and comments without a final newline.
+# Every lexer entry point must handle each input in linear time: the
+# time per character may not grow much when the input is 8 times larger,
+# and may not be far beyond that of ordinary code. A quadratic lexer
+# takes 8 times as long per character on the larger input, so the limits
+# are loose enough for a loaded machine, and a failed check is measured
+# again before it counts. These tests take a while, and are marked slow
+# for `pytest -m "not slow"`.
+
+import io
+import random
+import time
+
+from tokenizer import tokenize, tokenize_bytes, generate_tokens
+from token_store import store_tokens
+
+try:
+    import pytest
+
+    pytestmark = pytest.mark.slow
+except ImportError:
+    pass
+
+size = 10000
+attempts = 3
+
+generators = {
+    "unterminated string": lambda n: 'x = "' + "a" * n,
+    "long string": lambda n: 'x = "' + "a" * n + '"',
+    "doubled quotes": lambda n: 'x = "' + '""' * (n // 2) + '"',
+    "unterminated doubled quotes": lambda n: 'x = "' + '""' * (n // 2),
+    "empty strings": lambda n: 'x = ' + '"" ' * (n // 3),
+    "giant comment": lambda n: "x = 1 //" + "x" * n + "\n",
+    "comment without newline": lambda n: "x = 1 //" + " //" * (n // 3),
+    "comments": lambda n: "//\n" * (n // 3),
+    "slashes": lambda n: "/" * n,
+    "quotes in comment": lambda n: '// "' + '"a' * (n // 2) + "\nx",
+}
+
+
+# random mixes of the characters that start or end literals
+def fuzz(seed):
+    def generate(n):
+        random.seed(seed)
+        return "".join(random.choice('"/\na ') for i in range(n))
+
+    return generate
+
+
+for seed in range(5):
+    generators[f"fuzz {seed}"] = fuzz(seed)
+
+
+def lex_string(source):
+    tokenize(source)
+
+
+def lex_bytes(source):
+    tokenize_bytes(source.encode("utf-8"))
+
+
+def lex_stream(source):
+    list(generate_tokens(io.StringIO(source), 1024))
+
+
+def lex_store(source):
+    store_tokens(source)
+
+
+lexers = [lex_string, lex_bytes, lex_stream, lex_store]
+
+
+# best-of-three time per character; lexing errors count as finished
+def time_per_character(lexer, source):
+    times = []
+    for i in range(3):
+        start = time.perf_counter()
+        try:
+            lexer(source)
+        except AssertionError:
+            pass
+        times.append(time.perf_counter() - start)
+    return min(times) / len(source)
+
+
+def ordinary_source(n):
+    sample = 'x = [1, 2.5, "three"]; while (x) { print(x[0]) }; // note\n'
+    return sample * (n // len(sample))
+
+
+def check_linear(lexer):
+    baseline = time_per_character(lexer, ordinary_source(size))
+    for name, generate in generators.items():
+        small_source = generate(size)
+        large_source = generate(8 * size)
+        for attempt in range(attempts):
+            small = time_per_character(lexer, small_source)
+            large = time_per_character(lexer, large_source)
+            if large < 3 * small + baseline and large < 20 * baseline:
+                break
+        assert large < 3 * small + baseline, f"{lexer.__name__} on {name}: not linear"
+        assert large < 20 * baseline, f"{lexer.__name__} on {name}: too slow per character"
+
+
+def test_tokenize_linear():
+    print("testing tokenize is linear")
+    check_linear(lex_string)
+
+
+def test_tokenize_bytes_linear():
+    print("testing tokenize bytes is linear")
+    check_linear(lex_bytes)
+
+
+def test_generate_tokens_linear():
+    print("testing generate tokens is linear")
+    check_linear(lex_stream)
+
+
+def test_store_tokens_linear():
+    print("testing store tokens is linear")
+    check_linear(lex_store)
+
+
+if __name__ == "__main__":
+    test_tokenize_linear()
+    test_tokenize_bytes_linear()
+    test_generate_tokens_linear()
+    test_store_tokens_linear()
+    print("done.")
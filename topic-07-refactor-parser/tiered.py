@@ -0,0 +1,486 @@
+# tiered execution: interpret cold code, compile hot code to closures
+#
+# A TieredEvaluator runs a program with evaluator.evaluate, giving itself
+# as the tiers, so the evaluator counts the calls of each function and
+# the iterations (back edges) of each while loop in the Units that
+# function_unit() and loop_unit() keep. When a function reaches
+# call_threshold calls, promote() compiles its body into a tree of
+# closures, each with its children bound, and later calls run the
+# closures. A compiled statement returns the value of a return statement
+# or NO_RETURN, so returning raises no exception, and a compiled call of
+# a function that is compiled too calls its closures directly, so deep
+# recursion takes fewer Python frames compiled than interpreted. When a loop reaches loop_threshold iterations, the loop is
+# compiled and the rest of its iterations run compiled; all state lives
+# in the environments, so switching in the middle of a loop needs
+# nothing more.
+#
+# Compiled code assumes that indexes are ints into lists and that
+# .length is taken of lists, which are the common cases, and skips the
+# general get_index and set_index there. Each such assumption is checked
+# by a guard; when a guard fails, the value is computed the general way,
+# the compiled code is dropped so the unit is interpreted again, and the
+# failed site is compiled without the assumption when the unit gets hot
+# again. report() lists what was promoted and what was dropped.
+
+from tokenizer import tokenize
+from parser import parse, dict_types
+from evaluator import (
+    binary_operations,
+    Function,
+    Exit,
+    get_index,
+    set_index,
+    lookup,
+    call_function,
+    evaluate,
+)
+from bytecode import is_field
+
+call_threshold = 100
+loop_threshold = 1000
+
+binary_closures = {
+    "+": lambda x, y: lambda local, environment: x(local, environment) + y(local, environment),
+    "-": lambda x, y: lambda local, environment: x(local, environment) - y(local, environment),
+    "*": lambda x, y: lambda local, environment: x(local, environment) * y(local, environment),
+    "/": lambda x, y: lambda local, environment: x(local, environment) / y(local, environment),
+    "==": lambda x, y: lambda local, environment: x(local, environment) == y(local, environment),
+    "!=": lambda x, y: lambda local, environment: x(local, environment) != y(local, environment),
+    "<": lambda x, y: lambda local, environment: x(local, environment) < y(local, environment),
+    "<=": lambda x, y: lambda local, environment: x(local, environment) <= y(local, environment),
+    ">": lambda x, y: lambda local, environment: x(local, environment) > y(local, environment),
+    ">=": lambda x, y: lambda local, environment: x(local, environment) >= y(local, environment),
+}
+
+
+# what a compiled statement gives when it does not return; a return
+# statement gives the value it returns, so returning raises no exception
+NO_RETURN = object()
+
+
+# a function body or a loop, with its counter and compiled form
+class Unit:
+    def __init__(this, kind, name, node):
+        this.kind = kind
+        this.name = name
+        this.node = node
+        this.count = 0
+        this.compiled = None
+        # ids of the reference nodes whose guards have failed
+        this.generic_sites = set()
+
+
+class TieredEvaluator:
+    def __init__(this, call_threshold=call_threshold, loop_threshold=loop_threshold):
+        this.call_threshold = call_threshold
+        this.loop_threshold = loop_threshold
+        this.units = {}
+        # (event, unit, count) for each promotion and deoptimization
+        this.events = []
+        # the program being run, for naming loops
+        this.program = None
+
+    def evaluate(this, ast, environment=None):
+        this.program = ast
+        return evaluate(ast, environment, this)
+
+    def report(this):
+        lines = []
+        for event, unit, count in this.events:
+            if event == "promote":
+                counted = "calls" if unit.kind == "function" else "iterations"
+                lines.append(f"promoted {unit.kind} {unit.name} after {count} {counted}")
+            else:
+                lines.append(f"deoptimized {unit.kind} {unit.name}: guard failed at {event}")
+        return "\n".join(lines)
+
+    ### hooks for the evaluator
+
+    def function_unit(this, function):
+        unit = this.units.get(id(function.block))
+        if unit == None:
+            unit = this.units[id(function.block)] = Unit("function", function.name[1:], function.block)
+        return unit
+
+    def loop_unit(this, node):
+        unit = this.units.get(id(node))
+        if unit == None:
+            unit = this.units[id(node)] = Unit("loop", this.loop_name(node), node)
+        return unit
+
+    def promote(this, unit):
+        if unit.kind == "function":
+            unit.compiled = this.compile_function(unit.node, unit)
+        else:
+            body = this.compile_statement(unit.node, unit)
+
+            def run_loop(frame):
+                value = body(frame.variables, frame.environment)
+                if value is not NO_RETURN:
+                    if frame.variables is frame.environment:
+                        raise Exception("Return outside of a function")
+                    frame.value = value
+                    frame.returning = True
+
+            unit.compiled = run_loop
+        this.events.append(("promote", unit, unit.count))
+
+    def deoptimize(this, unit, site, description):
+        unit.generic_sites.add(id(site))
+        if unit.compiled != None:
+            unit.compiled = None
+            unit.count = 0
+            this.events.append((description, unit, 0))
+
+    # "loop k in f", where the loop is the k-th while statement of the
+    # innermost function f that declares it
+    def loop_name(this, node):
+        scope = ("program", this.program)
+        stack = [(this.program, scope)]
+        while stack:
+            item, scope = stack.pop()
+            if isinstance(item, dict_types):
+                if item is node:
+                    break
+                if item["type"] == "function_declaraction":
+                    scope = (item["name"][1:], item["block"])
+                stack.extend((value, scope) for key, value in item.items() if key != "type")
+            elif type(item) is list:
+                stack.extend((value, scope) for value in item)
+        name, body = scope
+        loops = []
+        stack = [body]
+        while stack:
+            item = stack.pop()
+            if isinstance(item, dict_types):
+                if item is node:
+                    break
+                if item["type"] == "while":
+                    loops.append(item)
+                if item["type"] != "function_declaraction":
+                    stack.extend(reversed([value for key, value in item.items() if key != "type"]))
+            elif type(item) is list:
+                stack.extend(reversed(item))
+        return f"{len(loops) + 1} in {name}"
+
+    ### the compiled tier
+
+    def compile_load(this, name):
+        def load(local, environment):
+            if name in local:
+                return local[name]
+            return lookup(name, local, environment)
+
+        return load
+
+    # the closure for a reference with its first `count` indexes
+    def compile_reference(this, node, unit, count=None):
+        indexes = node.get("indexes", [])
+        value = this.compile_load(node["name"])
+        for index in indexes[:count]:
+            value = this.compile_index(value, index, node, unit)
+        return value
+
+    def compile_index(this, value, index, node, unit):
+        generic = id(node) in unit.generic_sites
+        if is_field(index):
+            if index != "@length" or generic:
+                return lambda local, environment: get_index(value(local, environment), index)
+
+            def get_length(local, environment):
+                container = value(local, environment)
+                if type(container) is list:
+                    return len(container)
+                this.deoptimize(unit, node, f"{type(container).__name__}.length")
+                return get_index(container, index)
+
+            return get_length
+        index = this.compile_expression(index, unit)
+        if generic:
+            return lambda local, environment: get_index(value(local, environment), index(local, environment))
+
+        def get_item(local, environment):
+            container = value(local, environment)
+            key = index(local, environment)
+            if type(container) is list and type(key) is int:
+                return container[key]
+            this.deoptimize(unit, node, f"{type(container).__name__}[{type(key).__name__}]")
+            return get_index(container, key)
+
+        return get_item
+
+    def compile_expression(this, node, unit):
+        if not isinstance(node, dict_types):
+            return lambda local, environment: node
+        t = node["type"]
+        if t == "reference":
+            return this.compile_reference(node, unit)
+        if t == "binary":
+            x = this.compile_expression(node["left"], unit)
+            y = this.compile_expression(node["right"], unit)
+            return binary_closures[node["operator"]](x, y)
+        if t == "unary":
+            assert node["operator"] == "-", f"Unknown operator {node['operator']}"
+            x = this.compile_expression(node["expression"], unit)
+            return lambda local, environment: -x(local, environment)
+        if t == "function_call":
+            function = this.compile_reference(node["reference"], unit)
+            arguments = [this.compile_expression(e, unit) for e in node["expressions"]]
+            units = this.units
+
+            # a compiled function is called directly; any other call is
+            # counted by the evaluator
+            def call(local, environment):
+                callee = function(local, environment)
+                values = [a(local, environment) for a in arguments]
+                if type(callee) is Function:
+                    target = units.get(id(callee.block))
+                    if target != None and target.compiled != None and len(values) == len(callee.parameters):
+                        return target.compiled(dict(zip(callee.parameters, values)), environment)
+                return call_function(callee, values, environment, this)
+
+            return call
+        if t == "array-expression":
+            items = [this.compile_expression(e, unit) for e in node["expressions"]]
+            return lambda local, environment: [item(local, environment) for item in items]
+        raise Exception(f"Unknown content in AST={node}")
+
+    # the closure for a function body, which returns the function's value
+    def compile_function(this, node, unit):
+        statements = [this.compile_statement(s, unit) for s in node["statements"]]
+
+        def run_function(local, environment):
+            for statement in statements:
+                value = statement(local, environment)
+                if value is not NO_RETURN:
+                    return value
+            return None
+
+        return run_function
+
+    # the closure for a statement, which gives the value of a return
+    # statement that it runs, or NO_RETURN
+    def compile_statement(this, node, unit):
+        t = node["type"] if isinstance(node, dict_types) else None
+        if t in ["program", "block"]:
+            statements = [this.compile_statement(s, unit) for s in node["statements"]]
+            if len(statements) == 1:
+                return statements[0]
+
+            def run_statements(local, environment):
+                for statement in statements:
+                    value = statement(local, environment)
+                    if value is not NO_RETURN:
+                        return value
+                return NO_RETURN
+
+            return run_statements
+        if t == "assignment":
+            return this.compile_assignment(node["reference"], node["expression"], unit)
+        if t == "if":
+            condition = this.compile_expression(node["condition"], unit)
+            then_block = this.compile_statement(node["then"], unit)
+            if node["else"] == None:
+
+                def run_if(local, environment):
+                    if condition(local, environment):
+                        return then_block(local, environment)
+                    return NO_RETURN
+
+                return run_if
+            else_block = this.compile_statement(node["else"], unit)
+
+            def run_if_else(local, environment):
+                if condition(local, environment):
+                    return then_block(local, environment)
+                return else_block(local, environment)
+
+            return run_if_else
+        if t == "while":
+            condition = this.compile_expression(node["condition"], unit)
+            body = this.compile_statement(node["do"], unit)
+
+            def run_while(local, environment):
+                while condition(local, environment):
+                    value = body(local, environment)
+                    if value is not NO_RETURN:
+                        return value
+                return NO_RETURN
+
+            return run_while
+        if t == "print":
+            expressions = [this.compile_expression(e, unit) for e in node["expression_list"]["expressions"]]
+
+            def run_print(local, environment):
+                print(*[e(local, environment) for e in expressions])
+                return NO_RETURN
+
+            return run_print
+        if t == "return":
+            # the value of the expression is the value returned
+            return this.compile_expression(node["expression"], unit)
+        if t == "exit":
+            expression = this.compile_expression(node["expression"], unit)
+
+            def run_exit(local, environment):
+                raise Exit(expression(local, environment))
+
+            return run_exit
+        if t == "function_declaraction":
+            name = node["name"]
+            parameters = node["parameters"]
+            block = node["block"]
+
+            def declare(local, environment):
+                local[name] = Function(name, parameters, block)
+                return NO_RETURN
+
+            return declare
+        # an expression used as a statement
+        expression = this.compile_expression(node, unit)
+
+        def run_expression(local, environment):
+            expression(local, environment)
+            return NO_RETURN
+
+        return run_expression
+
+    def compile_assignment(this, reference, expression, unit):
+        value = this.compile_expression(expression, unit)
+        name = reference["name"]
+        indexes = reference.get("indexes", [])
+        if indexes == []:
+
+            def assign(local, environment):
+                local[name] = value(local, environment)
+                return NO_RETURN
+
+            return assign
+        container = this.compile_reference(reference, unit, -1)
+        index = indexes[-1]
+        if is_field(index):
+
+            def assign_field(local, environment):
+                set_index(container(local, environment), index, value(local, environment))
+                return NO_RETURN
+
+            return assign_field
+        index = this.compile_expression(index, unit)
+        generic = id(reference) in unit.generic_sites
+
+        def assign_item(local, environment):
+            item = value(local, environment)
+            target = container(local, environment)
+            key = index(local, environment)
+            if not generic and type(target) is list and type(key) is int and 0 <= key <= len(target):
+                if key == len(target):
+                    target.append(item)
+                else:
+                    target[key] = item
+                return NO_RETURN
+            if not generic:
+                this.deoptimize(unit, reference, f"{type(target).__name__}[{type(key).__name__}]")
+            set_index(target, key, item)
+            return NO_RETURN
+
+        return assign_item
+
+
+def test_tiered():
+    print("testing tiered")
+    import contextlib
+    import io
+    from evaluator import test_programs
+
+    # every program runs as in the evaluator, with everything promoted at
+    # once and with nothing promoted
+    for thresholds in [(1, 1), (2, 3), (10**9, 10**9)]:
+        for source, expected in test_programs:
+            output = io.StringIO()
+            with contextlib.redirect_stdout(output):
+                TieredEvaluator(*thresholds).evaluate(parse(tokenize(source)))
+            assert output.getvalue() == expected, (thresholds, source)
+    tiers = TieredEvaluator(call_threshold=10, loop_threshold=50)
+    environment = {}
+    source = """
+    function square(x) { return (x * x) };
+    function once() { return (0) };
+    k = 0; total = once();
+    while (k < 100) { total = total + square(k); k = k + 1 };
+    exit(total)
+    """
+    assert tiers.evaluate(parse(tokenize(source)), environment) == sum(k * k for k in range(100))
+    assert environment["@k"] == 100
+    assert tiers.report() == "\n".join(
+        [
+            "promoted function square after 10 calls",
+            "promoted loop 1 in program after 50 iterations",
+        ]
+    )
+    # loops are named by the function that declares them
+    tiers = TieredEvaluator(loop_threshold=2)
+    source = "function f() { function g() { i = 0; while (i < 3) { i = i + 1 } }; g() }; f()"
+    tiers.evaluate(parse(tokenize(source)))
+    assert tiers.report() == "promoted loop 1 in g after 2 iterations"
+    # a return outside of a function is an error in both tiers
+    for source in ["return (1)", "i = 0; while (1) { i = i + 1; if (i > 5) { return (i) } }"]:
+        try:
+            TieredEvaluator(loop_threshold=2).evaluate(parse(tokenize(source)))
+            raise Exception("An error was expected.")
+        except Exception as error:
+            assert str(error) == "Return outside of a function", source
+    # promotion never makes recursion run out of Python frames sooner
+    source = "function f(n) { if (n == 0) { return (0) }; return (1 + f(n - 1)) }; exit(f(%d))"
+
+    def depth(thresholds):
+        low, high = 10, 3000
+        while low < high:
+            middle = (low + high + 1) // 2
+            tiers = None if thresholds == None else TieredEvaluator(*thresholds)
+            try:
+                assert evaluate(parse(tokenize(source % middle)), None, tiers) == middle
+                low = middle
+            except RecursionError:
+                high = middle - 1
+        return low
+
+    interpreted = depth(None)
+    for thresholds in [(1, 1), (call_threshold, loop_threshold), (10**9, 10**9)]:
+        assert depth(thresholds) >= interpreted, thresholds
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        TieredEvaluator().evaluate(parse(tokenize(source.replace("exit", "print") % 200)))
+    assert output.getvalue() == "200\n"
+
+
+def test_guards():
+    print("testing guards")
+    tiers = TieredEvaluator(call_threshold=3, loop_threshold=10**9)
+    source = """
+    function size(a) { return (a.length) };
+    function first(a) { return (a[0]) };
+    function put(a, i) { a[i] = i };
+    n = 0; i = 0; b = [];
+    while (i < 5) { n = n + size([1, 2]) + first([i]); put(b, i); i = i + 1 };
+    n = n + size("text") + first(d);
+    i = 0; while (i < 5) { n = n + size("ab") + first(d); i = i + 1 };
+    exit([n, b])
+    """
+    assert tiers.evaluate(parse(tokenize(source)), {"@d": {0: 7}}) == [76, [0, 1, 2, 3, 4]]
+    assert tiers.report() == "\n".join(
+        [
+            "promoted function size after 3 calls",
+            "promoted function first after 3 calls",
+            "promoted function put after 3 calls",
+            "deoptimized function size: guard failed at str.length",
+            "deoptimized function first: guard failed at dict[int]",
+            "promoted function size after 3 calls",
+            "promoted function first after 3 calls",
+        ]
+    )
+
+
+if __name__ == "__main__":
+    test_tiered()
+    test_guards()
+    print("done.")
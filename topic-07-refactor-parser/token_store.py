@@ -0,0 +1,471 @@
+from array import array
+from bisect import bisect_right
+
+from tokenizer import tokenize, master_pattern, group_tokens, make_token, List
+from tokenizer import literal_tokens, scan_literal, incomplete
+
+# token kind codes
+NUMBER = 0
+STRING = 1
+IDENTIFIER = 2
+KEYWORD = 3
+SYMBOL = 4
+
+kind_names = ["number", "string", "identifier", "keyword", "symbol"]
+
+
+# the kind code of a token produced by a pattern
+def token_kind(token):
+    if token == "number":
+        return NUMBER
+    if token == "string":
+        return STRING
+    if token == "identifier":
+        return IDENTIFIER
+    if token.startswith("#"):
+        return KEYWORD
+    return SYMBOL
+
+
+pattern_kinds = {
+    group: token_kind(token)
+    for group, token in group_tokens.items()
+    if token not in [None, "error", "comment"]
+}
+
+
+# source text kept as a list of blocks, so that an edit copies one block
+# of text rather than the whole source
+class Text:
+    block_size = 4096
+
+    def __init__(this, text):
+        size = this.block_size
+        this.blocks = [text[i : i + size] for i in range(0, len(text), size)] or [""]
+        this.starts = [i * size for i in range(len(this.blocks))]
+        this.length = len(text)
+
+    def __len__(this):
+        return this.length
+
+    def __str__(this):
+        return "".join(this.blocks)
+
+    # index of the block holding offset
+    def block(this, offset):
+        return max(bisect_right(this.starts, offset) - 1, 0)
+
+    def slice(this, start, stop):
+        first = this.block(start)
+        last = this.block(stop)
+        text = "".join(this.blocks[first : last + 1])
+        base = this.starts[first]
+        return text[start - base : stop - base]
+
+    # size characters from start, and whether that reaches the end.
+    # like tokenize(), the text is read as if it ended in a newline.
+    def window(this, start, size):
+        if start + size >= this.length:
+            return this.slice(start, this.length) + "\n", True
+        return this.slice(start, start + size), False
+
+    def replace(this, offset, deleted, inserted):
+        first = this.block(offset)
+        last = this.block(offset + deleted)
+        base = this.starts[first]
+        text = "".join(this.blocks[first : last + 1])
+        text = text[: offset - base] + inserted + text[offset + deleted - base :]
+        size = this.block_size
+        if len(text) > 2 * size:
+            blocks = [text[i : i + size] for i in range(0, len(text), size)]
+        else:
+            blocks = [text]
+        blocks = [block for block in blocks if block]
+        starts = []
+        for block in blocks:
+            starts.append(base)
+            base = base + len(block)
+        delta = len(inserted) - deleted
+        this.blocks[first : last + 1] = blocks
+        this.starts[first : last + 1] = starts
+        for i in range(first + len(blocks), len(this.starts)):
+            this.starts[i] += delta
+        this.length = this.length + delta
+        if this.blocks == []:
+            this.blocks = [""]
+            this.starts = [0]
+
+
+# compact token storage in parallel columns. each token is a kind code,
+# an index into a table of interned constants holding the token values,
+# and the start and end offset of its text in the source. offsets are
+# signed, since a stored offset may be off by a pending shift (see edit).
+class TokenStore:
+    def __init__(this, source=""):
+        this.text = Text(source)
+        this.kinds = array("B")
+        this.values = array("I")
+        this.starts = array("i")
+        this.ends = array("i")
+        this.constants = []
+        this.constant_index = {}
+        # offsets of tokens from shift_index on are still to be moved by
+        # shift, so that an edit does not rewrite every later offset
+        this.shift_index = 0
+        this.shift = 0
+
+    def __len__(this):
+        return len(this.kinds)
+
+    @property
+    def source(this):
+        return str(this.text)
+
+    # index of a token value in the constants table, adding it if needed.
+    # the type is part of the key, so that 1 and 1.0 stay distinct.
+    def intern(this, value):
+        key = (type(value), value)
+        index = this.constant_index.get(key)
+        if index == None:
+            index = len(this.constants)
+            this.constants.append(value)
+            this.constant_index[key] = index
+        return index
+
+    def append(this, kind, value, start, end):
+        this.kinds.append(kind)
+        this.values.append(this.intern(value))
+        this.starts.append(start)
+        this.ends.append(end)
+
+    # the token at index i, as tokenize() would produce it
+    def token(this, i):
+        return this.constants[this.values[i]]
+
+    def tokens(this):
+        constants = this.constants
+        return [constants[value] for value in this.values]
+
+    # source offsets of token i, including any pending shift
+    def start(this, i):
+        if i >= this.shift_index:
+            return this.starts[i] + this.shift
+        return this.starts[i]
+
+    def end(this, i):
+        if i >= this.shift_index:
+            return this.ends[i] + this.shift
+        return this.ends[i]
+
+    # add delta to the stored offsets of tokens first..stop-1
+    def move(this, first, stop, delta):
+        if delta == 0:
+            return
+        for i in range(first, stop):
+            this.starts[i] += delta
+            this.ends[i] += delta
+
+    # apply the pending shift to all stored offsets
+    def settle(this):
+        this.move(this.shift_index, len(this), this.shift)
+        this.shift_index = len(this)
+        this.shift = 0
+
+    # index of the first token that ends at or after offset
+    def find_end(this, offset):
+        low, high = 0, len(this)
+        while low < high:
+            middle = (low + high) // 2
+            if this.end(middle) < offset:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    # Replace `deleted` characters at `offset` with `inserted` and re-lex
+    # only the affected tokens. Scanning restarts at the last token that
+    # ends before the edit, and stops as soon as a new token starts where
+    # an old token (moved by the edit) started, because from there on the
+    # tokens are unchanged. Returns (first, old_stop, new_stop): tokens
+    # first..old_stop-1 were replaced by tokens first..new_stop-1.
+    def edit(this, offset, deleted, inserted):
+        removed = this.text.slice(offset, offset + deleted)
+        this.text.replace(offset, deleted, inserted)
+        try:
+            return this.relex(offset, deleted, inserted)
+        except AssertionError:
+            this.text.replace(offset, len(inserted), removed)
+            raise
+
+    def relex(this, offset, deleted, inserted):
+        delta = len(inserted) - deleted
+        count = len(this)
+        first = this.find_end(offset)
+        if first == 0:
+            pos = 0
+        else:
+            first = first - 1
+            pos = this.start(first)
+        stop = offset + len(inserted)
+        old = first
+        tokens = []
+        base = pos
+        size = 256
+        window, at_end = this.text.window(base, size)
+        i = 0
+        while True:
+            if i == len(window):
+                if at_end:
+                    old = count
+                    break
+                size = size * 2
+                window, at_end = this.text.window(base, size)
+                continue
+            match = master_pattern.match(window, i)
+            token = group_tokens[match.lastgroup]
+            end = match.end()
+            if token in literal_tokens:
+                token, end = scan_literal(window, token, i, end)
+            if not at_end and incomplete(token, i, end, window):
+                # the window ends inside this token, read further
+                size = size * 2
+                window, at_end = this.text.window(base, size)
+                continue
+            text = window[i:end]
+            start = base + i
+            i = end
+            if token == None:
+                continue
+            assert token != "error", "Syntax error: illegal character at " + text
+            if start >= stop:
+                while old < count and this.start(old) + delta < start:
+                    old = old + 1
+                if old < count and this.start(old) + delta == start:
+                    break
+            value = make_token(token, text)
+            kind = pattern_kinds[match.lastgroup]
+            if kind == IDENTIFIER and value[0] == "#":
+                kind = KEYWORD
+            tokens.append((kind, value, start, base + end))
+        # move the pending shift to the first token after the replaced
+        # ones, which costs only the distance from the previous edit
+        if this.shift_index < old:
+            this.move(this.shift_index, first, this.shift)
+        else:
+            this.move(old, this.shift_index, -this.shift)
+        this.kinds[first:old] = array("B", [token[0] for token in tokens])
+        this.values[first:old] = array("I", [this.intern(token[1]) for token in tokens])
+        this.starts[first:old] = array("i", [token[2] for token in tokens])
+        this.ends[first:old] = array("i", [token[3] for token in tokens])
+        this.shift_index = first + len(tokens)
+        this.shift = this.shift + delta
+        return first, old, first + len(tokens)
+
+
+# tokenize into a token store instead of a list of token objects
+def store_tokens(characters):
+    store = TokenStore(characters)
+    characters = characters + "\n"
+    pos = 0
+    while pos < len(characters):
+        match = master_pattern.match(characters, pos)
+        token = group_tokens[match.lastgroup]
+        end = match.end()
+        if token in literal_tokens:
+            token, end = scan_literal(characters, token, pos, end)
+        if token != None:
+            text = characters[pos:end]
+            assert token != "error", "Syntax error: illegal character at " + text
+            value = make_token(token, text)
+            kind = pattern_kinds[match.lastgroup]
+            if kind == IDENTIFIER and value[0] == "#":
+                kind = KEYWORD
+            store.append(kind, value, pos, end)
+        pos = end
+    return store
+
+
+# token buffer over a token store, usable by the parser in place of List
+class StoreList(List):
+    has_kinds = True
+
+    def __init__(this, store, position=0):
+        this.store = store
+        this.position = position
+        # the columns are read directly on every lookahead
+        this.kinds = store.kinds
+        this.values = store.values
+        this.constants = store.constants
+
+    @property
+    def list(this):
+        return this.store.tokens()[this.position :]
+
+    def current(this):
+        index = this.position
+        if index < len(this.values):
+            return this.constants[this.values[index]]
+        return None
+
+    def lookahead(this, k=1):
+        if k < 0:
+            raise Exception(f"Cannot look behind the current token (k={k})")
+        index = this.position + k
+        if index < len(this.values):
+            return this.constants[this.values[index]]
+        return None
+
+    # the kind code of the token k positions past the current one
+    def kind(this, k=0):
+        if k < 0:
+            raise Exception(f"Cannot look behind the current token (k={k})")
+        index = this.position + k
+        if index < len(this.kinds):
+            return this.kinds[index]
+        return None
+
+    def discard(this, token=None):
+        if token:
+            assert this.current() == token
+        this.position += 1
+
+
+def test_store_tokens():
+    print("testing store tokens")
+    source = 'x = "a ""b"""; // comment\nif (x) { print(x.y[1], 2.5) }'
+    store = store_tokens(source)
+    assert store.tokens() == tokenize(source).list
+    assert [kind_names[kind] for kind in store.kinds[:4]] == [
+        "identifier",
+        "symbol",
+        "string",
+        "symbol",
+    ]
+    assert source[store.starts[0] : store.ends[0]] == "x"
+    assert source[store.starts[2] : store.ends[2]] == '"a ""b"""'
+    assert store.kinds[4] == KEYWORD and store.token(4) == "#if"
+
+
+def test_interned_constants():
+    print("testing interned constants")
+    store = store_tokens("x = x + 1 + 1.0 + x")
+    assert store.values[0] == store.values[2] == store.values[8]
+    assert store.token(4) == 1 and type(store.token(4)) is int
+    assert store.token(6) == 1.0 and type(store.token(6)) is float
+    assert len(store.constants) == 5
+
+
+def test_edit():
+    print("testing edit")
+    import random
+
+    source = 'x = 1; // note\nif (x <= 2) { print("a ""b""", x.y[3]) }; iffy = 2.5'
+    store = store_tokens(source)
+    # replace 'x' with 'xyz' in the if condition
+    offset = source.index("x <=")
+    assert store.edit(offset + 1, 0, "yz") == (5, 7, 7)
+    assert store.token(6) == "@xyz"
+    assert store.token(7) == "<=" and store.start(7) == offset + 4
+    # the edits change the meaning of the rest of the line
+    edits = [
+        (0, 0, "//"),
+        (0, 2, ""),
+        (source.index("note"), 0, "\n"),
+        (source.index("<="), 1, ""),
+        (source.index("<"), 0, '"'),
+        (source.index('"a'), 1, ""),
+        (len(source), 0, " + 1"),
+    ]
+    random.seed(1)
+    alphabet = 'ab1 ;(".\n/'
+    for i in range(300):
+        offset = random.randrange(len(store.source) + 1)
+        deleted = random.randrange(min(3, len(store.source) - offset) + 1)
+        inserted = "".join(random.choice(alphabet) for i in range(random.randrange(3)))
+        edits.append((offset, deleted, inserted))
+    for offset, deleted, inserted in edits:
+        offset = min(offset, len(store.source))
+        deleted = min(deleted, len(store.source) - offset)
+        source = store.source[:offset] + inserted + store.source[offset + deleted :]
+        try:
+            expected = store_tokens(source)
+        except AssertionError:
+            # the edited source does not lex, and the store is left as it was
+            before = store.tokens()
+            try:
+                store.edit(offset, deleted, inserted)
+                raise Exception("An error was expected.")
+            except AssertionError:
+                assert store.tokens() == before
+            continue
+        first, old_stop, new_stop = store.edit(offset, deleted, inserted)
+        assert store.source == source
+        assert store.tokens() == expected.tokens()
+        assert list(store.kinds) == list(expected.kinds)
+        assert [store.start(i) for i in range(len(store))] == list(expected.starts)
+        assert [store.end(i) for i in range(len(store))] == list(expected.ends)
+    store.settle()
+    assert store.starts == expected.starts and store.ends == expected.ends
+
+
+def test_text():
+    print("testing text")
+    Text.block_size = 4
+    try:
+        source = "abcdefghijklmnopqrstuvwxyz"
+        text = Text(source)
+        assert str(text) == source and len(text.blocks) == 7
+        assert text.slice(3, 13) == source[3:13]
+        assert text.window(20, 10) == (source[20:] + "\n", True)
+        assert text.window(2, 5) == (source[2:7], False)
+        for offset, deleted, inserted in [(3, 0, "123"), (0, 9, ""), (5, 3, "x" * 20), (0, 37, "")]:
+            source = source[:offset] + inserted + source[offset + deleted :]
+            text.replace(offset, deleted, inserted)
+            assert str(text) == source and len(text) == len(source)
+            assert text.slice(1, 5) == source[1:5]
+    finally:
+        Text.block_size = 4096
+
+
+def test_store_list():
+    print("testing store list")
+    tokens = StoreList(store_tokens("print(1, x)"))
+    assert tokens.current() == "#print" and tokens.kind() == KEYWORD
+    assert tokens.lookahead(2) == 1 and tokens.kind(2) == NUMBER
+    tokens.discard("#print")
+    for look_behind in [lambda: tokens.lookahead(-1), lambda: tokens.kind(-1)]:
+        try:
+            look_behind()
+            raise Exception("An error was expected.")
+        except Exception as error:
+            assert "look behind" in str(error)
+    tokens.discard("(")
+    assert tokens.list == [1, ",", "@x", ")"]
+    tokens.skip(4)
+    assert tokens.current() == None and tokens.kind() == None
+
+
+def test_parse_store():
+    print("testing parse store")
+    from parser import parse
+
+    source = "function f(a) { return (a * 2) }; x = [1, f(2)]; print(x[1])"
+    assert parse(StoreList(store_tokens(source))) == parse(tokenize(source))
+    # every kind of factor and statement
+    source = 'if (-x < 2.5) { {y.z = "s"} } else { while (1) { exit((x)) } }; [f(1)]'
+    assert parse(StoreList(store_tokens(source))) == parse(tokenize(source))
+    try:
+        parse(StoreList(store_tokens("x = if")))
+        raise Exception("An error was expected.")
+    except AssertionError:
+        pass
+
+
+if __name__ == "__main__":
+    test_store_tokens()
+    test_interned_constants()
+    test_edit()
+    test_text()
+    test_store_list()
+    test_parse_store()
+    print("done.")
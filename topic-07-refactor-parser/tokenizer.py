@@ -1,15 +1,11 @@
+import mmap
+import os
 import re
+import sys
 
 patterns = [
-    [r"//.*\n", None],  # 
+    [r"//", "comment"],  # comments, scanned by scan_literal
     [r"\s+", None],  # Whitespace
-    [r"print", "#print"],  # print keyword
-    [r"if", "#if"],  # if keyword
-    [r"else", "#else"],  # else keyword
-    [r"while", "#while"],  # while keyword
-    [r"return", "#return"],  # return keyword
-    [r"exit", "#exit"],  # exit keyword
-    [r"function", "#function"],  # function keyword
     [r"\+", "+"],
     [r"-", "-"],
     [r"\*", "*"],
@@ -32,12 +28,24 @@ patterns = [
     [r",", ","],
     [r"\;", ";"],
     [r"\d+(\.\d*)?", "number"],  # numeric literals
-    [r'"([^"]|"")*"', "string"],  # string literals
+    [r'"', "string"],  # string literals, scanned by scan_literal
     [r"[a-zA-Z_][a-zA-Z0-9_]*", "identifier"],  # identifiers
     [r".", "error"],  # unexpected content
 ]
 
 
+# keywords are lexed by the identifier pattern and then looked up here
+keywords = {
+    "print": "#print",
+    "if": "#if",
+    "else": "#else",
+    "while": "#while",
+    "return": "#return",
+    "exit": "#exit",
+    "function": "#function",
+}
+
+
 # general numeric literal conversion
 def number(s):
     if "." in s:
@@ -46,31 +54,298 @@ def number(s):
         return int(s)
 
 
-# simple list class to hold token buffer
+# token buffer that walks the token list with a cursor instead of
+# copying the rest of the list every time a token is discarded
 class List:
-    def __init__(this, tokens):
+    # whether kind(k) gives the kind code of a token (see token_store)
+    has_kinds = False
+
+    def __init__(this, tokens, position=0):
         assert type(tokens) is list
-        this.list = tokens
+        this.tokens = tokens
+        this.position = position
+
+    # the remaining (not yet discarded) tokens
+    @property
+    def list(this):
+        return this.tokens[this.position :]
+
+    @list.setter
+    def list(this, tokens):
+        assert type(tokens) is list
+        this.tokens = tokens
+        this.position = 0
 
     def current(this):
-        try:
-            return this.list[0]
-        except:
-            return None
+        return this.lookahead(0)
+
+    # the token k positions past the current one, or None past the end
+    def lookahead(this, k=1):
+        if k < 0:
+            raise Exception(f"Cannot look behind the current token (k={k})")
+        index = this.position + k
+        if index < len(this.tokens):
+            return this.tokens[index]
+        return None
 
     def discard(this, token=None):
         if token:
-            assert this.list[0] == token
-        this.list = this.list[1:]
+            assert this.tokens[this.position] == token
+        this.position += 1
+
+    # discard n tokens without checking them
+    def skip(this, n=1):
+        this.position += n
+
+    # remember the current position so that it can be restored by reset()
+    def mark(this):
+        return this.position
+
+    def reset(this, mark):
+        this.position = mark
+
+
+# one alternation of all patterns, compiled once at import time.
+# alternatives are tried left to right, so the first pattern in the
+# list that matches still wins, exactly as in the pattern-by-pattern loop.
+master_pattern = re.compile(
+    "|".join(f"(?P<t{i}>{regex})" for i, (regex, token) in enumerate(patterns))
+)
+group_tokens = {f"t{i}": token for i, (regex, token) in enumerate(patterns)}
+
+
+literal_tokens = ["comment", "string"]
+
+
+# Comments and string literals are matched by their opening characters
+# only, and then scanned to their end with find() instead of by the regex
+# engine. This keeps lexing linear on any input, including unterminated
+# strings and comments without a final newline. Returns the token and
+# its end; comments become None and unterminated strings "error".
+def scan_literal(characters, token, start, end, quote='"', newline="\n"):
+    if token == "comment":
+        end = characters.find(newline, end)
+        if end == -1:
+            return None, len(characters)
+        return None, end + 1
+    # the end of the string if a doubled quote is really a closing quote
+    # followed by another literal, as when backtracking from the end
+    closing = None
+    while True:
+        end = characters.find(quote, end)
+        if end == -1:
+            if closing != None:
+                return token, closing
+            return "error", start + 1
+        if characters[end + 1 : end + 2] != quote:
+            return token, end + 1
+        # a doubled quote inside the string
+        closing = end + 1
+        end = end + 2
+
+
+# convert the matched text of a pattern into the token the parser expects
+def make_token(token, text):
+    if token == "number":
+        return number(text)
+    if token == "string":
+        # omit closing and beginning strings, replace two quotes with one quote
+        return "$" + text[1:-1].replace('""', '"')
+    if token == "identifier":
+        if text in keywords:
+            return keywords[text]
+        # interned, so that equal names are the same string object
+        return sys.intern("@" + text)
+    return token
 
 
 # The lex/tokenize function
 def tokenize(characters):
+    characters = characters + "\n"
+    tokens = []
+    match_at = master_pattern.match
+    pos = 0
+    length = len(characters)
+    while pos < length:
+        match = match_at(characters, pos)
+        token = group_tokens[match.lastgroup]
+        if token in literal_tokens:
+            token, end = scan_literal(characters, token, pos, match.end())
+            text = characters[pos:end]
+        else:
+            end = match.end()
+            text = match.group()
+        if token != None:
+            assert token != "error", "Syntax error: illegal character at " + text
+            tokens.append(make_token(token, text))
+        pos = end
+    return List(tokens)
+
+
+# could the token scanned at the end of a partial buffer change once
+# more text has been read?
+def incomplete(token, start, end, buffer):
+    if end == len(buffer):
+        # words, numbers, operators, whitespace, comments without their
+        # newline and strings that may go on with a doubled quote
+        return True
+    if token == "error" and buffer[start] == '"':
+        # a string literal whose closing quote has not been read yet
+        return True
+    if token == "string" and buffer[end] == '"':
+        # a string that ended before a doubled quote because no closing
+        # quote followed it yet
+        return True
+    return False
+
+
+# lex a file in fixed-size chunks, yielding tokens as they are found.
+# only the unscanned tail of the current chunk is kept in memory.
+def generate_tokens(file, chunk_size=65536):
+    buffer = ""
+    at_end = False
+    while not at_end:
+        # a token longer than a chunk doubles the buffer on every read,
+        # so that scanning it again from its start stays linear
+        chunk = file.read(max(chunk_size, len(buffer)))
+        if chunk == "":
+            at_end = True
+            chunk = "\n"
+        buffer = buffer + chunk
+        pos = 0
+        while pos < len(buffer):
+            match = master_pattern.match(buffer, pos)
+            token = group_tokens[match.lastgroup]
+            end = match.end()
+            if token in literal_tokens:
+                token, end = scan_literal(buffer, token, pos, end)
+            if not at_end and incomplete(token, pos, end, buffer):
+                break
+            if token != None:
+                assert token != "error", "Syntax error: illegal character at " + buffer[pos:end]
+                yield make_token(token, buffer[pos:end])
+            pos = end
+        buffer = buffer[pos:]
+
+
+# token buffer that pulls tokens from an iterator only as the parser
+# asks for them. discarded tokens are dropped from memory, except for
+# those after a mark() which are kept until release().
+class Stream(List):
+    def __init__(this, tokens):
+        this.iterator = iter(tokens)
+        this.tokens = []
+        this.position = 0
+        this.offset = 0  # position of this.tokens[0] in the whole stream
+        this.pinned = None
+
+    @property
+    def list(this):
+        this.tokens.extend(this.iterator)
+        return this.tokens[this.position - this.offset :]
+
+    def lookahead(this, k=1):
+        if k < 0:
+            raise Exception(f"Cannot look behind the current token (k={k})")
+        index = this.position - this.offset + k
+        while index >= len(this.tokens):
+            token = next(this.iterator, None)
+            if token == None:
+                return None
+            this.tokens.append(token)
+        return this.tokens[index]
+
+    def discard(this, token=None):
+        if token:
+            assert this.current() == token
+        this.skip(1)
+
+    def skip(this, n=1):
+        if n > 0:
+            this.lookahead(n - 1)
+        this.position += n
+        keep = this.position if this.pinned == None else min(this.position, this.pinned)
+        drop = min(keep - this.offset, len(this.tokens))
+        if drop >= 4096:
+            del this.tokens[:drop]
+            this.offset += drop
+
+    def mark(this):
+        if this.pinned == None or this.position < this.pinned:
+            this.pinned = this.position
+        return this.position
+
+    def reset(this, mark):
+        assert mark >= this.offset, "Tokens before this mark were released"
+        this.position = mark
+
+    def release(this):
+        this.pinned = None
+
+
+# the master pattern compiled for bytes, to lex memory-mapped files
+# without decoding them. note that \s only matches ASCII whitespace here.
+bytes_pattern = re.compile(
+    b"|".join(
+        f"(?P<t{i}>{regex})".encode("ascii") for i, (regex, token) in enumerate(patterns)
+    )
+)
+
+
+# like make_token, decoding only the text of numbers, identifiers and strings
+def make_bytes_token(token, data):
+    if token == "number":
+        return number(data.decode("ascii"))
+    if token == "string":
+        return "$" + data[1:-1].decode("utf-8").replace('""', '"')
+    if token == "identifier":
+        return make_token(token, data.decode("ascii"))
+    return token
+
+
+# lex a bytes-like object, such as an mmap, without copying or decoding it
+def tokenize_bytes(data):
+    tokens = []
+    pos = 0
+    while pos < len(data):
+        match = bytes_pattern.match(data, pos)
+        token = group_tokens[match.lastgroup]
+        end = match.end()
+        if token in literal_tokens:
+            token, end = scan_literal(data, token, pos, end, b'"', b"\n")
+        if token != None:
+            assert token != "error", "Syntax error: illegal character at " + repr(data[pos:end])
+            tokens.append(make_bytes_token(token, data[pos:end]))
+        pos = end
+    return List(tokens)
+
+
+# lex a source file by memory-mapping it
+def tokenize_mapped_file(path):
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return List([])
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return tokenize_bytes(data)
+
+
+# the patterns with comments and string literals matched by regular
+# expressions alone, as they were before scan_literal
+reference_literals = {
+    "comment": [r"//.*\n", None],
+    "string": [r'"([^"]|"")*"', "string"],
+}
+reference_patterns = [reference_literals.get(token, [regex, token]) for regex, token in patterns]
+
+
+# The original pattern-by-pattern tokenizer, kept as the reference
+# implementation that the master pattern is checked against.
+def tokenize_by_patterns(characters):
     characters = characters + '\n'
     tokens = []
     pos = 0
     while pos < len(characters):
-        for regex, token in patterns:
+        for regex, token in reference_patterns:
             pattern = re.compile(regex)
             match = pattern.match(characters, pos)
             if match:
@@ -80,17 +355,7 @@ def tokenize(characters):
         if token == None:
             continue
         assert token != "error", "Syntax error: illegal character at " + match.group(0)
-        if token == "number":
-            tokens.append(number(match.group(0)))
-            continue
-        if token == "string":
-            # omit closing and beginning strings, replace two quotes with one quote
-            tokens.append("$" + match.group(0)[1:-1].replace('""', '"'))
-            continue
-        if token == "identifier":
-            tokens.append("@" + match.group(0))
-            continue
-        tokens.append(token)
+        tokens.append(make_token(token, match.group(0)))
     return List(tokens)
 
 
@@ -152,6 +417,22 @@ def test_keywords():
     for keyword in ["print", "if", "else", "while", "function", "return", "exit"]:
         assert tokenize(keyword).list == ["#" + keyword]
 
+def test_keyword_prefixes():
+    print("testing keyword prefixes")
+    assert tokenize("iffy printer elsewhere whiled").list == [
+        "@iffy",
+        "@printer",
+        "@elsewhere",
+        "@whiled",
+    ]
+    assert tokenize("if(x)").list == ["#if", "(", "@x", ")"]
+    assert tokenize("_print print_").list == ["@_print", "@print_"]
+    # identifier names are interned
+    first, second = tokenize("alpha + alpha").list[0::2]
+    assert first is second
+    assert first is tokenize("alpha").list[0]
+
+
 def test_comments():
     print("testing comments")
     assert tokenize("//comment\n").list == tokenize("\n").list
@@ -160,6 +441,45 @@ def test_comments():
     assert tokenize('"beta"//comment\n').list == tokenize('"beta"\n').list
 
 
+def test_master_pattern():
+    print("testing master pattern")
+    examples = [
+        "print(3+4*(5-2));",
+        'x = "say ""hi"" again"; // comment\ny=x;',
+        "function add(x,y) { return (x+y) }; z = add(1, 2.5)",
+        "if (a <= b) { print(a) } else { a[1].b = [1,2,3] }",
+        "while (k >= 0) { k = k - 1 }; iffy = printer != 12.",
+        'a = "x"""; b = "" + ""; c = 1 // "not a string"',
+    ]
+    for example in examples:
+        assert tokenize(example).list == tokenize_by_patterns(example).list
+    try:
+        tokenize("x = 1 ? 2")
+        raise Exception("An error was expected.")
+    except AssertionError:
+        pass
+
+
+def test_scan_literal():
+    print("testing scan literal")
+    import random
+
+    # strings end where the original regular expression ended them
+    original = re.compile(r'"([^"]|"")*"')
+    random.seed(1)
+    for i in range(2000):
+        text = '"' + "".join(random.choice('"a') for i in range(random.randrange(8)))
+        match = original.match(text)
+        token, end = scan_literal(text, "string", 0, 1)
+        if match:
+            assert (token, end) == ("string", match.end()), text
+        else:
+            assert token == "error", text
+    assert scan_literal("// note\nx", "comment", 0, 2) == (None, 8)
+    assert scan_literal("// note", "comment", 0, 2) == (None, 7)
+    assert scan_literal(b'"a""b" x', "string", 0, 1, b'"', b"\n") == ("string", 6)
+
+
 def test_list_class():
     tokens = List(["#print", 3, "+", 4, "*", "(", 5, "-", 2, ")", ";"])
     assert tokens.list == ["#print", 3, "+", 4, "*", "(", 5, "-", 2, ")", ";"]
@@ -177,6 +497,115 @@ def test_list_class():
         assert tokens.current() == None
 
 
+def test_list_cursor():
+    print("testing list cursor")
+    tokens = tokenize("x = y[1] + 2;")
+    assert tokens.lookahead(0) == "@x"
+    assert tokens.lookahead(1) == "="
+    assert tokens.lookahead(3) == "["
+    assert tokens.lookahead(20) == None
+    try:
+        tokens.lookahead(-1)
+        raise Exception("An error was expected.")
+    except Exception as error:
+        assert "look behind" in str(error)
+    start = tokens.mark()
+    tokens.discard("@x")
+    tokens.discard("=")
+    tokens.skip(4)
+    assert tokens.current() == "+"
+    tokens.reset(start)
+    assert tokens.current() == "@x"
+    assert tokens.list == ["@x", "=", "@y", "[", 1, "]", "+", 2, ";"]
+    tokens.skip(9)
+    assert tokens.current() == None and tokens.list == []
+
+
+def test_generate_tokens():
+    print("testing generate tokens")
+    import io
+
+    examples = [
+        "print(3+4*(5-2));",
+        'x = "say ""hi"" again"; // comment\ny=x;',
+        'a = "multi\nline ""string"""; // trailing comment',
+        "function add(x,y) { return (x+y) }; z = add(1, 2.5)",
+        "if (a <= b) { print(a) } else { a[1].b = [1,2,3] }",
+        "while (k >= 0) { k = k - 1 }; printer != 12.",
+    ]
+    for example in examples:
+        expected = tokenize(example).list
+        # every chunk size, so that each token is split at every position
+        for chunk_size in range(1, len(example) + 2):
+            tokens = list(generate_tokens(io.StringIO(example), chunk_size))
+            assert tokens == expected, f"chunk size {chunk_size}: {tokens}"
+    try:
+        list(generate_tokens(io.StringIO('x = "unterminated'), 4))
+        raise Exception("An error was expected.")
+    except AssertionError:
+        pass
+
+
+def test_stream_class():
+    print("testing stream class")
+    tokens = Stream(iter(["#print", "(", 3, ")", ";"]))
+    assert tokens.current() == "#print"
+    assert tokens.lookahead(2) == 3
+    start = tokens.mark()
+    tokens.discard("#print")
+    tokens.skip(0)
+    assert tokens.current() == "("
+    tokens.skip(2)
+    assert tokens.current() == ")"
+    tokens.reset(start)
+    assert tokens.list == ["#print", "(", 3, ")", ";"]
+    tokens.release()
+    tokens.skip(5)
+    assert tokens.current() == None
+    # discarded tokens are dropped from memory
+    tokens = Stream(iter(range(1, 10001)))
+    for i in range(1, 10001):
+        tokens.discard(i)
+    assert len(tokens.tokens) < 4096
+    assert tokens.current() == None
+
+
+def test_tokenize_bytes():
+    print("testing tokenize bytes")
+    examples = [
+        "print(3+4*(5-2));",
+        'x = "say ""hi"" to café ☕"; // comment\ny=x;',
+        'a = "multi\nline ""string"""; // trailing comment',
+        "function add(x,y) { return (x+y) }; z = add(1, 2.5)",
+        "if (a <= b) { print(a) } else { a[1].b = [1,2,3] }",
+        "while (k >= 0) { k = k - 1 }; printer != 12.",
+        "x // comment without newline",
+        "",
+    ]
+    for example in examples:
+        assert tokenize_bytes(example.encode("utf-8")).list == tokenize(example).list
+    try:
+        tokenize_bytes(b"x = 1 ? 2")
+        raise Exception("An error was expected.")
+    except AssertionError:
+        pass
+
+
+def test_tokenize_mapped_file():
+    print("testing tokenize mapped file")
+    import tempfile
+
+    source = 'x = [1, 2.5, "three"]; // list\nwhile (x) { print(x[0]) }\n' * 100
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "example.t")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(source)
+        assert tokenize_mapped_file(path).list == tokenize(source).list
+        with open(path, "w") as f:
+            pass
+        assert tokenize_mapped_file(path).list == []
+
+
 if __name__ == "__main__":
     test_simple_tokens()
     test_number_tokens()
@@ -185,8 +614,16 @@ if __name__ == "__main__":
     test_whitespace()
     test_multiple_tokens()
     test_keywords()
+    test_keyword_prefixes()
     test_comments()
+    test_master_pattern()
+    test_scan_literal()
     test_list_class()
+    test_list_cursor()
+    test_generate_tokens()
+    test_stream_class()
+    test_tokenize_bytes()
+    test_tokenize_mapped_file()
     print(tokenize("print(3+4*(5-2));").list)
     print(tokenize("\"x\"=y+1;").list)
 
@@ -0,0 +1,588 @@
+# translate programs to Python source, and cache them as modules
+#
+# transpile() turns the AST into the source of a Python module with one
+# function, _program(), that runs the program. Top-level names become
+# globals of the module and declared functions become Python functions,
+# so a transpiled program runs at the speed of ordinary Python code.
+#
+# Names get a trailing "_" if they would clash with Python (keywords,
+# the builtins the generated code uses, and names that start or end with
+# "_"), which leaves names starting with "_" for the helpers. As in the
+# evaluator, a function reads the global of a name it has not assigned
+# yet; such names are copied from the globals when the function starts,
+# which is the same thing, since only top-level code assigns globals.
+# run_module() turns the NameError of a missing name and the TypeError of
+# a call with the wrong number of arguments into the evaluator's errors;
+# other errors (a bad index, adding a string to a number) are the Python
+# ones, as in the evaluator.
+#
+# load_module() keeps the generated module in __tcache__ next to the
+# script, named by a hash of the script and of the language, so Python
+# also caches its bytecode in a .pyc file there. Like cache.py, it
+# removes the least recently used modules when the cache grows too big.
+
+import hashlib
+import importlib.util
+import keyword
+import os
+import re
+import tempfile
+
+from tokenizer import tokenize
+from parser import parse, binding_powers, unary_power, dict_types
+from evaluator import Exit
+from bytecode import assigned_names, is_field
+import cache
+
+helper_imports = "from evaluator import get_index as _get_index, set_index as _set_index, Exit as _Exit"
+
+# builtins that the generated code calls
+python_builtins = ["print", "globals"]
+
+statement_types = {
+    "program",
+    "block",
+    "if",
+    "while",
+    "print",
+    "return",
+    "exit",
+    "function_declaraction",
+    "assignment",
+}
+
+
+# the Python name of a name such as "@x"
+def python_name(name):
+    name = name[1:]
+    if keyword.iskeyword(name) or name in python_builtins or name[0] == "_" or name[-1] == "_":
+        return name + "_"
+    return name
+
+
+# the name such as "@x" of a Python name
+def program_name(name):
+    if len(name) > 1 and name[-1] == "_" and python_name("@" + name[:-1]) == name:
+        return "@" + name[:-1]
+    return "@" + name
+
+
+# the message of a missing name, or of a wrong number of arguments, in
+# generated code
+arity_error = re.compile(
+    r"^(?:\w+\.<locals>\.)*(\w+)\(\) "
+    r"(takes \d+ positional arguments? but \d+ (was|were) given|missing \d+ required positional arguments?)"
+)
+unbound_error = re.compile(r"local variable '(\w+)'")
+
+
+# the evaluator's error for a Python error raised by the code of module,
+# or None if the error means the same in both
+def program_error(error, module):
+    if isinstance(error, NameError):
+        name = error.name
+        if name == None:
+            match = unbound_error.search(str(error))
+            if match == None:
+                return None
+            name = match.group(1)
+        return Exception(f"Unknown name {program_name(name)[1:]}")
+    if isinstance(error, TypeError):
+        match = arity_error.match(str(error))
+        if match != None:
+            # the call is the last frame; a function from the environment
+            # keeps its own error
+            traceback = error.__traceback__
+            while traceback.tb_next != None:
+                traceback = traceback.tb_next
+            frame = traceback.tb_frame
+            name = match.group(1)
+            function = frame.f_locals.get(name, frame.f_globals.get(name))
+            if getattr(function, "__globals__", None) is module.__dict__:
+                return Exception(f"Wrong number of arguments to {program_name(name)[1:]}")
+    return None
+
+
+# the names an expression reads, not counting function bodies
+def read_names(node, names):
+    if not isinstance(node, dict_types):
+        return names
+    t = node["type"]
+    if t == "reference":
+        names.append(node["name"])
+        for index in node.get("indexes", []):
+            if not is_field(index):
+                read_names(index, names)
+    elif t == "binary":
+        read_names(node["left"], names)
+        read_names(node["right"], names)
+    elif t == "unary":
+        read_names(node["expression"], names)
+    elif t in ["function_call", "array-expression"]:
+        if t == "function_call":
+            read_names(node["reference"], names)
+        for expression in node["expressions"]:
+            read_names(expression, names)
+    return names
+
+
+# names of a function body that may be read before the function assigns
+# them, and so must start from the global of the same name. assignments
+# inside if and while statements are not counted as certain.
+def fallback_names(statements, local_names, assigned, certain, fallbacks):
+    def reads(node):
+        for name in read_names(node, []):
+            if name in local_names and name not in assigned and name not in fallbacks:
+                fallbacks.append(name)
+
+    for statement in statements:
+        t = statement["type"] if isinstance(statement, dict_types) else None
+        if t == "assignment":
+            reads(statement["expression"])
+            reference = statement["reference"]
+            if "indexes" in reference:
+                reads(reference)
+            elif certain:
+                assigned.add(reference["name"])
+        elif t == "function_declaraction":
+            if certain:
+                assigned.add(statement["name"])
+        elif t == "block":
+            fallback_names(statement["statements"], local_names, assigned, certain, fallbacks)
+        elif t == "if":
+            reads(statement["condition"])
+            branches = [statement["then"]] + ([statement["else"]] if statement["else"] != None else [])
+            fallback_names(branches, local_names, assigned, False, fallbacks)
+        elif t == "while":
+            reads(statement["condition"])
+            fallback_names([statement["do"]], local_names, assigned, False, fallbacks)
+        elif t == "print":
+            for expression in statement["expression_list"]["expressions"]:
+                reads(expression)
+        elif t in ["return", "exit"]:
+            reads(statement["expression"])
+        else:
+            reads(statement)
+    return fallbacks
+
+
+class Transpiler:
+    def __init__(this):
+        this.lines = []
+        this.depth = 0
+
+    def emit(this, line):
+        this.lines.append("    " * this.depth + line)
+
+    def expression(this, node):
+        if not isinstance(node, dict_types):
+            return repr(node)
+        t = node["type"]
+        if t == "reference":
+            text = python_name(node["name"])
+            for index in node.get("indexes", []):
+                if is_field(index):
+                    text = f"_get_index({text}, {index!r})"
+                else:
+                    text = f"{text}[{this.expression(index)}]"
+            return text
+        if t == "binary":
+            operator = node["operator"]
+            left = this.operand(node["left"], operator, False)
+            right = this.operand(node["right"], operator, True)
+            return f"{left} {operator} {right}"
+        if t == "unary":
+            assert node["operator"] == "-", f"Unknown operator {node['operator']}"
+            return f"-{this.operand(node['expression'], None, True)}"
+        if t == "function_call":
+            arguments = ", ".join(this.expression(e) for e in node["expressions"])
+            return f"{this.expression(node['reference'])}({arguments})"
+        if t == "array-expression":
+            return "[" + ", ".join(this.expression(e) for e in node["expressions"]) + "]"
+        raise Exception(f"Unknown content in AST={node}")
+
+    # an operand of an operator (None for unary minus), in parentheses
+    # where the precedence needs them. Python chains comparisons, so a
+    # comparison inside a comparison is always in parentheses.
+    def operand(this, node, operator, right):
+        if isinstance(node, dict_types) and node["type"] == "binary":
+            inner = binding_powers[node["operator"]]
+            outer = binding_powers[operator] if operator != None else unary_power
+            if inner < outer or (right and inner == outer) or (inner <= 2 and outer <= 2):
+                return f"({this.expression(node)})"
+        return this.expression(node)
+
+    def body(this, statements, in_function):
+        this.depth += 1
+        start = len(this.lines)
+        for statement in statements:
+            this.statement(statement, in_function)
+        if len(this.lines) == start:
+            this.emit("pass")
+        this.depth -= 1
+
+    def statement(this, node, in_function):
+        t = node["type"] if isinstance(node, dict_types) else None
+        if t not in statement_types:
+            # an expression used as a statement
+            this.emit(this.expression(node))
+        elif t in ["program", "block"]:
+            for statement in node["statements"]:
+                this.statement(statement, in_function)
+        elif t == "assignment":
+            reference = node["reference"]
+            value = this.expression(node["expression"])
+            indexes = reference.get("indexes", [])
+            if indexes == []:
+                this.emit(f"{python_name(reference['name'])} = {value}")
+                return
+            container = this.expression({"type": "reference", "name": reference["name"], "indexes": indexes[:-1]})
+            index = indexes[-1]
+            index = repr(index) if is_field(index) else this.expression(index)
+            this.emit(f"_set_index({container}, {index}, {value})")
+        elif t == "if":
+            this.emit(f"if {this.expression(node['condition'])}:")
+            this.body([node["then"]], in_function)
+            if node["else"] != None:
+                this.emit("else:")
+                this.body([node["else"]], in_function)
+        elif t == "while":
+            this.emit(f"while {this.expression(node['condition'])}:")
+            this.body([node["do"]], in_function)
+        elif t == "print":
+            expressions = node["expression_list"]["expressions"]
+            this.emit("print(" + ", ".join(this.expression(e) for e in expressions) + ")")
+        elif t == "return":
+            if in_function:
+                this.emit(f"return {this.expression(node['expression'])}")
+            else:
+                this.emit('raise Exception("Return outside of a function")')
+        elif t == "exit":
+            this.emit(f"raise _Exit({this.expression(node['expression'])})")
+        elif t == "function_declaraction":
+            this.function(node, in_function)
+
+    def function(this, node, nested):
+        parameters = node["parameters"]
+        statements = node["block"]["statements"]
+        local_names = list(parameters)
+        for name in assigned_names(statements, []):
+            if name not in local_names:
+                local_names.append(name)
+        this.emit(f"def {python_name(node['name'])}({', '.join(python_name(p) for p in parameters)}):")
+        this.depth += 1
+        if nested:
+            # read other names from the globals, not from the enclosing function
+            others = [name for name in this.function_reads(statements) if name not in local_names]
+            if others:
+                this.emit("global " + ", ".join(python_name(name) for name in others))
+        for name in fallback_names(statements, local_names, set(parameters), True, []):
+            this.emit(f"if {python_name(name)!r} in globals(): {python_name(name)} = globals()[{python_name(name)!r}]")
+        this.depth -= 1
+        this.body(statements, True)
+
+    # every name a function body reads, not counting nested functions
+    def function_reads(this, statements):
+        names = []
+        for statement in statements:
+            t = statement["type"] if isinstance(statement, dict_types) else None
+            if t in ["program", "block"]:
+                names += this.function_reads(statement["statements"])
+            elif t == "assignment":
+                read_names(statement["expression"], names)
+                read_names(statement["reference"], names)
+            elif t == "if":
+                read_names(statement["condition"], names)
+                names += this.function_reads([statement["then"]])
+                if statement["else"] != None:
+                    names += this.function_reads([statement["else"]])
+            elif t == "while":
+                read_names(statement["condition"], names)
+                names += this.function_reads([statement["do"]])
+            elif t == "print":
+                for expression in statement["expression_list"]["expressions"]:
+                    read_names(expression, names)
+            elif t in ["return", "exit"]:
+                read_names(statement["expression"], names)
+            elif t not in statement_types:
+                read_names(statement, names)
+        unique = []
+        for name in names:
+            if name not in unique:
+                unique.append(name)
+        return unique
+
+
+def transpile(ast, name="<program>"):
+    transpiler = Transpiler()
+    statements = ast["statements"]
+    names = []
+    for assigned in assigned_names(statements, []):
+        if assigned not in names:
+            names.append(assigned)
+    transpiler.lines += [
+        f"# generated from {name} by transpiler.py",
+        "",
+        helper_imports,
+        "",
+        "# the Python names of the program's top-level names",
+        "_names = {" + ", ".join(f"{python_name(n)!r}: {n!r}" for n in names) + "}",
+        "",
+        "",
+        "def _program():",
+    ]
+    transpiler.depth = 1
+    if names:
+        transpiler.emit("global " + ", ".join(python_name(n) for n in names))
+    transpiler.depth = 0
+    transpiler.body(statements, False)
+    return "\n".join(transpiler.lines) + "\n"
+
+
+# run a transpiled module; returns the value given to exit(), or None.
+# the program's globals are read from and written back to environment.
+def run_module(module, environment=None):
+    if environment == None:
+        environment = {}
+    for python, name in module._names.items():
+        if hasattr(module, python):
+            delattr(module, python)
+    for name, value in environment.items():
+        setattr(module, python_name(name), value)
+    try:
+        module._program()
+    except Exit as result:
+        return result.value
+    except (NameError, TypeError) as error:
+        translated = program_error(error, module)
+        if translated == None:
+            raise
+        raise translated from None
+    finally:
+        for python, name in module._names.items():
+            if hasattr(module, python):
+                environment[name] = getattr(module, python)
+    return None
+
+
+language_hash = None
+
+
+# a hash of the code that turns source into a Python module: the
+# tokenizer and parser, and the transpiler with the bytecode helpers it
+# uses
+def language_version():
+    global language_hash
+    if language_hash == None:
+        digest = hashlib.sha256(cache.language_version())
+        directory = os.path.dirname(os.path.abspath(__file__))
+        for name in ["bytecode.py", "transpiler.py"]:
+            with open(os.path.join(directory, name), "rb") as f:
+                digest.update(f.read())
+        language_hash = digest.digest()
+    return language_hash
+
+
+def module_path(path, source, directory=None):
+    if directory == None:
+        directory = os.path.join(os.path.dirname(os.path.abspath(path)), "__tcache__")
+    key = hashlib.sha256(language_version() + source).hexdigest()[:32]
+    name = "".join(c if c.isalnum() else "_" for c in os.path.splitext(os.path.basename(path))[0])
+    return os.path.join(directory, f"t_{name}_{key}.py")
+
+
+# remove the least recently used modules, with their .pyc files, until
+# the modules and .pyc files in the directory fit in max_size
+def evict(directory, max_size):
+    compiled = {}
+    pycache = os.path.join(directory, "__pycache__")
+    if os.path.isdir(pycache):
+        for entry in os.scandir(pycache):
+            if entry.name.startswith("t_") and entry.name.endswith(".pyc"):
+                compiled.setdefault(entry.name.split(".")[0], []).append(entry)
+    entries = []
+    for entry in os.scandir(directory):
+        if entry.name.startswith("t_") and entry.name.endswith(".py"):
+            try:
+                status = entry.stat()
+                paths = [entry.path]
+                size = status.st_size
+                for pyc in compiled.get(entry.name[:-3], []):
+                    paths.append(pyc.path)
+                    size += pyc.stat().st_size
+            except OSError:
+                continue
+            entries.append((status.st_mtime, size, paths))
+    cache.remove_oldest(entries, max_size)
+
+
+# the module of a script, transpiled and written to the cache if it is
+# not there yet. like cache.load_program, the cache keeps at most
+# max_size bytes (cache.max_cache_size by default) of recently used
+# modules.
+def load_module(path, directory=None, max_size=None):
+    with open(path, "rb") as f:
+        source = f.read()
+    python_file = module_path(path, source, directory)
+    if os.path.exists(python_file):
+        # mark the module as recently used
+        try:
+            os.utime(python_file)
+        except OSError:
+            pass
+    else:
+        code = transpile(parse(tokenize(source.decode("utf-8"))), os.path.basename(path))
+        os.makedirs(os.path.dirname(python_file), exist_ok=True)
+        handle, temporary = tempfile.mkstemp(dir=os.path.dirname(python_file), suffix=".tmp")
+        try:
+            with os.fdopen(handle, "w") as f:
+                f.write(code)
+            os.replace(temporary, python_file)
+        except BaseException:
+            os.remove(temporary)
+            raise
+        evict(os.path.dirname(python_file), cache.max_cache_size if max_size == None else max_size)
+    name = os.path.splitext(os.path.basename(python_file))[0]
+    specification = importlib.util.spec_from_file_location(name, python_file)
+    module = importlib.util.module_from_spec(specification)
+    specification.loader.exec_module(module)
+    return module
+
+
+def test_transpile():
+    print("testing transpile")
+    source = 'x = [1, 2]; x[x.length] = -(3 - 4); function f(def) { return (def * 2) }; print(f(x[2]), "a")'
+    assert transpile(parse(tokenize(source))) == "\n".join(
+        [
+            "# generated from <program> by transpiler.py",
+            "",
+            helper_imports,
+            "",
+            "# the Python names of the program's top-level names",
+            "_names = {'x': '@x', 'f': '@f'}",
+            "",
+            "",
+            "def _program():",
+            "    global x, f",
+            "    x = [1, 2]",
+            "    _set_index(x, _get_index(x, '@length'), -(3 - 4))",
+            "    def f(def_):",
+            "        return def_ * 2",
+            "    print(f(x[2]), 'a')",
+            "",
+        ]
+    )
+
+
+def test_run_module():
+    print("testing run module")
+    import contextlib
+    import io
+    import types
+    from evaluator import test_programs
+
+    def module_of(source):
+        module = types.ModuleType("program")
+        exec(transpile(parse(tokenize(source))), module.__dict__)
+        return module
+
+    for source, expected in test_programs + [
+        (
+            "x = 1 - 2 - (3 - 4) * -(5 * 6) / (7 * 8); print(x, x < 1 == (2 > 3), (x == 1) == 0, 8 / 4 / 2, 8 - (4 - 2))",
+            "-1.5357142857142856 False True 1.0 6\n",
+        ),
+        ("globals = 1; _x = 2; y_ = 3; def = globals + _x + y_; print(def)", "6\n"),
+        ("x = 1; function f() { function g() { return (x) }; x = 2; return (g()) }; print(f())", "1\n"),
+        ("function f() { while (0) { } ; if (1) { } else { } }; print(f())", "None\n"),
+    ]:
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            run_module(module_of(source))
+        assert output.getvalue() == expected, source
+    environment = {"@double": lambda x: x * 2}
+    module = module_of("x = double(2); exit(x + 1)")
+    assert run_module(module, environment) == 5
+    assert environment["@x"] == 4
+    # a module can be run again from a clean start
+    assert run_module(module, {"@double": lambda x: x}) == 3
+    # errors are the evaluator's
+    from evaluator import evaluate
+
+    for source in [
+        "print(y)",
+        "function f() { return (z) }; f()",
+        "function f() { if (0) { z = 1 }; return (z) }; f()",
+        "function f(a) { }; f()",
+        "function f(a) { }; f(1, 2)",
+        "function f() { function def(a) { }; def() }; f()",
+        "return (1)",
+    ]:
+        messages = []
+        for run in [lambda: evaluate(parse(tokenize(source))), lambda: run_module(module_of(source))]:
+            try:
+                run()
+                raise Exception("An error was expected.")
+            except Exception as error:
+                messages.append(str(error).split("\n")[0])
+        assert messages[0] == messages[1] and "An error was expected." not in messages[0], (source, messages)
+    assert program_name("def_") == "@def" and program_name("x_") == "@x_" and program_name("_") == "@_"
+
+
+def test_load_module():
+    print("testing load module")
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "my-program.t")
+        with open(path, "w") as f:
+            f.write("function sq(x) { return (x * x) }; exit(sq(7))")
+        module = load_module(path)
+        assert run_module(module) == 49
+        cached = [name for name in os.listdir(os.path.join(directory, "__tcache__")) if name.endswith(".py")]
+        assert len(cached) == 1 and cached[0].startswith("t_my_program_") and cached[0].endswith(".py")
+        # the cached module is used as it is
+        python_file = os.path.join(directory, "__tcache__", cached[0])
+        with open(python_file, "a") as f:
+            f.write("_names['cached'] = True\n")
+        assert load_module(path)._names["cached"] == True
+        # an edited script gets a new module
+        with open(path, "a") as f:
+            f.write("; print(1)")
+        assert "cached" not in load_module(path)._names
+    # the least recently used modules are removed, with their .pyc files
+    with tempfile.TemporaryDirectory() as directory:
+        paths = []
+        for n in range(3):
+            paths.append(os.path.join(directory, f"p{n}.t"))
+            with open(paths[n], "w") as f:
+                f.write(f"exit({n})")
+        for n, path in enumerate(paths):
+            assert run_module(load_module(path, max_size=10**6)) == n
+        cache_directory = os.path.join(directory, "__tcache__")
+        modules = sorted(name for name in os.listdir(cache_directory) if name.endswith(".py"))
+        pycache = os.path.join(cache_directory, "__pycache__")
+
+        def compiled(name):
+            return [p for p in os.listdir(pycache) if p.split(".")[0] == name[:-3]] if os.path.isdir(pycache) else []
+
+        sizes = {}
+        for name in modules:
+            sizes[name] = os.path.getsize(os.path.join(cache_directory, name))
+            sizes[name] += sum(os.path.getsize(os.path.join(pycache, p)) for p in compiled(name))
+        for n, name in enumerate(modules):
+            os.utime(os.path.join(cache_directory, name), (n, n))
+        # using the oldest module makes it the newest
+        first = load_module(paths[0], max_size=10**6).__name__ + ".py"
+        with open(os.path.join(directory, "p3.t"), "w") as f:
+            f.write("exit(3)")
+        assert run_module(load_module(os.path.join(directory, "p3.t"), max_size=sum(sizes.values()))) == 3
+        left = [name for name in os.listdir(cache_directory) if name.endswith(".py")]
+        assert first in left and len(left) < 4
+        for name in modules:
+            if name not in left:
+                assert compiled(name) == []
+
+
+if __name__ == "__main__":
+    test_transpile()
+    test_run_module()
+    test_load_module()
+    print("done.")
@@ -0,0 +1,34 @@
+# performance measurements for the tokenizer
+#
+# run with `python benchmark.py`
+
+import time
+
+import tokenizer
+
+sample = 'x = [1, 2.5, 3]; while (x <= 10) { print "x is ""big"""; x = x + 1 }\n'
+
+
+def timed(function, *arguments):
+    start = time.perf_counter()
+    result = function(*arguments)
+    return result, time.perf_counter() - start
+
+
+def benchmark_tokenize():
+    print("benchmark: tokenize")
+    print("  copies   pattern scan     dfa scan   dfa chars/sec")
+    for copies in [25, 50, 100, 200, 400, 3200]:
+        source = sample * copies
+        tokens, dfa_time = timed(tokenizer.tokenize, source)
+        if copies <= 400:
+            reference, pattern_time = timed(tokenizer.tokenize_by_patterns, source)
+            assert reference == tokens
+            pattern = f"{pattern_time:10.4f} s"
+        else:
+            pattern = "   (skipped)"
+        print(f"  {copies:6d} {pattern} {dfa_time:10.4f} s {len(source) / dfa_time:12.0f}")
+
+
+if __name__ == "__main__":
+    benchmark_tokenize()
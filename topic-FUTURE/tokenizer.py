@@ -1,36 +1,276 @@
 import re
 
+token_patterns = [
+    (r'\s+', None),                      # Whitespace
+    (r'[0-9]+(\.[0-9]+)?', "number"),    # Numbers
+    (r'\+', "+"),                        # Plus operator
+    (r'-', "-"),                         # Minus operator
+    (r'\*', "*"),                        # Multiplication operator
+    (r'/', "/"),                         # Division operator
+    (r'\(', "("),                        # Left parenthesis
+    (r'\)', ")"),                        # Right parenthesis
+    (r'{', "{"),                         # Left brace
+    (r'}', "}"),                         # Right brace
+    (r';', ";"),                         # Semicolon
+    (r'print', "print"),                 # print keyword
+    (r'if', "if"),                       # if keyword
+    (r'else', "else"),                   # else keyword
+    (r'while', "while"),                 # while keyword
+    (r'==', "=="),                       # Equality operator
+    (r'!=', "!="),                       # Inequality operator
+    (r'<=', "<="),                       # Less than or equal to operator
+    (r'>=', ">="),                       # Greater than or equal to operator
+    (r'<', "<"),                         # Less than operator
+    (r'>', ">"),                         # Greater than operator
+    (r'=', "="),                         # Assignment operator
+    (r'\[', "["),                        # Left square bracket
+    (r'\]', "]"),                        # Right square bracket
+    (r',', ","),                         # Comma
+    (r'"([^"]|"")*"', "string"),         # String literals
+    (r'[a-zA-Z_][a-zA-Z0-9_]*', "identifier"),  # Identifiers
+]
+
+### DFA construction
+#
+# The patterns above are compiled once, at import time, into a single
+# deterministic automaton. Characters are first mapped to character
+# classes (characters that no pattern tells apart share a class), so the
+# transition table has one row per state and one column per class.
+
+# every ASCII character stands for itself; all other characters are
+# represented by one of these two symbols
+OTHER = "other"
+OTHER_SPACE = "other space"
+symbols = [chr(code) for code in range(128)] + [OTHER, OTHER_SPACE]
+
+
+escapes = {"s": {s for s in symbols if s == OTHER_SPACE or re.match(r"\s", s)}}
+
+
+# the nondeterministic automaton: each state has a list of
+# (symbol set, target) transitions, where a symbol set of None is
+# an epsilon transition
+class NFA:
+    def __init__(this):
+        this.transitions = []
+        this.accepts = {}
+
+    def state(this):
+        this.transitions.append([])
+        return len(this.transitions) - 1
+
+    def link(this, source, target, symbol_set=None):
+        this.transitions[source].append((symbol_set, target))
+
+
+# build the states for a regular expression using the subset of the
+# syntax that appears in token_patterns, returning (start, end) states
+def compile_regex(nfa, regex):
+    position = 0
+
+    def peek():
+        return regex[position] if position < len(regex) else None
+
+    def next_character():
+        nonlocal position
+        position += 1
+        return regex[position - 1]
+
+    def single(symbol_set):
+        start, end = nfa.state(), nfa.state()
+        nfa.link(start, end, frozenset(symbol_set))
+        return start, end
+
+    def character_class():
+        negated = peek() == "^"
+        if negated:
+            next_character()
+        members = set()
+        while peek() != "]":
+            low = next_character()
+            if peek() == "-" and regex[position + 1] != "]":
+                next_character()
+                high = next_character()
+                members.update(chr(code) for code in range(ord(low), ord(high) + 1))
+            else:
+                members.add(low)
+        next_character()
+        if negated:
+            return {s for s in symbols if s not in members}
+        return members
+
+    def atom():
+        character = next_character()
+        if character == "(":
+            fragment = alternation()
+            assert next_character() == ")"
+            return fragment
+        if character == "[":
+            return single(character_class())
+        if character == "\\":
+            character = next_character()
+            return single(escapes.get(character, {character}))
+        return single({character})
+
+    def repetition():
+        start, end = atom()
+        while peek() in ["*", "+", "?"]:
+            operator = next_character()
+            new_start, new_end = nfa.state(), nfa.state()
+            nfa.link(new_start, start)
+            nfa.link(end, new_end)
+            if operator in ["*", "?"]:
+                nfa.link(new_start, new_end)
+            if operator in ["*", "+"]:
+                nfa.link(end, start)
+            start, end = new_start, new_end
+        return start, end
+
+    def concatenation():
+        start = end = nfa.state()
+        while peek() not in [None, "|", ")"]:
+            fragment_start, fragment_end = repetition()
+            nfa.link(end, fragment_start)
+            end = fragment_end
+        return start, end
+
+    def alternation():
+        start, end = nfa.state(), nfa.state()
+        while True:
+            fragment_start, fragment_end = concatenation()
+            nfa.link(start, fragment_start)
+            nfa.link(fragment_end, end)
+            if peek() != "|":
+                return start, end
+            next_character()
+
+    fragment = alternation()
+    assert position == len(regex), f"Unsupported pattern {regex}"
+    return fragment
+
+
+def epsilon_closure(nfa, states):
+    closure = set(states)
+    stack = list(states)
+    while stack:
+        for symbol_set, target in nfa.transitions[stack.pop()]:
+            if symbol_set == None and target not in closure:
+                closure.add(target)
+                stack.append(target)
+    return frozenset(closure)
+
+
+# build the scanner tables from a list of (regex, tag) patterns. returns
+# the class of each symbol, the transition table (-1 for no transition),
+# and for each state the set of patterns that accept there.
+def build_dfa(patterns):
+    nfa = NFA()
+    start = nfa.state()
+    for index, (regex, tag) in enumerate(patterns):
+        fragment_start, fragment_end = compile_regex(nfa, regex)
+        nfa.link(start, fragment_start)
+        nfa.accepts[fragment_end] = index
+
+    # symbols that belong to the same symbol sets share a class
+    symbol_sets = sorted(
+        {symbol_set for row in nfa.transitions for symbol_set, target in row if symbol_set},
+        key=sorted,
+    )
+    signatures = {}
+    classes = {}
+    for s in symbols:
+        signature = tuple(s in symbol_set for symbol_set in symbol_sets)
+        classes[s] = signatures.setdefault(signature, len(signatures))
+    representatives = {number: s for s, number in reversed(list(classes.items()))}
+
+    # subset construction
+    initial = epsilon_closure(nfa, [start])
+    states = {initial: 0}
+    work = [initial]
+    table = []
+    accepts = []
+    while work:
+        current = work.pop(0)
+        row = []
+        for number in range(len(signatures)):
+            s = representatives[number]
+            targets = [
+                target
+                for state in current
+                for symbol_set, target in nfa.transitions[state]
+                if symbol_set and s in symbol_set
+            ]
+            if targets == []:
+                row.append(-1)
+                continue
+            following = epsilon_closure(nfa, targets)
+            if following not in states:
+                states[following] = len(states)
+                work.append(following)
+            row.append(states[following])
+        table.append(row)
+        accepts.append(frozenset(nfa.accepts[state] for state in current if state in nfa.accepts))
+    return classes, table, accepts
+
+
+symbol_classes, dfa_table, dfa_accepts = build_dfa(token_patterns)
+ascii_classes = [symbol_classes[chr(code)] for code in range(128)]
+other_class = symbol_classes[OTHER]
+other_space_class = symbol_classes[OTHER_SPACE]
+
+
+def make_token(tag, value):
+    if tag == "number":
+        return ["number", float(value) if '.' in value else int(value)]
+    if tag == "string":
+        # Replacing doubled quotes with a solitary quote mark
+        return ["string", value[1:-1].replace('""', '"')]
+    return value
+
+
+# Scan with the DFA. As with trying the patterns in order, the first
+# pattern in the list that matches at a position wins, and it takes
+# its longest match.
 def tokenize(source_code):
-    token_patterns = [
-        (r'\s+', None),                      # Whitespace
-        (r'[0-9]+(\.[0-9]+)?', "number"),    # Numbers
-        (r'\+', "+"),                        # Plus operator
-        (r'-', "-"),                         # Minus operator
-        (r'\*', "*"),                        # Multiplication operator
-        (r'/', "/"),                         # Division operator
-        (r'\(', "("),                        # Left parenthesis
-        (r'\)', ")"),                        # Right parenthesis
-        (r'{', "{"),                         # Left brace
-        (r'}', "}"),                         # Right brace
-        (r';', ";"),                         # Semicolon
-        (r'print', "print"),                 # print keyword
-        (r'if', "if"),                       # if keyword
-        (r'else', "else"),                   # else keyword
-        (r'while', "while"),                 # while keyword
-        (r'==', "=="),                       # Equality operator
-        (r'!=', "!="),                       # Inequality operator
-        (r'<=', "<="),                       # Less than or equal to operator
-        (r'>=', ">="),                       # Greater than or equal to operator
-        (r'<', "<"),                         # Less than operator
-        (r'>', ">"),                         # Greater than operator
-        (r'=', "="),                         # Assignment operator
-        (r'\[', "["),                        # Left square bracket
-        (r'\]', "]"),                        # Right square bracket
-        (r',', ","),                         # Comma
-        (r'"([^"]|"")*"', "string"),         # String literals
-        (r'[a-zA-Z_][a-zA-Z0-9_]*', "identifier"),  # Identifiers
-    ]
+    tokens = []
+    i = 0
+    length = len(source_code)
+    while i < length:
+        state = 0
+        pos = i
+        best = -1
+        end = i
+        while pos < length:
+            character = source_code[pos]
+            code = ord(character)
+            if code < 128:
+                state = dfa_table[state][ascii_classes[code]]
+            elif character.isspace():
+                state = dfa_table[state][other_space_class]
+            else:
+                state = dfa_table[state][other_class]
+            if state < 0:
+                break
+            pos += 1
+            accepted = dfa_accepts[state]
+            if accepted:
+                first = min(accepted)
+                if best < 0 or first < best:
+                    best = first
+                    end = pos
+                elif best in accepted:
+                    end = pos
+        if best < 0:
+            raise Exception(f"Invalid token at position {i}")
+        tag = token_patterns[best][1]
+        if tag:  # Only add non-whitespace tokens
+            tokens.append(make_token(tag, source_code[i:end]))
+        i = end
+    return tokens
+
 
+# The original scanner, trying each pattern in turn at every position
+def tokenize_by_patterns(source_code):
     tokens = []
     i = 0
     while i < len(source_code):
@@ -53,9 +293,47 @@ def tokenize(source_code):
                 break
         if not matched:
             raise Exception(f"Invalid token at position {i}")
-    
+
     return tokens
 
 # Example usage:
 source_code = 'print "Hello, World!"; x = "Say ""hi"" again";'
 print(tokenize(source_code))
+
+
+def test_dfa_tokenize():
+    print("testing dfa tokenize")
+    examples = [
+        source_code,
+        "x = [1, 2.5, 3]; while (x <= 10) { x = x + 1 }",
+        'if (a != b) print "café ☃"; else { y[0] = -3 * (4 / 2) }',
+        "printer iffy elsewhere == >= > < = ,",
+        '"" """" "a""b" "multi\nline"',
+        " x =\t1\n",
+    ]
+    for example in examples:
+        assert tokenize(example) == tokenize_by_patterns(example), example
+    for invalid in ["x = 1 ? 2", 'x = "unterminated', "x = café", "x = 1 !", "3."]:
+        messages = []
+        for scanner in [tokenize, tokenize_by_patterns]:
+            try:
+                scanner(invalid)
+            except Exception as error:
+                messages.append(str(error))
+        assert len(messages) == 2 and messages[0] == messages[1], messages
+
+
+def test_character_classes():
+    print("testing character classes")
+    # letters that only identifiers accept share one class
+    assert symbol_classes["q"] == symbol_classes["Z"]
+    assert symbol_classes["p"] != symbol_classes["q"]
+    assert symbol_classes["0"] == symbol_classes["9"]
+    assert symbol_classes[OTHER] != symbol_classes[OTHER_SPACE]
+    assert len(set(symbol_classes.values())) < 50
+
+
+if __name__ == "__main__":
+    test_dfa_tokenize()
+    test_character_classes()
+    print("done.")